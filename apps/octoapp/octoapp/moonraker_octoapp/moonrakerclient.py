@@ -1010,7 +1010,8 @@ class MoonrakerCompat:
             {
                 "objects": {
                     "print_stats": None,
-                    "gcode_move": None
+                    "gcode_move": None,
+                    "virtual_sdcard": None
                 }
             })
             if result.HasError():
@@ -1020,6 +1021,8 @@ class MoonrakerCompat:
             res = result.GetResult()
             printStats = res["status"]["print_stats"]
             gcodeMove = res["status"]["gcode_move"]
+            # The virtual_sdcard layer fields come from its gcode file index, they are None until the index is built.
+            virtualSdCard = res["status"].get("virtual_sdcard", {})
 
             # Get the file name, required for looking up layer info.
             if "filename" not in printStats:
@@ -1039,6 +1042,8 @@ class MoonrakerCompat:
             totalLayers = 0
             if "info" in printStats and "total_layer" in printStats["info"] and printStats["info"]["total_layer"] is not None:
                 totalLayers = int(printStats["info"]["total_layer"])
+            if totalLayers == 0 and virtualSdCard.get("layer_count") is not None:
+                totalLayers = int(virtualSdCard["layer_count"])
             if totalLayers == 0 and layerCount > 0:
                 totalLayers = int(layerCount)
             if totalLayers == 0 and firstLayerHeight > 0 and layerHeight > 0 and objectHeight > 0:
@@ -1053,6 +1058,8 @@ class MoonrakerCompat:
             currentLayer = -1
             if "info" in printStats and "current_layer" in printStats["info"] and printStats["info"]["current_layer"] is not None:
                 currentLayer = int(printStats["info"]["current_layer"])
+            if currentLayer == -1 and virtualSdCard.get("current_layer") is not None:
+                currentLayer = int(virtualSdCard["current_layer"])
             if currentLayer == -1 and firstLayerHeight > 0 and layerHeight > 0 and "gcode_position" in gcodeMove and len(gcodeMove["gcode_position"]) > 2:
                 # Note that we need to check print_duration before checking this, because print duration will only start going after the hotend is in print position.
                 # If we take the zAxisPosition before that, the z axis might be up in a pre-print position, and we will get the wrong value.
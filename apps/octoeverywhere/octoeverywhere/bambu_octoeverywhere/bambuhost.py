@@ -137,6 +137,7 @@ class BambuHost:
             self.NotificationHandler = NotificationsHandler(self.Logger, stateTranslator)
             self.NotificationHandler.SetPrinterId(printerId)
             self.NotificationHandler.SetBedCooldownThresholdTemp(self.Config.GetFloat(Config.GeneralSection, Config.GeneralBedCooldownThresholdTempC, Config.GeneralBedCooldownThresholdTempCDefault))
+            self.NotificationHandler.SetSnapshotMaxAgeSec(self.Config.GetFloat(Config.GeneralSection, Config.GeneralNotificationSnapshotMaxAgeSec, Config.GeneralNotificationSnapshotMaxAgeSecDefault))
             stateTranslator.SetNotificationHandler(self.NotificationHandler)
 
             # Setup the command handler
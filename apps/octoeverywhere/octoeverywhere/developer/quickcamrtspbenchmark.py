@@ -0,0 +1,148 @@
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import argparse
+
+#
+# A benchmark for the QuickCam RTSP image parsing.
+#
+# QuickCam_RTSP reads the jpeg images ffmpeg writes to stdout and splits them into images. This feeds recorded ffmpeg output
+# through a pipe, at the stream's fps, and reports how much cpu the image parsing takes.
+#
+# To record ffmpeg output, use the same output options QuickCam uses:
+#    ffmpeg -i rtsp://<camera> -filter:v fps=15 -t 30 -f image2pipe recording.mjpeg
+#
+# Usage, from the repo root:
+#    python3 developer/quickcamrtspbenchmark.py --file recording.mjpeg           - Feeds the recording at 15 fps for 10 seconds.
+#    python3 developer/quickcamrtspbenchmark.py --file recording.mjpeg --fps 0   - Feeds the recording as fast as possible.
+#    python3 developer/quickcamrtspbenchmark.py --framekb 300                    - Feeds generated 300KB images, if there's no recording.
+#
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+from octoeverywhere.sentry import Sentry
+from octoeverywhere.Webcam.quickcam import QuickCam_RTSP
+
+
+# Makes images that look like ffmpeg's output, a jpeg start, a comment segment, and random scan data with the 0xff bytes stuffed.
+def MakeImages(frameKb:int, count:int = 8) -> list:
+    images = []
+    for _ in range(count):
+        scanData = os.urandom(frameKb * 1024).replace(b"\xff", b"\xff\x00")
+        images.append(b"\xff\xd8\xff\xfe\x00\x10Lavc60.31.102\x00\xff\xda" + scanData + b"\xff\xd9")
+    return images
+
+
+# Splits recorded ffmpeg output into images.
+def ReadImages(filePath:str) -> list:
+    with open(filePath, "rb") as f:
+        data = f.read()
+    images = []
+    start = 0
+    while True:
+        end = data.find(b"\xff\xd9", start)
+        if end == -1:
+            break
+        images.append(data[start:end + 2])
+        start = end + 2
+    return images
+
+
+# Writes the images to stdout like ffmpeg, run in its own process so it's not counted in the cpu time.
+# Ffmpeg writes through a 32KB io buffer, and on a busy device the writes are spread out, so the reads don't line up with the images.
+def Feed(filePath:str, frameKb:int, fps:float, seconds:float, chunkDelayMs:float):
+    # Exit quietly when QuickCam stops us like it stops ffmpeg.
+    signal.signal(signal.SIGINT, lambda *_: os._exit(0))
+    images = ReadImages(filePath) if filePath else MakeImages(frameKb)
+    out = sys.stdout.buffer
+    start = time.time()
+    sent = 0
+    while time.time() - start < seconds:
+        image = images[sent % len(images)]
+        for offset in range(0, len(image), 32 * 1024):
+            out.write(image[offset:offset + 32 * 1024])
+            out.flush()
+            if chunkDelayMs > 0:
+                time.sleep(chunkDelayMs / 1000.0)
+        sent += 1
+        if fps > 0:
+            wait = start + sent / fps - time.time()
+            if wait > 0:
+                time.sleep(wait)
+    # Keep the pipe open until we are stopped, so the reader doesn't see the end of the stream.
+    while True:
+        time.sleep(1)
+
+
+def RunBenchmark(filePath:str, frameKb:int, fps:float, seconds:float, chunkDelayMs:float) -> dict:
+    logger = logging.getLogger("quickcamrtspbenchmark")
+    logger.setLevel(logging.ERROR)
+    logger.addHandler(logging.StreamHandler())
+    Sentry.SetLogger(logger)
+
+    images = ReadImages(filePath) if filePath else MakeImages(frameKb)
+    avgImageBytes = sum(len(i) for i in images) / len(images)
+
+    args = [sys.executable, os.path.abspath(__file__), "--feed", "--fps", str(fps), "--seconds", str(seconds), "--chunkms", str(chunkDelayMs)]
+    if filePath:
+        args += ["--file", filePath]
+    else:
+        args += ["--framekb", str(frameKb)]
+
+    imageCount = 0
+    imageBytes = 0
+    rtsp = QuickCam_RTSP(logger)
+    with rtsp:
+        # pylint: disable=protected-access
+        rtsp._StartProcess(args)
+        cpuStart = time.process_time()
+        start = time.time()
+        while time.time() - start < seconds:
+            img = rtsp.GetImage()
+            imageCount += 1
+            imageBytes += len(img)
+        totalSec = time.time() - start
+        cpuSec = time.process_time() - cpuStart
+
+    return {
+        "Source": filePath if filePath else f"generated {frameKb}KB images",
+        "AvgImageKB": avgImageBytes / 1024,
+        "FeedFps": fps,
+        "Images": imageCount,
+        "Fps": imageCount / totalSec,
+        "MBps": imageBytes / totalSec / (1024 * 1024),
+        "CpuSec": cpuSec,
+        "CpuPercent": cpuSec / totalSec * 100,
+        "CpuMsPerImage": cpuSec * 1000 / max(imageCount, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Feeds recorded ffmpeg output through the QuickCam RTSP image parsing and reports the cpu usage.")
+    parser.add_argument("--file", help="Recorded ffmpeg image2pipe output. If not set, images are generated.")
+    parser.add_argument("--framekb", type=int, default=200, help="The size of the generated images.")
+    parser.add_argument("--fps", type=float, default=15, help="The rate the images are fed, 0 for as fast as possible.")
+    parser.add_argument("--seconds", type=float, default=10, help="How long to run.")
+    parser.add_argument("--chunkms", type=float, default=1, help="The delay between each 32KB write, 0 to write each image at once.")
+    parser.add_argument("--json", action="store_true", help="Output the results as json.")
+    parser.add_argument("--feed", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.feed:
+        Feed(args.file, args.framekb, args.fps, args.seconds, args.chunkms)
+        return
+
+    result = RunBenchmark(args.file, args.framekb, args.fps, args.seconds, args.chunkms)
+    if args.json:
+        print(json.dumps(result))
+        return
+    print("Source: %s, avg image %.0fKB, fed at %s fps" % (result["Source"], result["AvgImageKB"], result["FeedFps"] if result["FeedFps"] > 0 else "max"))
+    print("Parsed %d images, %.1f fps %.1f MB/s, cpu %.2fs (%.1f%% of a core) %.3fms per image" % (result["Images"], result["Fps"], result["MBps"], result["CpuSec"], result["CpuPercent"], result["CpuMsPerImage"]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+import os
+import sys
+import json
+import time
+import queue
+import logging
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+#
+# A throughput benchmark for http response bodies sent through a web stream.
+#
+# This downloads a large file from a local file server through an OctoSession, like a direct download through the service,
+# and reports how fast the body is framed into messages. The stand-in websocket doesn't actually send the messages, it only
+# reads each one, so the numbers only reflect the body read and message framing.
+#
+# Usage, from the repo root:
+#    python3 developer/webstreambodybenchmark.py                        - Downloads a 200MB file five times.
+#    python3 developer/webstreambodybenchmark.py --sizemb 50 --runs 10  - Downloads a 50MB file ten times.
+#    python3 developer/webstreambodybenchmark.py --compress             - Serves the file as text, so the body is compressed.
+#
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+from octoeverywhere.sentry import Sentry
+from octoeverywhere.compression import Compression
+from octoeverywhere.httpsessions import HttpSessions
+from octoeverywhere.commandhandler import CommandHandler
+from octoeverywhere.octohttprequest import OctoHttpRequest
+from octoeverywhere.octosessionimpl import OctoSession
+from octoeverywhere.Webcam.webcamhelper import WebcamHelper
+from octoeverywhere.Proto import WebStreamMsg
+from octoeverywhere.Proto import MessageContext
+from octoeverywhere.Proto import OctoStreamMessage
+from octoeverywhere.Proto.MessagePriority import MessagePriority
+from webstreamloadtest import BuildOpenMessage, GetRssKb
+
+
+# Serves the files in a directory, run in its own process so the server's cpu time isn't counted.
+def ServeDirectory(directory:str):
+    class Handler(SimpleHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=directory, **kwargs)
+        def guess_type(self, path):
+            if path.endswith(".txt"):
+                return "text/plain"
+            return "application/octet-stream"
+        def log_message(self, format, *args): #pylint: disable=redefined-builtin
+            pass
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    print(server.server_address[1], flush=True)
+    server.serve_forever()
+
+
+# Stands in for the OctoServerCon. Like the real websocket, the messages are handed off to a send thread.
+class StandInOctoStream:
+
+    def __init__(self):
+        self.SendQueue = queue.Queue()
+        self.BodyBytes = 0
+        self.MsgCount = 0
+        self.Done = threading.Event()
+        t = threading.Thread(target=self._SendThread, daemon=True)
+        t.start()
+
+    def SendMsg(self, buffer, msgStartOffsetBytes, msgSize, sentCallback=None):
+        self.SendQueue.put((buffer, msgStartOffsetBytes, msgSize, sentCallback))
+
+    def OnSessionError(self, sessionId, backoffModifierSec):
+        print("Session error.")
+        self.Done.set()
+
+    def GetSendBytesPerSec(self) -> float:
+        return 0.0
+
+    def _SendThread(self):
+        while True:
+            buffer, msgStartOffsetBytes, _, sentCallback = self.SendQueue.get()
+            msg = OctoStreamMessage.OctoStreamMessage.GetRootAs(buffer, msgStartOffsetBytes + 4)
+            if msg.ContextType() == MessageContext.MessageContext.WebStreamMsg:
+                webStreamMsg = WebStreamMsg.WebStreamMsg()
+                webStreamMsg.Init(msg.Context().Bytes, msg.Context().Pos)
+                self.BodyBytes += webStreamMsg.DataLength()
+                self.MsgCount += 1
+                if webStreamMsg.IsCloseMsg():
+                    self.Done.set()
+            if sentCallback is not None:
+                sentCallback()
+
+
+def RunBenchmark(sizeMb:int, runs:int, compress:bool) -> dict:
+    logger = logging.getLogger("webstreambodybenchmark")
+    logger.setLevel(logging.ERROR)
+    logger.addHandler(logging.StreamHandler())
+    Sentry.SetLogger(logger)
+
+    # Make the file and start the server.
+    directory = tempfile.mkdtemp(prefix="webstreambodybenchmark-")
+    fileName = "download.txt" if compress else "download.bin"
+    with open(os.path.join(directory, fileName), "wb") as f:
+        chunk = (b"G1 X10.0 Y20.0 E0.5 F1800\n" * 40000) if compress else os.urandom(1024 * 1024)
+        written = 0
+        while written < sizeMb * 1024 * 1024:
+            f.write(chunk)
+            written += len(chunk)
+    fileSize = os.path.getsize(os.path.join(directory, fileName))
+    serverProc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", directory], stdout=subprocess.PIPE)
+    serverPort = int(serverProc.stdout.readline().decode().strip())
+
+    OctoHttpRequest.SetLocalHttpProxyPort(serverPort)
+    OctoHttpRequest.SetLocalOctoPrintPort(serverPort)
+    OctoHttpRequest.SetLocalHttpProxyIsHttps(False)
+    HttpSessions.Init(logger)
+    Compression.Init(logger, tempfile.mkdtemp(prefix="webstreambodybenchmark-"))
+    WebcamHelper.Init(logger, None, tempfile.mkdtemp(prefix="webstreambodybenchmark-"))
+    CommandHandler.Init(logger, None, None, None)
+    hostHeader = "127.0.0.1:"+str(serverPort)
+
+    results = []
+    try:
+        for run in range(runs):
+            octoStream = StandInOctoStream()
+            session = OctoSession(octoStream, logger, "printerid", "privatekey", True, 1, None, "benchmark", 0, False)
+            startRssKb = GetRssKb()
+            cpuStart = time.process_time()
+            start = time.time()
+            session.HandleMessage(BuildOpenMessage(1, {"path": "/"+fileName, "priority": MessagePriority.Normal}, hostHeader))
+            if octoStream.Done.wait(300) is False:
+                print("Timed out waiting for the download.")
+            totalSec = time.time() - start
+            cpuSec = time.process_time() - cpuStart
+            results.append({
+                "Run": run,
+                "Sec": totalSec,
+                "MBps": fileSize / totalSec / (1024 * 1024),
+                "Mbps": fileSize * 8 / totalSec / (1000 * 1000),
+                "CpuSec": cpuSec,
+                "Msgs": octoStream.MsgCount,
+                "RssGrowthKb": GetRssKb() - startRssKb,
+            })
+    finally:
+        serverProc.kill()
+        os.remove(os.path.join(directory, fileName))
+
+    best = max(results, key=lambda r: r["MBps"])
+    return {
+        "FileSizeMB": fileSize / (1024 * 1024),
+        "Compressed": compress,
+        "Runs": results,
+        "BestMBps": best["MBps"],
+        "BestMbps": best["Mbps"],
+        "AvgMBps": sum(r["MBps"] for r in results) / len(results),
+        "AvgCpuSecPerGB": sum(r["CpuSec"] for r in results) / (len(results) * fileSize / (1024 * 1024 * 1024)),
+        "MaxRssKb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Downloads a large file from a local file server through a web stream and reports the throughput.")
+    parser.add_argument("--sizemb", type=int, default=200, help="The size of the file to download.")
+    parser.add_argument("--runs", type=int, default=5, help="The number of downloads.")
+    parser.add_argument("--compress", action="store_true", help="Serve the file as text, so the body is compressed.")
+    parser.add_argument("--json", action="store_true", help="Output the results as json.")
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        ServeDirectory(args.serve)
+        return
+
+    result = RunBenchmark(args.sizemb, args.runs, args.compress)
+    if args.json:
+        print(json.dumps(result))
+        return
+    for r in result["Runs"]:
+        print("Run %d: %.2fs %.1f MB/s (%.0f Mbps) cpu %.2fs msgs %d rss growth %dKB" % (r["Run"], r["Sec"], r["MBps"], r["Mbps"], r["CpuSec"], r["Msgs"], r["RssGrowthKb"]))
+    print("File %.0fMB compressed:%s best %.1f MB/s (%.0f Mbps) avg %.1f MB/s, cpu %.2fs per GB, max rss %dKB" % (result["FileSizeMB"], result["Compressed"], result["BestMBps"], result["BestMbps"], result["AvgMBps"], result["AvgCpuSecPerGB"], result["MaxRssKb"]))
+
+
+if __name__ == '__main__':
+    main()
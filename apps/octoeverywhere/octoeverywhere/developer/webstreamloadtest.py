@@ -0,0 +1,342 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+#
+# A load test for the web stream engines.
+#
+# This replays a recorded page load through an OctoSession, like the service would send it, against a local stand-in http server.
+# The stand-in server returns bodies of the recorded sizes after the recorded server delays, so the numbers only reflect the plugin.
+#
+# Usage, from the repo root:
+#    python3 developer/webstreamloadtest.py                          - Runs the built in Mainsail page load with both engines.
+#    python3 developer/webstreamloadtest.py --engine pool --loads 5  - Runs only the worker pool engine, five page loads back to back.
+#    python3 developer/webstreamloadtest.py --recording load.json    - Replays a recording file.
+#    python3 developer/webstreamloadtest.py --speedup 10             - Replays the requests 10x faster than recorded, for more concurrent streams.
+#
+# A recording file is a json list of requests, ordered by the time they started:
+#    [ { "startMs": 0, "path": "/", "size": 1500, "serverDelayMs": 5, "contentType": "text/html", "priority": 10 }, ... ]
+#
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+from octoeverywhere.sentry import Sentry
+from octoeverywhere.compression import Compression
+from octoeverywhere.httpsessions import HttpSessions
+from octoeverywhere.commandhandler import CommandHandler
+from octoeverywhere.octohttprequest import OctoHttpRequest
+from octoeverywhere.octosessionimpl import OctoSession
+from octoeverywhere.octostreammsgbuilder import OctoStreamMsgBuilder
+from octoeverywhere.Webcam.webcamhelper import WebcamHelper
+from octoeverywhere.WebStream.octowebstreamworkerpool import OctoWebStreamWorkerPool
+from octoeverywhere.Proto import WebStreamMsg
+from octoeverywhere.Proto import HttpHeader
+from octoeverywhere.Proto import HttpInitialContext
+from octoeverywhere.Proto import MessageContext
+from octoeverywhere.Proto import OctoStreamMessage
+from octoeverywhere.Proto.PathTypes import PathTypes
+from octoeverywhere.Proto.MessagePriority import MessagePriority
+
+
+# Builds a recording that looks like a Mainsail page load: the index, a burst of js, css and font assets,
+# and the api calls the frontend makes once it starts, some of which the server is slow to answer.
+def BuildMainsailRecording() -> list:
+    requests = [{"startMs": 0, "path": "/", "size": 1800, "serverDelayMs": 5, "contentType": "text/html", "priority": MessagePriority.High}]
+    requests.append({"startMs": 60, "path": "/assets/index.js", "size": 900000, "serverDelayMs": 10, "contentType": "application/javascript", "priority": MessagePriority.High})
+    requests.append({"startMs": 60, "path": "/assets/index.css", "size": 120000, "serverDelayMs": 10, "contentType": "text/css", "priority": MessagePriority.High})
+    for i in range(30):
+        requests.append({"startMs": 250 + i * 4, "path": "/assets/chunk-%d.js" % i, "size": 4000 + i * 3000, "serverDelayMs": 5, "contentType": "application/javascript", "priority": MessagePriority.Normal})
+    for i in range(6):
+        requests.append({"startMs": 300 + i * 5, "path": "/fonts/font-%d.woff2" % i, "size": 30000, "serverDelayMs": 5, "contentType": "font/woff2", "priority": MessagePriority.Normal})
+    for i, (path, delay) in enumerate([("/server/info", 20), ("/server/config", 30), ("/printer/info", 20), ("/server/database/item?namespace=mainsail", 40),
+                                      ("/server/files/list?root=gcodes", 150), ("/server/history/list?limit=50", 120), ("/machine/system_info", 60),
+                                      ("/server/webcams/list", 20), ("/printer/objects/list", 25), ("/server/files/get_directory?path=config", 80)]):
+        requests.append({"startMs": 600 + i * 10, "path": path, "size": 2000 + i * 1500, "serverDelayMs": delay, "contentType": "application/json", "priority": MessagePriority.Normal})
+    for i in range(20):
+        requests.append({"startMs": 900 + i * 15, "path": "/server/files/gcodes/.thumbs/file-%d.png" % i, "size": 25000, "serverDelayMs": 15, "contentType": "image/png", "priority": MessagePriority.Low})
+    return requests
+
+
+# The stand-in for the local web server.
+class StandInHttpServer:
+
+    def __init__(self, recording:list):
+        # Build the bodies up front, binary types are random so they don't compress like text.
+        self.Routes = {}
+        for r in recording:
+            contentType = r.get("contentType", "application/octet-stream")
+            if contentType.startswith("image") or contentType.startswith("font"):
+                body = os.urandom(r["size"])
+            else:
+                body = (b"function f%d(a, b) { return a + b; }\n" % len(self.Routes)) * (r["size"] // 30 + 1)
+            self.Routes[r["path"]] = (r, body[:r["size"]])
+        routes = self.Routes
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            def do_GET(self):
+                if self.path not in routes:
+                    self.send_error(404)
+                    return
+                route, body = routes[self.path]
+                time.sleep(route.get("serverDelayMs", 0) / 1000.0)
+                self.send_response(200)
+                self.send_header("Content-Type", route.get("contentType", "application/octet-stream"))
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, format, *args): #pylint: disable=redefined-builtin
+                pass
+
+        self.Server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.Server.daemon_threads = True
+        self.Port = self.Server.server_address[1]
+
+    def ServeForever(self):
+        self.Server.serve_forever()
+
+
+# Starts the stand-in server in its own process, so its threads and memory aren't counted, and returns the process and port.
+def StartStandInServerProcess(recordingPath:str):
+    cmd = [sys.executable, os.path.abspath(__file__), "--serve"]
+    if recordingPath is not None:
+        cmd += ["--recording", recordingPath]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    port = int(proc.stdout.readline().decode().strip())
+    return proc, port
+
+
+# Stands in for the OctoServerCon, it records when each stream gets its first response message and when it closes.
+class StandInOctoStream:
+
+    def __init__(self):
+        self.Lock = threading.Lock()
+        self.FirstResponseTime = {}
+        self.CloseTime = {}
+        self.BytesReceived = 0
+        self.SessionErrors = 0
+        self.AllClosed = threading.Event()
+        self.ExpectedStreams = 0
+
+    def SendMsg(self, buffer, msgStartOffsetBytes, msgSize, sentCallback=None):
+        now = time.time()
+        msg = OctoStreamMessage.OctoStreamMessage.GetRootAs(buffer, msgStartOffsetBytes + 4)
+        if msg.ContextType() != MessageContext.MessageContext.WebStreamMsg:
+            return
+        webStreamMsg = WebStreamMsg.WebStreamMsg()
+        webStreamMsg.Init(msg.Context().Bytes, msg.Context().Pos)
+        streamId = webStreamMsg.StreamId()
+        with self.Lock:
+            self.BytesReceived += msgSize
+            if streamId not in self.FirstResponseTime:
+                self.FirstResponseTime[streamId] = now
+            if webStreamMsg.IsCloseMsg() and streamId not in self.CloseTime:
+                self.CloseTime[streamId] = now
+                if len(self.CloseTime) >= self.ExpectedStreams:
+                    self.AllClosed.set()
+        if sentCallback is not None:
+            sentCallback()
+
+    def OnSessionError(self, sessionId, backoffModifierSec):
+        with self.Lock:
+            self.SessionErrors += 1
+
+    def GetSendBytesPerSec(self) -> float:
+        return 0.0
+
+
+# Builds the open message the service sends for a http GET request.
+def BuildOpenMessage(streamId:int, request:dict, hostHeader:str) -> bytes:
+    builder = OctoStreamMsgBuilder.CreateBuffer(500)
+    headerOffsets = []
+    for key, value in (("Host", hostHeader), ("Accept-Encoding", "gzip, deflate, br"), ("User-Agent", "webstreamloadtest")):
+        keyOffset = builder.CreateString(key)
+        valueOffset = builder.CreateString(value)
+        HttpHeader.Start(builder)
+        HttpHeader.AddKey(builder, keyOffset)
+        HttpHeader.AddValue(builder, valueOffset)
+        headerOffsets.append(HttpHeader.End(builder))
+    HttpInitialContext.StartHeadersVector(builder, len(headerOffsets))
+    for o in reversed(headerOffsets):
+        builder.PrependUOffsetTRelative(o)
+    headersOffset = builder.EndVector()
+    pathOffset = builder.CreateString(request["path"])
+    methodOffset = builder.CreateString("GET")
+    octoHostOffset = builder.CreateString("loadtest.octoeverywhere.com")
+    HttpInitialContext.Start(builder)
+    HttpInitialContext.AddPath(builder, pathOffset)
+    HttpInitialContext.AddPathType(builder, PathTypes.Relative)
+    HttpInitialContext.AddMethod(builder, methodOffset)
+    HttpInitialContext.AddOctoHost(builder, octoHostOffset)
+    HttpInitialContext.AddHeaders(builder, headersOffset)
+    contextOffset = HttpInitialContext.End(builder)
+    WebStreamMsg.Start(builder)
+    WebStreamMsg.AddStreamId(builder, streamId)
+    WebStreamMsg.AddIsOpenMsg(builder, True)
+    WebStreamMsg.AddIsDataTransmissionDone(builder, True)
+    WebStreamMsg.AddIsControlFlagsOnly(builder, False)
+    WebStreamMsg.AddHttpInitialContext(builder, contextOffset)
+    WebStreamMsg.AddMsgPriority(builder, request.get("priority", MessagePriority.Normal))
+    webStreamMsgOffset = WebStreamMsg.End(builder)
+    buffer, msgStartOffsetBytes, msgSizeBytes = OctoStreamMsgBuilder.CreateOctoStreamMsgAndFinalize(builder, MessageContext.MessageContext.WebStreamMsg, webStreamMsgOffset)
+    return bytes(buffer[msgStartOffsetBytes:msgStartOffsetBytes+msgSizeBytes])
+
+
+def GetRssKb() -> int:
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except Exception:
+        pass
+    return 0
+
+
+def Percentile(values:list, p:float) -> float:
+    values = sorted(values)
+    if len(values) == 0:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+# Runs the page loads in this process with the given engine and returns the results.
+def RunEngine(engine:str, recording:list, recordingPath:str, loads:int, speedup:float) -> dict:
+    logger = logging.getLogger("webstreamloadtest")
+    logger.setLevel(logging.ERROR)
+    logger.addHandler(logging.StreamHandler())
+    Sentry.SetLogger(logger)
+    serverProc, serverPort = StartStandInServerProcess(recordingPath)
+    OctoHttpRequest.SetLocalHttpProxyPort(serverPort)
+    OctoHttpRequest.SetLocalOctoPrintPort(serverPort)
+    OctoHttpRequest.SetLocalHttpProxyIsHttps(False)
+    HttpSessions.Init(logger)
+    Compression.Init(logger, tempfile.mkdtemp(prefix="webstreamloadtest-"))
+    WebcamHelper.Init(logger, None, tempfile.mkdtemp(prefix="webstreamloadtest-"))
+    CommandHandler.Init(logger, None, None, None)
+    if engine == "pool":
+        OctoWebStreamWorkerPool.Init(logger)
+
+    octoStream = StandInOctoStream()
+    session = OctoSession(octoStream, logger, "printerid", "privatekey", True, 1, None, "loadtest", 0, False)
+    hostHeader = "127.0.0.1:"+str(serverPort)
+
+    # Sample the resource usage while the page loads run.
+    samples = {"PeakRssKb": GetRssKb(), "PeakThreads": threading.active_count()}
+    startRssKb = samples["PeakRssKb"]
+    sampling = threading.Event()
+    def sampler():
+        while not sampling.is_set():
+            samples["PeakRssKb"] = max(samples["PeakRssKb"], GetRssKb())
+            samples["PeakThreads"] = max(samples["PeakThreads"], threading.active_count())
+            time.sleep(0.005)
+    threading.Thread(target=sampler, daemon=True).start()
+
+    # Replay the page loads from this thread, like the socket receive thread does.
+    openTimes = {}
+    octoStream.ExpectedStreams = len(recording) * loads
+    cpuStart = time.process_time()
+    loadStart = time.time()
+    streamId = 1
+    for _ in range(loads):
+        replayStart = time.time()
+        for request in recording:
+            delaySec = replayStart + request["startMs"] / 1000.0 / speedup - time.time()
+            if delaySec > 0:
+                time.sleep(delaySec)
+            msg = BuildOpenMessage(streamId, request, hostHeader)
+            openTimes[streamId] = time.time()
+            session.HandleMessage(msg)
+            streamId += 1
+    completed = octoStream.AllClosed.wait(60)
+    totalSec = time.time() - loadStart
+    cpuSec = time.process_time() - cpuStart
+    sampling.set()
+    serverProc.kill()
+
+    firstResponseMs = [(octoStream.FirstResponseTime[i] - openTimes[i]) * 1000.0 for i in openTimes if i in octoStream.FirstResponseTime]
+    completeMs = [(octoStream.CloseTime[i] - openTimes[i]) * 1000.0 for i in openTimes if i in octoStream.CloseTime]
+    return {
+        "Engine": engine,
+        "Streams": len(openTimes),
+        "Completed": len(completeMs),
+        "TimedOut": completed is False,
+        "SessionErrors": octoStream.SessionErrors,
+        "TotalSec": totalSec,
+        "CpuSec": cpuSec,
+        "FirstResponseP50Ms": Percentile(firstResponseMs, 0.5),
+        "FirstResponseP95Ms": Percentile(firstResponseMs, 0.95),
+        "CompleteP50Ms": Percentile(completeMs, 0.5),
+        "CompleteP95Ms": Percentile(completeMs, 0.95),
+        "CompleteMaxMs": Percentile(completeMs, 1.0),
+        "StartRssKb": startRssKb,
+        "PeakRssKb": samples["PeakRssKb"],
+        "MaxRssKb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "PeakThreads": samples["PeakThreads"],
+        "BytesReceived": octoStream.BytesReceived,
+    }
+
+
+def PrintResults(results:list):
+    keys = ["Streams", "Completed", "SessionErrors", "TotalSec", "CpuSec", "FirstResponseP50Ms", "FirstResponseP95Ms",
+            "CompleteP50Ms", "CompleteP95Ms", "CompleteMaxMs", "StartRssKb", "PeakRssKb", "PeakThreads"]
+    print("%-20s" % "" + "".join(["%14s" % r["Engine"] for r in results]))
+    for k in keys:
+        line = "%-20s" % k
+        for r in results:
+            v = r[k]
+            line += "%14.1f" % v if isinstance(v, float) else "%14s" % str(v)
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays a page load through the web stream engines and reports latency and memory use.")
+    parser.add_argument("--engine", choices=["thread", "pool", "both"], default="both", help="The web stream engine to test.")
+    parser.add_argument("--recording", help="A recorded page load json file, the built in Mainsail page load is used if not set.")
+    parser.add_argument("--loads", type=int, default=3, help="The number of back to back page loads to replay.")
+    parser.add_argument("--speedup", type=float, default=1.0, help="Replays the requests this many times faster than recorded.")
+    parser.add_argument("--json", action="store_true", help="Output the results as json.")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    recording = BuildMainsailRecording()
+    if args.recording is not None:
+        with open(args.recording, encoding="utf-8") as f:
+            recording = json.load(f)
+
+    if args.serve:
+        # Run as the stand-in server process.
+        server = StandInHttpServer(recording)
+        print(server.Port, flush=True)
+        server.ServeForever()
+        return
+
+    if args.engine != "both":
+        results = [RunEngine(args.engine, recording, args.recording, args.loads, args.speedup)]
+    else:
+        # Run each engine in its own process, so the memory numbers are not shared.
+        results = []
+        for engine in ["thread", "pool"]:
+            cmd = [sys.executable, os.path.abspath(__file__), "--engine", engine, "--loads", str(args.loads), "--speedup", str(args.speedup), "--json"]
+            if args.recording is not None:
+                cmd += ["--recording", args.recording]
+            output = subprocess.check_output(cmd)
+            results.append(json.loads(output.decode().strip().splitlines()[-1])[0])
+
+    if args.json:
+        print(json.dumps(results))
+    else:
+        PrintResults(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,7 @@ from octoeverywhere.deviceid import DeviceId
 from octoeverywhere.telemetry import Telemetry
 from octoeverywhere.hostcommon import HostCommon
 from octoeverywhere.compression import Compression
+from octoeverywhere.assetcache import AssetCache
 from octoeverywhere.printinfo import PrintInfoManager
 from octoeverywhere.httpsessions import HttpSessions
 from octoeverywhere.Webcam.webcamhelper import WebcamHelper
@@ -108,6 +109,9 @@ class ElegooHost:
             # Init compression
             Compression.Init(self.Logger, localStorageDir)
 
+            # Init the asset cache, which depends on compression.
+            AssetCache.Init(self.Logger, localStorageDir)
+
             # Init the mdns client
             MDns.Init(self.Logger, localStorageDir)
 
@@ -133,6 +137,7 @@ class ElegooHost:
             self.NotificationHandler = NotificationsHandler(self.Logger, stateTranslator)
             self.NotificationHandler.SetPrinterId(printerId)
             self.NotificationHandler.SetBedCooldownThresholdTemp(self.Config.GetFloat(Config.GeneralSection, Config.GeneralBedCooldownThresholdTempC, Config.GeneralBedCooldownThresholdTempCDefault))
+            self.NotificationHandler.SetSnapshotMaxAgeSec(self.Config.GetFloat(Config.GeneralSection, Config.GeneralNotificationSnapshotMaxAgeSec, Config.GeneralNotificationSnapshotMaxAgeSecDefault))
             stateTranslator.SetNotificationHandler(self.NotificationHandler)
 
             # Setup the command handler
@@ -23,6 +23,8 @@ class Config:
     GeneralSection = "general"
     GeneralBedCooldownThresholdTempC = "bed_cooldown_threshold_temp_celsius"
     GeneralBedCooldownThresholdTempCDefault = 40.0
+    GeneralNotificationSnapshotMaxAgeSec = "notification_snapshot_max_age_sec"
+    GeneralNotificationSnapshotMaxAgeSecDefault = 2.0
 
 
     #
@@ -31,6 +33,10 @@ class Config:
     RelaySection = "relay"
     RelayFrontEndPortKey = "frontend_port"            # This field is shared with the installer, the installer can write this value. It the name can't change!
     RelayFrontEndTypeHintKey = "frontend_type_hint"   # This field is shared with the installer, the installer can write this value. It the name can't change!
+    RelayWebStreamEngineKey = "web_stream_engine"
+    RelayWebStreamEngineValueThread = "thread"
+    RelayWebStreamEngineValuePool = "pool"
+    RelayWebStreamEngineDefault = RelayWebStreamEngineValueThread
 
 
     #
@@ -82,6 +88,7 @@ class Config:
     c_ConfigComments = [
         { "Target": RelayFrontEndPortKey,  "Comment": "The port used for http relay. If your desired frontend runs on a different port, change this value. The OctoEverywhere plugin service needs to be restarted before changes will take effect."},
         { "Target": RelayFrontEndTypeHintKey,  "Comment": "A string only used by the UI to hint at what web interface this port is."},
+        { "Target": RelayWebStreamEngineKey,  "Comment": "How relayed web requests are processed. 'thread' uses a thread per request, 'pool' shares a small pool of worker threads, which uses less memory on low end devices. The OctoEverywhere plugin service needs to be restarted before changes will take effect."},
         { "Target": LogLevelKey,  "Comment": "The active logging level. Valid values include: DEBUG, INFO, WARNING, or ERROR."},
         { "Target": CompanionKeyIpOrHostname,  "Comment": "The IP or hostname this companion plugin will use to connect to Moonraker. The OctoEverywhere plugin service needs to be restarted before changes will take effect."},
         { "Target": CompanionKeyPort,  "Comment": "The port this companion plugin will use to connect to Moonraker. The OctoEverywhere plugin service needs to be restarted before changes will take effect."},
@@ -96,6 +103,7 @@ class Config:
         { "Target": WebcamFlipV,  "Comment": "Flips the webcam image vertically. Valid values are True or False"},
         { "Target": WebcamRotation,  "Comment": "Rotates the webcam image. Valid values are 0, 90, 180, or 270"},
         { "Target": GeneralBedCooldownThresholdTempC,  "Comment": "The temperature in Celsius that the bed must be under to be considered cooled down. This is used to fire the Bed Cooldown Complete notification."},
+        { "Target": GeneralNotificationSnapshotMaxAgeSec,  "Comment": "How old in seconds a webcam snapshot can be and still be used for notifications and Gadget, rather than taking a new one. Set to 0 to always take a new snapshot."},
         { "Target": ElegooMainboardId,  "Comment": "This is the mainboard id of the linked printer."},
     ]
 
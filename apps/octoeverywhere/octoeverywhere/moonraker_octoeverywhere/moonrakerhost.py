@@ -7,6 +7,7 @@ from octoeverywhere.deviceid import DeviceId
 from octoeverywhere.telemetry import Telemetry
 from octoeverywhere.hostcommon import HostCommon
 from octoeverywhere.compression import Compression
+from octoeverywhere.assetcache import AssetCache
 from octoeverywhere.octopingpong import OctoPingPong
 from octoeverywhere.httpsessions import HttpSessions
 from octoeverywhere.Webcam.webcamhelper import WebcamHelper
@@ -14,6 +15,7 @@ from octoeverywhere.printinfo import PrintInfoManager
 from octoeverywhere.commandhandler import CommandHandler
 from octoeverywhere.octoeverywhereimpl import OctoEverywhere
 from octoeverywhere.octohttprequest import OctoHttpRequest
+from octoeverywhere.WebStream.octowebstreamworkerpool import OctoWebStreamWorkerPool
 from octoeverywhere.Proto.ServerHost import ServerHost
 from octoeverywhere.localip import LocalIpHelper
 from octoeverywhere.compat import Compat
@@ -129,6 +131,9 @@ class MoonrakerHost:
             # Init compression
             Compression.Init(self.Logger, localStorageDir)
 
+            # Init the asset cache, which depends on compression.
+            AssetCache.Init(self.Logger, localStorageDir)
+
             # Init the mdns client
             MDns.Init(self.Logger, localStorageDir)
 
@@ -156,6 +161,11 @@ class MoonrakerHost:
             OctoHttpRequest.SetLocalHttpProxyIsHttps(False)
             OctoHttpRequest.SetLocalOctoPrintPort(frontendPort)
 
+            # Setup the web stream worker pool, if it's enabled.
+            webStreamEngine = self.Config.GetStrIfInAcceptableList(Config.RelaySection, Config.RelayWebStreamEngineKey, Config.RelayWebStreamEngineDefault, [Config.RelayWebStreamEngineValueThread, Config.RelayWebStreamEngineValuePool])
+            if webStreamEngine.lower() == Config.RelayWebStreamEngineValuePool:
+                OctoWebStreamWorkerPool.Init(self.Logger)
+
             # If we are in companion mode, we need to update the local address to be the other local remote.
             if isCompanionMode:
                 ipOrHostnameStr = self.Config.GetStr(Config.SectionCompanion, Config.CompanionKeyIpOrHostname, None)
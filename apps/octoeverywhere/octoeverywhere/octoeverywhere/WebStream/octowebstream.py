@@ -4,14 +4,16 @@ import threading
 import traceback
 import time
 import queue
+import collections
 
 from ..sentry import Sentry
 from ..octostreammsgbuilder import OctoStreamMsgBuilder
 from .octowebstreamhttphelper import OctoWebStreamHttpHelper
 from .octowebstreamwshelper import OctoWebStreamWsHelper
+from .octowebstreamworkerpool import OctoWebStreamWorkerPool
+from .octowebstreamsendscheduler import OctoWebStreamSendScheduler
 from ..Proto import WebStreamMsg
 from ..Proto import MessageContext
-from ..Proto import MessagePriority
 from ..debugprofiler import DebugProfiler, DebugProfilerFeatures
 
 #
@@ -36,11 +38,14 @@ class OctoWebStream(threading.Thread):
         self.OpenedTime = time.time()
         self.ClosedDueToRequestConnectionError = False
 
-        # Vars for high pri streams
-        self.IsHighPriStream = False
-        self.HighPriLock = threading.Lock()
-        self.ActiveHighPriStreamCount = 0
-        self.ActiveHighPriStreamStart = time.time()
+        # If the worker pool engine is enabled, this stream doesn't use its own thread.
+        # The pool owns these vars and only accesses them under its lock.
+        self.WorkerPool = OctoWebStreamWorkerPool.Get()
+        self.PooledMsgs = collections.deque()
+        self.IsPoolScheduled = False
+
+        # The class used to schedule the messages this stream sends, it's set from the open message and can be updated once the response is known.
+        self.SendClass = OctoWebStreamSendScheduler.ClassApi
 
 
     # Called for all messages for this stream id.
@@ -64,8 +69,24 @@ class OctoWebStream(threading.Thread):
             # Call close.
             self.Close()
         else:
-            # Otherwise, put the message into the queue, so the thread will pick it up.
-            self.MsgQueue.put(webStreamMsg)
+            # If the http helper is streaming a large upload into the local request, make sure the local server is keeping up.
+            # This doesn't block, since that would stall every stream on this session. If too much of the upload is queued, the stream is closed.
+            httpHelper = self.HttpHelper
+            if httpHelper is not None and httpHelper.OnUploadMessageQueued(webStreamMsg) is False:
+                self.Close()
+                return
+
+            if self.WorkerPool is not None:
+                # Let the worker pool schedule the stream to process the message.
+                self.WorkerPool.QueueMessage(self, webStreamMsg)
+            else:
+                # Otherwise, put the message into the queue, so the thread will pick it up.
+                self.MsgQueue.put(webStreamMsg)
+
+
+    # Returns true if the stream needs to be started as a thread, false if the worker pool will run it.
+    def UsesOwnThread(self) -> bool:
+        return self.WorkerPool is None
 
 
     # Closes the web stream and all related elements.
@@ -104,9 +125,8 @@ class OctoWebStream(threading.Thread):
         # Ensure we have sent the close message
         self.ensureCloseMessageSent()
 
-        # If this was high pri, clear the state
-        if self.IsHighPriStream:
-            self.highPriStreamEnded()
+        # If the stream's thread is waiting to send, let it know we closed.
+        self.OctoSession.SendScheduler.OnStreamClosed()
 
         # If we got a ref to the helper, we need to call close on it.
         try:
@@ -157,40 +177,66 @@ class OctoWebStream(threading.Thread):
             if webStreamMsg is None:
                 continue
 
-            # Handle the message.
-            if webStreamMsg.IsOpenMsg():
-                self.initFromOpenMessage(webStreamMsg)
+            # Handle the message, and exit if the stream is done.
+            if self.processMessage(webStreamMsg):
+                return
 
-            # Ensure we have an open message.
-            if self.OpenWebStreamMsg is None:
-                # Throw so we reset the connection.
-                raise Exception("Web stream ["+str(self.Id)+"] got a non open message before it's open message.")
 
-            # Don't pass it to the helper if there's nothing more.
-            if webStreamMsg.IsControlFlagsOnly():
-                continue
+    # Called by the worker pool to process the next message of this stream, when the pool engine is used.
+    # Returns true if the stream is done and no more messages should be processed.
+    def ProcessPooledMessage(self, webStreamMsg:WebStreamMsg.WebStreamMsg) -> bool:
+        if self.IsClosed is True:
+            return True
+        # Enable the profiler if needed- it will do nothing if not enabled.
+        with DebugProfiler(self.Logger, DebugProfilerFeatures.WebStream):
+            try:
+                return self.processMessage(webStreamMsg)
+            except Exception as e:
+                Sentry.Exception("Exception in web stream ["+str(self.Id)+"] worker pool message processing.", e)
+                traceback.print_exc()
+                self.OctoSession.OnSessionError(0)
+                return True
 
-            # Allow the helper to process the message
-            # We should only ever have one, but just for safety, check both.
-            returnValue = True
-            if self.HttpHelper is not None:
-                returnValue = self.HttpHelper.IncomingServerMessage(webStreamMsg)
-            if self.WsHelper is not None:
-                returnValue = self.WsHelper.IncomingServerMessage(webStreamMsg)
 
-            # If process server message returns true, we should close the stream.
-            if returnValue is True:
-                self.Close()
-                return
+    # Handles a single message for this stream, the messages must be handled in order.
+    # Returns true if the stream is done and no more messages should be processed.
+    def processMessage(self, webStreamMsg:WebStreamMsg.WebStreamMsg) -> bool:
+        # Handle the message.
+        if webStreamMsg.IsOpenMsg():
+            self.initFromOpenMessage(webStreamMsg)
 
-            # When the http helper sends messages, it can indicate that the close flag has been set.
-            # In such a case, self.HasSentCloseMessage will be true. We don't want to rely on the client
-            # returning the correct returnValue, so if we see that we will call close to make sure things
-            # are going down. Since Close() is guarded against multiple entries, this is totally fine.
-            if self.HasSentCloseMessage is True and self.IsClosed is False:
-                self.Logger.warn("Web stream "+str(self.Id)+" processed a message and has sent a close message, but didn't call close on the web stream. Closing now.")
-                self.Close()
-                return
+        # Ensure we have an open message.
+        if self.OpenWebStreamMsg is None:
+            # Throw so we reset the connection.
+            raise Exception("Web stream ["+str(self.Id)+"] got a non open message before it's open message.")
+
+        # Don't pass it to the helper if there's nothing more.
+        if webStreamMsg.IsControlFlagsOnly():
+            return False
+
+        # Allow the helper to process the message
+        # We should only ever have one, but just for safety, check both.
+        returnValue = True
+        if self.HttpHelper is not None:
+            returnValue = self.HttpHelper.IncomingServerMessage(webStreamMsg)
+        if self.WsHelper is not None:
+            returnValue = self.WsHelper.IncomingServerMessage(webStreamMsg)
+
+        # If process server message returns true, we should close the stream.
+        if returnValue is True:
+            self.Close()
+            return True
+
+        # When the http helper sends messages, it can indicate that the close flag has been set.
+        # In such a case, self.HasSentCloseMessage will be true. We don't want to rely on the client
+        # returning the correct returnValue, so if we see that we will call close to make sure things
+        # are going down. Since Close() is guarded against multiple entries, this is totally fine.
+        if self.HasSentCloseMessage is True and self.IsClosed is False:
+            self.Logger.warn("Web stream "+str(self.Id)+" processed a message and has sent a close message, but didn't call close on the web stream. Closing now.")
+            self.Close()
+            return True
+
+        return False
 
 
     def initFromOpenMessage(self, webStreamMsg:WebStreamMsg.WebStreamMsg):
@@ -202,10 +248,8 @@ class OctoWebStream(threading.Thread):
         # Set the message.
         self.OpenWebStreamMsg = webStreamMsg
 
-        # Check if this is high pri, if so, tell them system a high pri is active
-        if self.OpenWebStreamMsg.MsgPriority() < MessagePriority.MessagePriority.Normal:
-            self.IsHighPriStream = True
-            self.highPriStreamStarted()
+        # Set the send class from what we know so far.
+        self.SendClass = OctoWebStreamSendScheduler.GetClassForOpenMsg(self.OpenWebStreamMsg.MsgPriority())
 
         # At this point we know what kind of stream we are, http or ws.
         # Create the helper out of lock and then set it.
@@ -241,7 +285,13 @@ class OctoWebStream(threading.Thread):
 
 
     # Called by the helpers to send messages to the server.
-    def SendToOctoStream(self, buffer:bytearray, msgStartOffsetBytes:int, msgSize:int, isCloseFlagSet = False, silentlyFail = False):
+    # If the optional sentCallback is set, it's called once the buffer has been sent and can be reused. It's not called if the message isn't sent.
+    # If this stream already has a lot of data waiting to be sent, this blocks until some of it has been sent.
+    def SendToOctoStream(self, buffer:bytearray, msgStartOffsetBytes:int, msgSize:int, isCloseFlagSet = False, silentlyFail = False, sentCallback = None):
+        # Close messages are sent from the main socket receive thread, so they must not block.
+        if isCloseFlagSet is False:
+            self.OctoSession.SendScheduler.WaitForCapacity(self)
+
         # Make sure we aren't closed. If we are, don't allow the message to be sent.
         with self.StateLock:
             if self.IsClosed is True:
@@ -261,9 +311,9 @@ class OctoWebStream(threading.Thread):
             if isCloseFlagSet:
                 self.HasSentCloseMessage = True
 
-        # Send now
+        # Queue it to be sent when it's our turn.
         try:
-            self.OctoSession.Send(buffer, msgStartOffsetBytes, msgSize)
+            self.OctoSession.SendScheduler.Send(self.Id, self.SendClass, buffer, msgStartOffsetBytes, msgSize, sentCallback)
         except Exception as e:
             Sentry.Exception("Web stream "+str(self.Id)+ " failed to send a message to the OctoStream.", e)
 
@@ -299,33 +349,6 @@ class OctoWebStream(threading.Thread):
             Sentry.Exception("Exception thrown while trying to send close message for web stream "+str(self.Id), e)
             self.OctoSession.OnSessionError(0)
 
-    # Called by the OctoStreamHttpHelper if the request is normal pri.
-    # If a high pri request is active, this should block until it's complete or for a little while.
-    def BlockIfHighPriStreamActive(self):
-        # Check the counter, don't worry about taking the lock, worst case
-        # this logic would allow one request through or not block one.
-
-        # If there are no high pri requests, don't block.
-        if self.ActiveHighPriStreamCount == 0:
-            return
-        # As a sanity check, if the high pri request started more than 5 seconds ago
-        # don't block.
-        timeSinceStartSec = time.time() - self.ActiveHighPriStreamStart
-        if timeSinceStartSec > 5.0:
-            return
-
-        # We should block this request
-        # TODO - this would be better if we blocked on a event or something, but for now this is fine.
-        # Note that the http will call this function before the request and on each response read loop, so the delays add up.
-        time.sleep(0.1)
-
-    # Called when a high pri stream is started
-    def highPriStreamStarted(self):
-        with self.HighPriLock:
-            self.ActiveHighPriStreamCount += 1
-            self.ActiveHighPriStreamStart = time.time()
-
-    # Called when a high pri stream is ended.
-    def highPriStreamEnded(self):
-        with self.HighPriLock:
-            self.ActiveHighPriStreamCount -= 1
+    # Called by the helpers once they know more about the response, to update the class used to schedule the stream's messages.
+    def SetSendClass(self, sendClass:str):
+        self.SendClass = sendClass
@@ -1,6 +1,7 @@
 import time
 import logging
 import threading
+import collections
 
 import requests
 import urllib3
@@ -13,6 +14,9 @@ from ..octostreammsgbuilder import OctoStreamMsgBuilder
 from ..Webcam.webcamhelper import WebcamHelper
 from ..commandhandler import CommandHandler
 from ..compression import Compression, CompressionContext
+from ..assetcache import AssetCache
+from ..adaptivecompression import AdaptiveCompression
+from .octowebstreamsendscheduler import OctoWebStreamSendScheduler
 from ..sentry import Sentry
 from ..compat import Compat
 from ..Proto import HttpHeader
@@ -34,9 +38,107 @@ class MsgBuilderContext:
 
     def __init__(self):
         self.Builder:octoflatbuffers.Builder = None
+        self.BuilderInitialSizeBytes = 0
+        self.IsPooledBuilder = False
+        self.ReservedVectorHead = 0
+        self.ReservedVectorSizeBytes = 0
 
     def CreateBuilder(self, knownBodySizeBytes = 0):
-        self.Builder = octoflatbuffers.Builder(knownBodySizeBytes + self.c_MsgStreamOverheadSize)
+        # Larger messages use a builder from the pool, so we don't allocate a new big buffer for every message.
+        self.Builder = MsgBuilderPool.Rent(knownBodySizeBytes + self.c_MsgStreamOverheadSize)
+        self.IsPooledBuilder = self.Builder is not None
+        if self.Builder is None:
+            self.Builder = octoflatbuffers.Builder(knownBodySizeBytes + self.c_MsgStreamOverheadSize)
+        self.BuilderInitialSizeBytes = len(self.Builder.Bytes)
+
+    # Drops the builder, if the message won't be sent.
+    def DiscardBuilder(self):
+        if self.IsPooledBuilder and self.Builder is not None:
+            MsgBuilderPool.Return(self.Builder)
+        self.Builder = None
+        self.IsPooledBuilder = False
+
+    # If the builder came from the pool, this returns a callback that puts it back once the message has been sent.
+    # After the message is sent with the callback, the builder must not be used again.
+    def GetSentCallback(self):
+        if self.IsPooledBuilder is False:
+            return None
+        builder = self.Builder
+        return lambda: MsgBuilderPool.Return(builder)
+
+    # Reserves the data vector in the builder and returns a memoryview over it, so the body can be read directly into the message.
+    # This must be the first object created in the builder, and FinishDataVector must be called with how much was written, before anything else is created.
+    # The returned memoryview must be released before FinishDataVector is called.
+    def ReserveDataVector(self, sizeBytes:int) -> memoryview:
+        builder = self.Builder
+        # This is the same as what CreateByteVector does, but without the copy.
+        builder.assertNotNested()
+        builder.nested = True
+        builder.Prep(4, sizeBytes)
+        builder.head = builder.head - sizeBytes
+        self.ReservedVectorHead = builder.head
+        self.ReservedVectorSizeBytes = sizeBytes
+        return memoryview(builder.Bytes)[builder.head:builder.head+sizeBytes]
+
+    # Finishes the reserved data vector with the size that was written and returns the vector offset.
+    def FinishDataVector(self, writtenSizeBytes:int) -> int:
+        builder = self.Builder
+        if writtenSizeBytes < self.ReservedVectorSizeBytes:
+            # If less was written, move the data to the end of the reservation so the unused space isn't sent.
+            # The move is a multiple of 4 bytes, so the vector stays aligned.
+            moveBytes = (self.ReservedVectorSizeBytes - writtenSizeBytes) & ~3
+            if moveBytes > 0:
+                builder.head = self.ReservedVectorHead + moveBytes
+                builder.Bytes[builder.head:builder.head+writtenSizeBytes] = builder.Bytes[self.ReservedVectorHead:self.ReservedVectorHead+writtenSizeBytes]
+        builder.vectorNumElems = writtenSizeBytes
+        return builder.EndVector()
+
+
+#
+# A pool of the flatbuffer builders used for large messages.
+#
+# A large http body is sent as many messages of about the same size, and each one used to allocate a new builder buffer.
+# The buffers are handed to the websocket send thread, so a builder is only returned to the pool once its message has been sent.
+#
+class MsgBuilderPool:
+
+    # The size of the builders in the pool, it fits the largest body read we do for uncompressed bodies plus the message overhead.
+    c_BuilderSizeBytes = (490 * 1024) + MsgBuilderContext.c_MsgStreamOverheadSize
+
+    # Smaller messages just allocate a builder, since it's cheap and we don't want to tie up a big buffer.
+    c_MinRentSizeBytes = 64 * 1024
+
+    # The max number of builders kept in the pool when they aren't in use. More can be rented at once, but the extras aren't kept.
+    c_MaxPooledBuilders = 4
+
+    _Lock = threading.Lock()
+    _Builders = []
+
+
+    # Returns a cleared builder that's at least the given size, or None if the size shouldn't use the pool.
+    @staticmethod
+    def Rent(sizeBytes:int) -> octoflatbuffers.Builder:
+        if sizeBytes < MsgBuilderPool.c_MinRentSizeBytes or sizeBytes > MsgBuilderPool.c_BuilderSizeBytes:
+            return None
+        builder = None
+        with MsgBuilderPool._Lock:
+            if len(MsgBuilderPool._Builders) > 0:
+                builder = MsgBuilderPool._Builders.pop()
+        if builder is None:
+            return octoflatbuffers.Builder(MsgBuilderPool.c_BuilderSizeBytes)
+        builder.Clear()
+        return builder
+
+
+    # Called once the builder's message has been sent.
+    @staticmethod
+    def Return(builder:octoflatbuffers.Builder) -> None:
+        # If the builder had to grow, don't keep it.
+        if len(builder.Bytes) != MsgBuilderPool.c_BuilderSizeBytes:
+            return
+        with MsgBuilderPool._Lock:
+            if len(MsgBuilderPool._Builders) < MsgBuilderPool.c_MaxPooledBuilders:
+                MsgBuilderPool._Builders.append(builder)
 
 
 #
@@ -47,6 +149,10 @@ class MsgBuilderContext:
 #
 class OctoWebStreamHttpHelper:
 
+    # Uploads with a known size this large or larger are streamed into the local http request as they arrive,
+    # rather than being buffered in memory until the upload is done.
+    c_StreamingUploadMinSizeBytes = 2 * 1024 * 1024
+
     # Called by the main socket thread so this should be quick!
     def __init__(self, streamId, logger:logging.Logger, webStream, webStreamOpenMsg:WebStreamMsg.WebStreamMsg, openedTime):
         self.Id = streamId
@@ -71,6 +177,11 @@ class OctoWebStreamHttpHelper:
         self.UploadBytesReceivedSoFar = 0
         self.UploadBuffer = None
 
+        # If this is not None, the upload is being streamed into the local http request, which runs on the upload thread.
+        self.StreamingUploadBody:StreamingUploadBody = None
+        self.StreamingUploadThread:threading.Thread = None
+        self.StreamingUploadException:Exception = None
+
         # Unknown body size chunk reader
         # If this is not None, we are doing the unknown body read. Then the rest of the body reads must use this same system.
         self.UnknownBodyChunkReadContext:UnknownBodyChunkReadContext = None
@@ -94,6 +205,10 @@ class OctoWebStreamHttpHelper:
         fullStreamUploadSize = webStreamOpenMsg.FullStreamDataSize()
         if fullStreamUploadSize > 0:
             self.KnownFullStreamUploadSizeBytes = fullStreamUploadSize
+            # For large uploads, we stream the data into the local request so we never need the full upload in memory.
+            # We only do this when the size is known, since the local request needs a content-length.
+            if fullStreamUploadSize >= OctoWebStreamHttpHelper.c_StreamingUploadMinSizeBytes:
+                self.StreamingUploadBody = StreamingUploadBody(fullStreamUploadSize)
 
 
     # When close is called, all http operations should be shutdown.
@@ -110,6 +225,22 @@ class OctoWebStreamHttpHelper:
             with self.UnknownBodyChunkReadContext.BufferLock:
                 self.UnknownBodyChunkReadContext.BufferDataReadyEvent.set()
 
+        # If we are streaming an upload, this will unblock the upload thread and anything waiting on the body.
+        if self.StreamingUploadBody is not None:
+            self.StreamingUploadBody.Close()
+
+
+    # Called by the main socket receive thread before an incoming message is queued for this stream, so it must not block.
+    # If we are streaming an upload, this tracks how much of it is queued on the stream and returns false if that's over the limit,
+    # in which case the stream must be closed, since the local server isn't keeping up with the upload.
+    def OnUploadMessageQueued(self, webStreamMsg:WebStreamMsg.WebStreamMsg) -> bool:
+        if self.StreamingUploadBody is None:
+            return True
+        if self.StreamingUploadBody.OnMessageQueued(webStreamMsg.DataLength()) is False:
+            self.Logger.warn(self.getLogMsgPrefix() + " the local server isn't keeping up with the streaming upload, closing the stream. Queued bytes:"+str(self.StreamingUploadBody.QueuedBytes))
+            return False
+        return True
+
 
     # Called when a new message has arrived for this stream from the server.
     # This function should throw on critical errors, that will reset the connection.
@@ -119,6 +250,10 @@ class OctoWebStreamHttpHelper:
         # Note this is called on a single thread and will always handle messages
         # in order as they were sent.
 
+        # Large uploads are streamed into the request, which is handled differently.
+        if self.StreamingUploadBody is not None:
+            return self.streamingUploadIncomingServerMessage(webStreamMsg)
+
         # This http call might have data sent to us in multiple messages.
         # If this message has data, put it into our buffer.
         if webStreamMsg.DataLength() > 0:
@@ -143,6 +278,72 @@ class OctoWebStreamHttpHelper:
         return False
 
 
+    # Handles incoming messages when the upload is being streamed into the local request.
+    # The http request is started on the first message, so the local server gets the upload data as it arrives.
+    def streamingUploadIncomingServerMessage(self, webStreamMsg:WebStreamMsg.WebStreamMsg):
+        if self.StreamingUploadThread is None:
+            self.StreamingUploadThread = threading.Thread(target=self.streamingUploadThread, name="OctoWebStreamUpload", daemon=True)
+            self.StreamingUploadThread.start()
+
+        # If the request hit a critical error, throw it on this thread so the connection is reset.
+        if self.StreamingUploadException is not None:
+            raise self.StreamingUploadException
+
+        if webStreamMsg.DataLength() > 0:
+            self.StreamingUploadBody.OnMessageDequeued(webStreamMsg.DataLength())
+            buf = self.decompressBufferIfNeeded(webStreamMsg)
+            if len(buf) + self.UploadBytesReceivedSoFar > self.KnownFullStreamUploadSizeBytes:
+                self.Logger.warn(self.getLogMsgPrefix() + " received more bytes than it was expecting for the upload. thisMsg:"+str(len(buf))+"; so far:"+str(self.UploadBytesReceivedSoFar) + "; expected:"+str(self.KnownFullStreamUploadSizeBytes))
+                raise Exception("Too many bytes received for http upload buffer")
+            self.UploadBytesReceivedSoFar += len(buf)
+            # This blocks this stream's thread while the local server catches up, the rest of the messages wait in this stream's queue.
+            # If the local server stops taking data, the stream is closed, which makes the server fail the upload.
+            if self.StreamingUploadBody.AddData(buf) is False:
+                self.Logger.warn(self.getLogMsgPrefix() + " the local server stopped taking the streaming upload data, closing the stream.")
+                return True
+
+        if webStreamMsg.IsDataTransmissionDone():
+            self.StreamingUploadBody.SetDone()
+            # Like the non streaming path, block this thread until the request is done and the entire response is sent.
+            # We want to make sure we destroy the compression context after this returns, no matter what.
+            with self.CompressionContext:
+                self.StreamingUploadThread.join()
+            if self.StreamingUploadException is not None:
+                raise self.StreamingUploadException
+            # Return true since this stream is now done
+            return True
+
+        # Return false since there should be more to this stream.
+        return False
+
+
+    # Returns true if the response handler might want to edit the response of this request.
+    def responseMightBeHandled(self, httpInitialContext) -> bool:
+        if Compat.HasWebRequestResponseHandler() is False:
+            return False
+        path = OctoStreamMsgBuilder.BytesToString(httpInitialContext.Path())
+        if path is None:
+            return False
+        return Compat.GetWebRequestResponseHandler().CheckIfResponseNeedsToBeHandled(path) is not None
+
+
+    # Runs the http request for a streaming upload, the request body is read from the StreamingUploadBody as the data arrives.
+    def streamingUploadThread(self):
+        try:
+            self.executeHttpRequest()
+        except Exception as e:
+            # The web stream will throw this on the next message, which will reset the connection.
+            self.StreamingUploadException = e
+        finally:
+            # The request is done, so no one will read any more of the upload.
+            # This unblocks the web stream thread and drops any data that's still coming in.
+            self.StreamingUploadBody.Close()
+        # If the local server responded before the upload was done, the response has already been sent, so close the stream.
+        # If the upload is done, the web stream thread will close the stream when it sees the request is done.
+        if self.StreamingUploadException is None and self.StreamingUploadBody.IsDone() is False:
+            self.WebStream.Close()
+
+
     # This function either needs to throw (which will restart the entire connection)
     # or return a WebStreamMsg, or close the web stream. Otherwise the server will be waiting for it
     # for until it hits a timeout.
@@ -157,7 +358,8 @@ class OctoWebStreamHttpHelper:
         if self.WebStreamOpenMsg is None:
             raise Exception("ExecuteHttpRequest but there is no open message")
         # Make sure if there was a defined upload size, we have all of the data.
-        if self.KnownFullStreamUploadSizeBytes is not None:
+        # For streaming uploads, the body itself makes sure all of the data is sent.
+        if self.KnownFullStreamUploadSizeBytes is not None and self.StreamingUploadBody is None:
             if self.UploadBytesReceivedSoFar != self.KnownFullStreamUploadSizeBytes:
                 raise Exception("Http request tried to execute, but we haven't gotten all of the upload payload. Total:"+str(self.KnownFullStreamUploadSizeBytes)+"; rec so far:"+str(self.UploadBytesReceivedSoFar))
 
@@ -182,9 +384,6 @@ class OctoWebStreamHttpHelper:
             self.Logger.error(self.getLogMsgPrefix()+" request had a None method type.")
             raise Exception("Http request had a None method type")
 
-        # Before we make the request, make sure we shouldn't defer for a high pri request
-        self.checkForDelayIfNotHighPri()
-
         # Before we handle the request, see if this is a webcam stream request we need to handle specially.
         if Compat.HasRelayWebcamStreamDetector():
             relativeOrAbsolutePath = OctoStreamMsgBuilder.BytesToString(httpInitialContext.Path())
@@ -195,15 +394,17 @@ class OctoWebStreamHttpHelper:
         #
         # 1) An oracle snapshot or webcam stream request. In this case the WebCamHelper class will handle the request.
         # 2) If the request is a OctoStreamCommand, the CommandHandler will handle the request.
-        # 3) Finally, check if the request is cached in Slipstream.
+        # 3) Finally, check if the request is cached in Slipstream or the asset cache.
         octoHttpResult = None
         isFromCache = False
+        isWebcamRequest = False
         if WebcamHelper.Get().IsSnapshotOrWebcamStreamOracleRequest(sendHeaders):
-            octoHttpResult = WebcamHelper.Get().MakeSnapshotOrWebcamStreamRequest(httpInitialContext, method, sendHeaders, self.UploadBuffer)
+            isWebcamRequest = True
+            octoHttpResult = WebcamHelper.Get().MakeSnapshotOrWebcamStreamRequest(httpInitialContext, method, sendHeaders, self.getFullUploadBuffer())
         # If this is a special command for OctoEverywhere, we handle it differently.
         elif CommandHandler.Get().IsCommandRequest(httpInitialContext):
             # This HandleCommand wil return a mock  OctoHttpResult, including a full mock response object.
-            octoHttpResult = CommandHandler.Get().HandleCommand(httpInitialContext, self.UploadBuffer)
+            octoHttpResult = CommandHandler.Get().HandleCommand(httpInitialContext, self.getFullUploadBuffer())
         else:
             # This is a normal web request, first ensure they are allowed.
             # Note we must always allow absolute paths, since these can be services like Spoolman or OctoFarm.
@@ -222,8 +423,23 @@ class OctoWebStreamHttpHelper:
             if octoHttpResult is not None:
                 isFromCache = True
             else:
-                # If we don't have a valid result yet, do the normal http path.
-                octoHttpResult = OctoHttpRequest.MakeHttpCallOctoStreamHelper(self.Logger, httpInitialContext, method, sendHeaders, self.UploadBuffer)
+                # Next check the asset cache, on a hit the result has the pre-compressed body and no local request is needed.
+                # If the asset can be cached but isn't a hit, the lookup might have added conditional headers to revalidate the cached copy.
+                # Note the asset cache builds a new result for each hit, so unlike Slipstream it's fine to convert it to a 304.
+                # Responses the response handler might edit aren't cached, since the handler needs the full uncompressed body.
+                assetCacheLookup = None
+                if AssetCache.Get() is not None and self.responseMightBeHandled(httpInitialContext) is False:
+                    assetCacheLookup = AssetCache.Get().Lookup(httpInitialContext, method, sendHeaders)
+                if assetCacheLookup is not None and assetCacheLookup.Result is not None:
+                    octoHttpResult = assetCacheLookup.Result
+                else:
+                    # If we don't have a valid result yet, do the normal http path.
+                    # For streaming uploads, the body is read as the request is sent.
+                    uploadData = self.UploadBuffer if self.StreamingUploadBody is None else self.StreamingUploadBody
+                    requestHeaders = sendHeaders if assetCacheLookup is None else assetCacheLookup.SendHeaders
+                    octoHttpResult = OctoHttpRequest.MakeHttpCallOctoStreamHelper(self.Logger, httpInitialContext, method, requestHeaders, uploadData)
+                    if assetCacheLookup is not None:
+                        octoHttpResult = AssetCache.Get().OnResponse(assetCacheLookup, octoHttpResult)
 
 
         # If None is returned, it failed.
@@ -319,11 +535,23 @@ class OctoWebStreamHttpHelper:
                     # So when the web server responds back with a 301 or 302, the location header might not have the correct hostname, instead an ip like 127.0.0.1.
                     octoHttpResult.Headers[name] = HeaderHelper.CorrectLocationResponseHeaderIfNeeded(self.Logger, uri, value, sendHeaders)
 
+            # Now that we know what the response is, update the class used to schedule the messages we send.
+            self.WebStream.SetSendClass(OctoWebStreamSendScheduler.GetClassForHttpResponse(self.WebStream.SendClass, isWebcamRequest, contentTypeLower, contentLength, boundaryStr))
+
             # We also look at the content-type to determine if we should add compression to this request or not.
             # general rule of thumb is that compression is quite cheap but really helps with text, so we should compress when we
             # can.
             compressBody = self.shouldCompressBody(contentTypeLower, octoHttpResult, contentLength)
 
+            # If we are going to compress the body, let the session pick the level based on how fast we can compress and send.
+            # If sending is faster than compressing, it might decide we shouldn't compress at all.
+            if compressBody and octoHttpResult.BodyBufferCompressionType == DataCompression.DataCompression.None_:
+                compressionLevel = self.WebStream.OctoSession.AdaptiveCompression.GetCompressionLevel()
+                if compressionLevel == AdaptiveCompression.NoCompression:
+                    compressBody = False
+                else:
+                    self.CompressionContext.SetCompressionLevel(compressionLevel)
+
             # If the content length is known, tell the compression system, which will help performance.
             if contentLength is not None:
                 self.CompressionContext.SetTotalCompressedSizeOfData(contentLength)
@@ -349,9 +577,6 @@ class OctoWebStreamHttpHelper:
             # We don't check th body read sizes here, because we don't want to duplicate that logic check.
             while self.IsClosed is False and isLastMessage is False:
 
-                # Before we process the response, make sure we shouldn't defer for a high pri request
-                self.checkForDelayIfNotHighPri()
-
                 # This is an interesting check. If we are spinning to deliver a http body, and we detect that what we are compressing
                 # is larger than the OG body, we will disable compression for all future messages. We do this because any files that's already
                 # compressed (video, audio, images, or files) will be the same after compression but with overhead added.
@@ -495,7 +720,7 @@ class OctoWebStreamHttpHelper:
                 # Send the message.
                 # If this is the last, we need to make sure to set that we have set the closed flag.
                 serviceSendStartSec = time.time()
-                self.WebStream.SendToOctoStream(buffer, msgStartOffsetBytes, msgSizeBytes, isLastMessage, True)
+                self.WebStream.SendToOctoStream(buffer, msgStartOffsetBytes, msgSizeBytes, isLastMessage, True, builderContext.GetSentCallback())
                 thisServiceSendTimeSec = time.time() - serviceSendStartSec
                 self.ServiceUploadTimeSec += thisServiceSendTimeSec
                 if thisServiceSendTimeSec > self.ServiceUploadTimeHighWaterMarkSec:
@@ -504,7 +729,7 @@ class OctoWebStreamHttpHelper:
                 # Do a debug check to see if our pre-allocated flatbuffer size was too small.
                 # If this fires often, we should increase the c_MsgStreamOverheadSize size.
                 finalFullBufferBytes = len(buffer)
-                if finalFullBufferBytes > lastBodyReadLength + builderContext.c_MsgStreamOverheadSize and self.Logger.isEnabledFor(logging.DEBUG):
+                if finalFullBufferBytes > builderContext.BuilderInitialSizeBytes and self.Logger.isEnabledFor(logging.DEBUG):
                     delta = msgSizeBytes - (lastBodyReadLength + builderContext.c_MsgStreamOverheadSize)
                     self.Logger.warn(f"The flatbuffer internal buffer had to be resized from the guess we set. Flatbuffer full buffer size: {finalFullBufferBytes}, last body read length: {lastBodyReadLength}; overage delta: {delta}")
 
@@ -571,6 +796,14 @@ class OctoWebStreamHttpHelper:
             self.UploadBuffer = self.UploadBuffer[0:self.UploadBytesReceivedSoFar]
 
 
+    # Returns the full upload buffer, for the special case handlers that need all of the data at once.
+    def getFullUploadBuffer(self):
+        if self.StreamingUploadBody is None:
+            return self.UploadBuffer
+        # This is only hit if a large upload is sent to a special handler, so we have to build the full buffer.
+        return self.StreamingUploadBody.ReadAll()
+
+
     def copyUploadDataFromMsg(self, webStreamMsg:WebStreamMsg.WebStreamMsg):
         # Check how much data this message has in it.
         # This size is the size of the full buffer, which is decompressed size if the data is compressed.
@@ -606,7 +839,10 @@ class OctoWebStreamHttpHelper:
                 newBufferSizeBytes = self.KnownFullStreamUploadSizeBytes
             else:
                 # If we don't know the size, allocate this message plus the current size, plus some buffer (50kb).
+                # We also at least double the buffer, so large uploads don't need to re-allocate and copy on every message.
                 newBufferSizeBytes = thisMessageDataLen + self.UploadBytesReceivedSoFar + 1204 * 50
+                if self.UploadBuffer is not None:
+                    newBufferSizeBytes = max(newBufferSizeBytes, len(self.UploadBuffer) * 2)
 
             # If there's a buffer, grab it since we need to copy it over
             oldBuffer = self.UploadBuffer
@@ -789,6 +1025,8 @@ class OctoWebStreamHttpHelper:
         # Some requests like snapshot requests will already have a fully read body. In this case we use the existing body buffer instead of reading from the body.
         finalDataBuffer = None
         finalDataBufferMv_CanBeNone = None
+        directReadBytes = 0
+        directReadDataOffset = None
         try:
             bodyReadStartSec = time.time()
             if self.IsUsingFullBodyBuffer:
@@ -831,7 +1069,14 @@ class OctoWebStreamHttpHelper:
                             else:
                                 # Use a 2mb buffer.
                                 defaultBodyReadSizeBytes = 1024 * 1024 * 2
-                        finalDataBuffer = self.doBodyRead(octoHttpResult, defaultBodyReadSizeBytes)
+                        # If the body doesn't need to be edited or compressed, read it directly into the message data vector.
+                        # This saves allocating a new buffer and copying the body into the message for every read, which adds up for large downloads.
+                        directReadBytes = 0
+                        if responseHandlerContext is None and shouldCompress is False:
+                            directReadBytes, directReadDataOffset = self.doBodyReadIntoDataVector(builderContext, octoHttpResult, defaultBodyReadSizeBytes)
+                        if directReadBytes == 0:
+                            # Nothing was read directly, so do a normal read, which also handles bodies that can't be streamed.
+                            finalDataBuffer = self.doBodyRead(octoHttpResult, defaultBodyReadSizeBytes)
 
             # Keep track of read times.
             thisBodyReadTimeSec = time.time() - bodyReadStartSec
@@ -839,6 +1084,10 @@ class OctoWebStreamHttpHelper:
             if thisBodyReadTimeSec > self.BodyReadTimeHighWaterMarkSec:
                 self.BodyReadTimeHighWaterMarkSec = thisBodyReadTimeSec
 
+            # If the body was read directly into the message, it's done.
+            if directReadBytes is not None and directReadBytes > 0:
+                return (directReadBytes, directReadBytes, directReadDataOffset)
+
             # If the final data buffer has been set to None, it means the body is not empty
             if finalDataBuffer is None:
                 # Return empty to indicate the body has been fully read.
@@ -1092,24 +1341,60 @@ class OctoWebStreamHttpHelper:
             # Otherwise we are done, return None to end the octostream.
             return None
 
-        except requests.exceptions.ChunkedEncodingError as _:
-            # This shouldn't happen now that we don't use the iter_content read, but it doesn't hurt.
+        except Exception as e:
+            self.handleBodyReadException("doBodyRead", e)
             return None
-        except requests.exceptions.StreamConsumedError as _:
+
+
+    # Like doBodyRead, but the body is read directly into the message data vector, so there's no buffer to allocate and copy into the message.
+    # Returns the read size and the data vector offset.
+    # If nothing was read, the read size is 0 and the builder isn't created, so doBodyRead should be used to check for a body that can't be streamed.
+    # If the body read is done because of an error, the read size is None.
+    def doBodyReadIntoDataVector(self, builderContext:MsgBuilderContext, octoHttpResult:OctoHttpRequest.Result, readSize:int):
+        try:
+            # Ensure there's an actual requests lib Response object to read from
+            response = octoHttpResult.ResponseForBodyRead
+            if response is None:
+                raise Exception("doBodyReadIntoDataVector was called with a result that has not Response object to read from.")
+
+            # Like doBodyRead, this will block until the full read size is read or the body is done.
+            readBytes = 0
+            builderContext.CreateBuilder(readSize)
+            vectorMv = builderContext.ReserveDataVector(readSize)
+            try:
+                readBytes = response.raw.readinto(vectorMv)
+            finally:
+                vectorMv.release()
+
+            if readBytes is None or readBytes <= 0:
+                builderContext.DiscardBuilder()
+                return (0, None)
+            return (readBytes, builderContext.FinishDataVector(readBytes))
+
+        except Exception as e:
+            builderContext.DiscardBuilder()
+            self.handleBodyReadException("doBodyReadIntoDataVector", e)
+            return (None, None)
+
+
+    # Handles exceptions from reading the http response body, all of them end the body read.
+    def handleBodyReadException(self, funcName:str, e:Exception):
+        if isinstance(e, requests.exceptions.ChunkedEncodingError):
+            # This shouldn't happen now that we don't use the iter_content read, but it doesn't hurt.
+            return
+        if isinstance(e, requests.exceptions.StreamConsumedError):
             # When this exception is thrown, it means the entire body has been read.
-            return None
-        except urllib3.exceptions.ReadTimeoutError as _:
+            return
+        if isinstance(e, urllib3.exceptions.ReadTimeoutError):
             # Fired then the read times out, this should just close the stream.
             # TODO - this will leave this stream with an incomplete body size, we should indicate that to the server.
-            return None
-        except Exception as e:
-            # There doesn't seem to be an exception type for this one, so we will just catch it like this.
-            if "IncompleteRead" in str(e):
-                # Don't do the entire sentry exception print, since it's too long.
-                self.Logger.warn("doBodyRead failed with an IncompleteRead, so the stream is done.")
-                return None
-            Sentry.Exception(self.getLogMsgPrefix()+ " exception thrown in doBodyRead. Ending body read.", e)
-            return None
+            return
+        # There doesn't seem to be an exception type for this one, so we will just catch it like this.
+        if "IncompleteRead" in str(e):
+            # Don't do the entire sentry exception print, since it's too long.
+            self.Logger.warn(f"{funcName} failed with an IncompleteRead, so the stream is done.")
+            return
+        Sentry.Exception(self.getLogMsgPrefix()+ f" exception thrown in {funcName}. Ending body read.", e)
 
 
     def doUnknownBodyChunkReadThread(self):
@@ -1298,17 +1583,6 @@ class OctoWebStreamHttpHelper:
         return True
 
 
-    # To speed up page load, we will defer lower pri requests while higher priority requests
-    # are executing.
-    def checkForDelayIfNotHighPri(self):
-        # This isn't used at all right now.
-        pass
-        # Allow anything above Normal priority to always execute
-        # if self.WebStreamOpenMsg.MsgPriority() < MessagePriority.MessagePriority.Normal:
-        #     return
-        # # Otherwise, we want to block for a bit if there's a high pri stream processing.
-        # self.WebStream.BlockIfHighPriStreamActive()
-
     # Formatting helper.
     def _FormatFloat(self, value:float) -> str:
         return str(format(value, '.3f'))
@@ -1329,3 +1603,134 @@ class UnknownBodyChunkReadContext:
         # Set to true when the read is done either from the end of the body or an error.
         # Once true, it will never read again, but we do need to process the BufferList
         self.ReadComplete = False
+
+
+#
+# The request body for a streaming upload.
+#
+# The web stream thread adds the upload data as it arrives and the http request reads it as it's sent to the local server.
+# The amount of data that's waiting to be sent is bounded, when it's full the stream's thread waits and the rest of the upload
+# messages wait in the stream's queue. The main socket receive thread never waits, since that would stall every stream on the session.
+# There's no way to push back on the server, so if too much of the upload is queued on the stream, it's closed and the upload fails.
+#
+# The body has a length, so requests will send it with a content-length rather than using a chunked transfer encoding.
+#
+class StreamingUploadBody:
+
+    # The max amount of upload data that can be waiting to be sent to the local server.
+    c_MaxBufferedBytes = 2 * 1024 * 1024
+
+    # The max amount of upload data that can be queued on the stream, waiting for room in the buffer.
+    # The local server is usually much faster than the upload, so this is only hit if it's stuck or very slow.
+    c_MaxQueuedBytes = 16 * 1024 * 1024
+
+    # The max time the stream's thread will wait for the local server to take some data before the upload fails.
+    c_MaxStallSec = 10.0
+
+    def __init__(self, totalSizeBytes:int) -> None:
+        self.TotalSizeBytes = totalSizeBytes
+        self.Lock = threading.Condition()
+        self.Chunks = collections.deque()
+        self.BufferedBytes = 0
+        self.QueuedBytes = 0
+        self.SentBytes = 0
+        self.IsDataDone = False
+        self.IsClosed = False
+
+
+    # Used by requests to set the content-length.
+    def __len__(self) -> int:
+        return self.TotalSizeBytes
+
+
+    # Used by the http request to know if the body can be sent again after a failed attempt.
+    # The data is only kept until it's sent, so if any of it has been read, it can't be sent again.
+    def CanBeResent(self) -> bool:
+        with self.Lock:
+            return self.SentBytes == 0
+
+
+    # Called by the http request as it sends the body.
+    def __iter__(self):
+        with self.Lock:
+            if self.SentBytes != 0:
+                raise Exception("The streaming upload body can't be sent again after some of it was sent.")
+        while True:
+            chunk = None
+            with self.Lock:
+                while len(self.Chunks) == 0 and self.IsDataDone is False and self.IsClosed is False:
+                    self.Lock.wait()
+                if self.IsClosed:
+                    raise Exception("The streaming upload was closed before all of the data was sent.")
+                if len(self.Chunks) == 0:
+                    if self.SentBytes != self.TotalSizeBytes:
+                        raise Exception("The streaming upload is done but not all of the data was sent. Total:"+str(self.TotalSizeBytes)+"; sent:"+str(self.SentBytes))
+                    return
+                chunk = self.Chunks.popleft()
+                self.BufferedBytes -= len(chunk)
+                self.SentBytes += len(chunk)
+                # Let the web stream thread know there's room.
+                self.Lock.notify_all()
+            yield chunk
+
+
+    # Called by the web stream thread when upload data arrives, blocks while the buffer is full.
+    # Returns false if the local server didn't take any data for too long.
+    def AddData(self, buf) -> bool:
+        with self.Lock:
+            while self.IsClosed is False and self.BufferedBytes >= StreamingUploadBody.c_MaxBufferedBytes:
+                sentBytes = self.SentBytes
+                if self.Lock.wait_for(lambda: self.IsClosed or self.BufferedBytes < StreamingUploadBody.c_MaxBufferedBytes or self.SentBytes != sentBytes, StreamingUploadBody.c_MaxStallSec) is False:
+                    return False
+            # If the request is done, no one will read this.
+            if self.IsClosed:
+                return True
+            self.Chunks.append(buf)
+            self.BufferedBytes += len(buf)
+            self.Lock.notify_all()
+        return True
+
+
+    # Called by the main socket receive thread when an upload message is queued for the stream.
+    # Returns false if too much of the upload is queued.
+    def OnMessageQueued(self, sizeBytes:int) -> bool:
+        with self.Lock:
+            self.QueuedBytes += sizeBytes
+            return self.QueuedBytes <= StreamingUploadBody.c_MaxQueuedBytes
+
+
+    # Called by the web stream thread when it takes an upload message off of the queue.
+    def OnMessageDequeued(self, sizeBytes:int) -> None:
+        with self.Lock:
+            # Messages that were queued before the http helper was created weren't counted.
+            self.QueuedBytes = max(0, self.QueuedBytes - sizeBytes)
+
+
+    # Called by the web stream thread when all of the upload data has arrived.
+    def SetDone(self) -> None:
+        with self.Lock:
+            self.IsDataDone = True
+            self.Lock.notify_all()
+
+
+    def IsDone(self) -> bool:
+        return self.IsDataDone
+
+
+    # Called when the request or the stream is done.
+    def Close(self) -> None:
+        with self.Lock:
+            self.IsClosed = True
+            self.Chunks.clear()
+            self.BufferedBytes = 0
+            self.Lock.notify_all()
+
+
+    # Reads the entire upload into one buffer.
+    def ReadAll(self) -> bytearray:
+        buffer = bytearray(self.TotalSizeBytes)
+        pos = 0
+        for chunk in self:
+            buffer[pos:pos+len(chunk)] = chunk
+            pos += len(chunk)
+        return buffer
@@ -0,0 +1,323 @@
+# namespace: WebStream
+
+import time
+import logging
+import threading
+import collections
+
+from ..sentry import Sentry
+from ..Proto import MessagePriority
+
+#
+# Schedules the web stream messages that are sent on the session's websocket.
+#
+# All of the web streams share one websocket to the service, and the websocket sends messages in the order they are queued.
+# Without scheduling, a big download or a busy page load queues megabytes of data in front of a webcam frame or an api call,
+# and the frame has to wait until all of it has been sent.
+#
+# Each stream gets its own queue and is put into a send class, which has a weight. The messages are sent using weighted fair queuing,
+# so when streams are competing for the websocket, each class gets a share of the bandwidth in proportion to its weight. Streams in the
+# same class share it equally, and when only one stream is sending it gets all of it.
+#
+# Only a small window of data is handed to the websocket at a time, the rest waits in the stream queues so the scheduler can pick what goes next.
+# The next messages are sent when the websocket tells us the last ones have been sent, so there's no polling or sleeping.
+# If a stream has too much data queued, the stream's thread is blocked until some of it has been sent, which keeps big downloads from reading
+# the entire body into memory while other streams are using the bandwidth.
+#
+class OctoWebStreamSendScheduler:
+
+    # The send classes, with their weights.
+    ClassWebcam = "Webcam"
+    ClassApi = "Api"
+    ClassStatic = "Static"
+    ClassBulk = "Bulk"
+    ClassWeights = {ClassWebcam: 8.0, ClassApi: 4.0, ClassStatic: 2.0, ClassBulk: 1.0}
+
+    # Responses larger than this are bulk downloads, like gcode files and timelapses.
+    BulkMinContentLengthBytes = 5 * 1024 * 1024
+
+    # Content types that are static web assets.
+    StaticContentTypePrefixes = ("text/html", "text/css", "text/javascript", "application/javascript", "application/x-javascript", "image/", "font/", "application/font", "application/wasm")
+
+    # The amount of data handed to the websocket at once is about this much send time, based on the measured send throughput.
+    InFlightTargetSec = 0.05
+    MinInFlightBytes = 128 * 1024
+    MaxInFlightBytes = 2 * 1024 * 1024
+    # Used until the send throughput is known.
+    DefaultInFlightBytes = 1024 * 1024
+
+    # If a stream has this much data queued, its thread is blocked until some of it has been sent.
+    MaxQueuedBytesPerStream = 1024 * 1024
+
+    # How often a blocked stream thread checks if the stream has been closed.
+    CapacityWaitCheckSec = 1.0
+
+
+    def __init__(self, logger:logging.Logger, sendFunc, getSendBytesPerSecFunc, onSendErrorFunc) -> None:
+        self.Logger = logger
+        self.SendFunc = sendFunc
+        self.GetSendBytesPerSecFunc = getSendBytesPerSecFunc
+        self.OnSendErrorFunc = onSendErrorFunc
+        self.Lock = threading.Lock()
+        self.CapacityAvailable = threading.Condition(self.Lock)
+        self.IsClosed = False
+        # The stream queues, by stream id.
+        self.StreamQueues = {}
+        self.InFlightBytes = 0
+        self.IsDispatching = False
+        self.DispatchAgain = False
+        # The virtual time of the fair queue, it's the finish tag of the last message sent.
+        self.VirtualTime = 0.0
+        self.ClassStats = {sendClass: SendClassStats() for sendClass in OctoWebStreamSendScheduler.ClassWeights}
+
+
+    # Returns the send class for a new stream, before we know anything about the response.
+    @staticmethod
+    def GetClassForOpenMsg(msgPriority:int) -> str:
+        if msgPriority < MessagePriority.MessagePriority.Normal:
+            # The service marks webcam streams as high priority.
+            return OctoWebStreamSendScheduler.ClassWebcam
+        if msgPriority >= MessagePriority.MessagePriority.Background:
+            return OctoWebStreamSendScheduler.ClassBulk
+        # Until we know more, everything else is an api call. This includes websocket streams, which are used by the frontends for live printer updates.
+        return OctoWebStreamSendScheduler.ClassApi
+
+
+    # Returns the send class for a http response.
+    @staticmethod
+    def GetClassForHttpResponse(currentClass:str, isWebcamRequest:bool, contentTypeLower_CanBeNone:str, contentLength_CanBeNone:int, boundaryStr_CanBeNone:str) -> str:
+        if currentClass == OctoWebStreamSendScheduler.ClassWebcam or isWebcamRequest:
+            return OctoWebStreamSendScheduler.ClassWebcam
+        # Multipart streams are webcam streams.
+        if boundaryStr_CanBeNone is not None and len(boundaryStr_CanBeNone) > 0:
+            return OctoWebStreamSendScheduler.ClassWebcam
+        if contentLength_CanBeNone is not None and contentLength_CanBeNone >= OctoWebStreamSendScheduler.BulkMinContentLengthBytes:
+            return OctoWebStreamSendScheduler.ClassBulk
+        if contentTypeLower_CanBeNone is not None:
+            if contentTypeLower_CanBeNone.startswith("application/octet-stream"):
+                return OctoWebStreamSendScheduler.ClassBulk
+            if contentTypeLower_CanBeNone.startswith(OctoWebStreamSendScheduler.StaticContentTypePrefixes):
+                return OctoWebStreamSendScheduler.ClassStatic
+        return currentClass
+
+
+    # Queues a message for the stream, it will be sent when it's the stream's turn.
+    # If the optional sentCallback is set, it's called once the message has been sent and the buffer can be reused.
+    def Send(self, streamId:int, sendClass:str, buffer:bytearray, msgStartOffsetBytes:int, msgSize:int, sentCallback = None) -> None:
+        isQueued = False
+        with self.Lock:
+            if self.IsClosed is False:
+                isQueued = True
+                streamQueue = self.StreamQueues.get(streamId, None)
+                if streamQueue is None:
+                    streamQueue = StreamSendQueue(streamId)
+                    self.StreamQueues[streamId] = streamQueue
+                # The finish tag is when the message would be done sending if the stream got its share of the bandwidth.
+                weight = OctoWebStreamSendScheduler.ClassWeights.get(sendClass, 1.0)
+                startTag = max(self.VirtualTime, streamQueue.LastFinishTag)
+                streamQueue.LastFinishTag = startTag + float(msgSize) / weight
+                streamQueue.Msgs.append(QueuedSendMsg(buffer, msgStartOffsetBytes, msgSize, sentCallback, sendClass, streamQueue.LastFinishTag))
+                streamQueue.QueuedBytes += msgSize
+                stats = self.ClassStats[sendClass]
+                stats.QueuedBytes += msgSize
+                stats.QueuedMsgs += 1
+        if isQueued is False:
+            # The session is going down, just pass it along.
+            if self._SendMsgs([(buffer, msgStartOffsetBytes, msgSize, sentCallback)]) is False:
+                self.OnSendErrorFunc()
+            return
+        self._Dispatch()
+
+
+    # Called by the stream threads before they read more data to send.
+    # If the stream has too much data queued, this blocks until some of it has been sent.
+    def WaitForCapacity(self, webStream) -> None:
+        with self.Lock:
+            while self.IsClosed is False and webStream.IsClosed is False:
+                streamQueue = self.StreamQueues.get(webStream.Id, None)
+                if streamQueue is None or streamQueue.QueuedBytes < OctoWebStreamSendScheduler.MaxQueuedBytesPerStream:
+                    return
+                self.CapacityAvailable.wait(OctoWebStreamSendScheduler.CapacityWaitCheckSec)
+
+
+    # Called when a stream closes, so if the stream's thread is blocked waiting for capacity it returns right away.
+    def OnStreamClosed(self) -> None:
+        with self.Lock:
+            self.CapacityAvailable.notify_all()
+
+
+    # Called when the session is closing. Any queued messages are sent and new messages are no longer scheduled.
+    def Close(self) -> None:
+        toSend = []
+        with self.Lock:
+            if self.IsClosed:
+                return
+            self.IsClosed = True
+            for streamQueue in self.StreamQueues.values():
+                for msg in streamQueue.Msgs:
+                    toSend.append((msg.Buffer, msg.MsgStartOffsetBytes, msg.MsgSize, msg.SentCallback))
+            self.StreamQueues.clear()
+            for stats in self.ClassStats.values():
+                stats.QueuedBytes = 0
+                stats.QueuedMsgs = 0
+            self.CapacityAvailable.notify_all()
+        self._SendMsgs(toSend)
+
+
+    # Returns the current state of the scheduler, with the queued bytes, sent bytes, and wait times per send class. Used for debugging.
+    # The max wait time is the high water mark since the last call.
+    def GetStats(self) -> dict:
+        with self.Lock:
+            result = {
+                "InFlightBytes": self.InFlightBytes,
+                "Streams": len(self.StreamQueues),
+            }
+            for sendClass, stats in self.ClassStats.items():
+                result[sendClass] = {
+                    "QueuedBytes": stats.QueuedBytes,
+                    "QueuedMsgs": stats.QueuedMsgs,
+                    "SentBytes": stats.SentBytes,
+                    "SentMsgs": stats.SentMsgs,
+                    "AvgWaitMs": round(stats.AvgWaitSec * 1000.0, 2),
+                    "MaxWaitMs": round(stats.MaxWaitSec * 1000.0, 2),
+                }
+                stats.MaxWaitSec = 0.0
+            return result
+
+
+    # Called on the websocket send thread when a message has been sent.
+    def _OnMsgSent(self, msgSize:int, sentCallback) -> None:
+        with self.Lock:
+            self.InFlightBytes -= msgSize
+        if sentCallback is not None:
+            sentCallback()
+        self._Dispatch()
+
+
+    # Hands messages to the websocket until the in flight window is full.
+    # Only one thread sends at a time, so the messages of a stream always stay in order. If another thread is already
+    # sending, it's told to check again, so the messages are handed off without holding the lock.
+    def _Dispatch(self) -> None:
+        with self.Lock:
+            if self.IsDispatching:
+                self.DispatchAgain = True
+                return
+            self.IsDispatching = True
+        try:
+            while True:
+                with self.Lock:
+                    toSend = []
+                    if self.IsClosed is False:
+                        toSend = self._GetMsgsToSend_UnderLock()
+                    if len(toSend) == 0 and self.DispatchAgain is False:
+                        self.IsDispatching = False
+                        return
+                    self.DispatchAgain = False
+                if self._SendMsgs(toSend) is False:
+                    self.OnSendErrorFunc()
+                    with self.Lock:
+                        self.IsDispatching = False
+                    return
+        except Exception as e:
+            Sentry.Exception("Web stream send scheduler exception while dispatching.", e)
+            with self.Lock:
+                self.IsDispatching = False
+
+
+    def _GetInFlightLimitBytes(self) -> int:
+        sendBytesPerSec = self.GetSendBytesPerSecFunc()
+        if sendBytesPerSec is None or sendBytesPerSec <= 0:
+            return OctoWebStreamSendScheduler.DefaultInFlightBytes
+        return int(min(OctoWebStreamSendScheduler.MaxInFlightBytes, max(OctoWebStreamSendScheduler.MinInFlightBytes, sendBytesPerSec * OctoWebStreamSendScheduler.InFlightTargetSec)))
+
+
+    # Picks the messages to send, in order, until the in flight window is full.
+    def _GetMsgsToSend_UnderLock(self) -> list:
+        toSend = []
+        limitBytes = None
+        now = None
+        while len(self.StreamQueues) > 0:
+            if self.InFlightBytes > 0:
+                if limitBytes is None:
+                    limitBytes = self._GetInFlightLimitBytes()
+                if self.InFlightBytes >= limitBytes:
+                    break
+            # Find the message with the lowest finish tag, there are only ever a few dozen streams.
+            bestQueue = None
+            for streamQueue in self.StreamQueues.values():
+                if len(streamQueue.Msgs) > 0 and (bestQueue is None or streamQueue.Msgs[0].FinishTag < bestQueue.Msgs[0].FinishTag):
+                    bestQueue = streamQueue
+            if bestQueue is None:
+                break
+            msg = bestQueue.Msgs.popleft()
+            bestQueue.QueuedBytes -= msg.MsgSize
+            # Empty queues are removed, their last finish tag is behind the virtual time so it's not needed anymore.
+            if len(bestQueue.Msgs) == 0:
+                del self.StreamQueues[bestQueue.StreamId]
+            self.VirtualTime = msg.FinishTag
+            self.InFlightBytes += msg.MsgSize
+
+            # Update the stats.
+            if now is None:
+                now = time.time()
+            waitSec = now - msg.QueuedTime
+            stats = self.ClassStats[msg.SendClass]
+            stats.QueuedBytes -= msg.MsgSize
+            stats.QueuedMsgs -= 1
+            stats.SentBytes += msg.MsgSize
+            stats.SentMsgs += 1
+            stats.AvgWaitSec = waitSec if stats.SentMsgs == 1 else stats.AvgWaitSec * 0.9 + waitSec * 0.1
+            stats.MaxWaitSec = max(stats.MaxWaitSec, waitSec)
+
+            # When this message has been sent, the next ones will be picked.
+            msgSize = msg.MsgSize
+            sentCallback = msg.SentCallback
+            toSend.append((msg.Buffer, msg.MsgStartOffsetBytes, msg.MsgSize, lambda s=msgSize, c=sentCallback: self._OnMsgSent(s, c)))
+        if len(toSend) > 0:
+            # Wake up any stream threads that are waiting for their queue to drain.
+            self.CapacityAvailable.notify_all()
+        return toSend
+
+
+    # Returns false if the send failed.
+    def _SendMsgs(self, toSend:list) -> bool:
+        try:
+            for buffer, msgStartOffsetBytes, msgSize, sentCallback in toSend:
+                self.SendFunc(buffer, msgStartOffsetBytes, msgSize, sentCallback)
+            return True
+        except Exception as e:
+            Sentry.Exception("Web stream send scheduler failed to send a message.", e)
+            return False
+
+
+# The queue of messages for one stream.
+class StreamSendQueue:
+
+    def __init__(self, streamId:int) -> None:
+        self.StreamId = streamId
+        self.Msgs = collections.deque()
+        self.QueuedBytes = 0
+        self.LastFinishTag = 0.0
+
+
+class QueuedSendMsg:
+
+    def __init__(self, buffer:bytearray, msgStartOffsetBytes:int, msgSize:int, sentCallback, sendClass:str, finishTag:float) -> None:
+        self.Buffer = buffer
+        self.MsgStartOffsetBytes = msgStartOffsetBytes
+        self.MsgSize = msgSize
+        self.SentCallback = sentCallback
+        self.SendClass = sendClass
+        self.FinishTag = finishTag
+        self.QueuedTime = time.time()
+
+
+class SendClassStats:
+
+    def __init__(self) -> None:
+        self.QueuedBytes = 0
+        self.QueuedMsgs = 0
+        self.SentBytes = 0
+        self.SentMsgs = 0
+        self.AvgWaitSec = 0.0
+        self.MaxWaitSec = 0.0
@@ -0,0 +1,170 @@
+# namespace: WebStream
+
+import time
+import logging
+import threading
+import collections
+
+from ..sentry import Sentry
+
+#
+# An alternative engine for web streams.
+#
+# By default every web stream gets its own thread that waits on the stream's message queue for the stream's whole lifetime.
+# A page load opens dozens of streams at once, and websocket streams stay open, so most of those threads only sit idle.
+#
+# With the worker pool, the web streams don't have threads. Incoming messages are queued on the stream and the stream
+# is scheduled on a shared set of worker threads. Each stream is only processed by one worker at a time, so the messages
+# of a stream are still handled in order, exactly like the dedicated thread would. Threads are only needed while a stream
+# is actually processing a message (like executing a http request), and idle workers are reused for the next streams.
+#
+# The number of workers is bounded, so when a page load opens many streams at once they wait in the ready queue instead
+# of all running at the same time. Some streams hold a worker for a long time (like webcam streams or long polling requests),
+# so if a stream has been waiting in the queue too long an extra worker is added, to ensure a stream is never starved.
+# The extra workers exit once they are idle.
+#
+class OctoWebStreamWorkerPool:
+
+    # The number of workers that process streams at the same time, they are kept around when idle.
+    DefaultMaxWorkers = 16
+
+    # If all of the workers are busy and a stream waited longer than this in the ready queue, an extra worker is added.
+    MaxQueueWaitSec = 0.5
+
+    # The max number of messages a stream will process before it's put back into the ready queue,
+    # so one very busy stream can't hold a worker while other streams are waiting.
+    MaxMessagesPerTurn = 16
+
+    _Instance = None
+
+    @staticmethod
+    def Init(logger:logging.Logger, maxWorkers:int = DefaultMaxWorkers):
+        OctoWebStreamWorkerPool._Instance = OctoWebStreamWorkerPool(logger, maxWorkers)
+
+
+    # Returns None if the worker pool engine isn't enabled.
+    @staticmethod
+    def Get():
+        return OctoWebStreamWorkerPool._Instance
+
+
+    def __init__(self, logger:logging.Logger, maxWorkers:int) -> None:
+        self.Logger = logger
+        self.MaxWorkers = max(1, maxWorkers)
+        self.Lock = threading.Lock()
+        self.WorkAvailable = threading.Condition(self.Lock)
+        self.OverflowCheck = threading.Condition(self.Lock)
+        self.OverflowMonitorThread = None
+        # Streams that have messages waiting and aren't being processed by a worker, with the time they were queued.
+        self.ReadyStreams = collections.deque()
+        self.WorkerCount = 0
+        self.IdleWorkerCount = 0
+        self.WorkerCountHighWaterMark = 0
+        self.OverflowWorkersAdded = 0
+        self.Logger.info("Web streams will use the worker pool engine. Max workers: "+str(self.MaxWorkers))
+
+
+    # Called on the main OctoSocket receive thread, so this must be quick.
+    def QueueMessage(self, webStream, webStreamMsg) -> None:
+        with self.Lock:
+            webStream.PooledMsgs.append(webStreamMsg)
+            if webStream.IsPoolScheduled:
+                # A worker has the stream or it's already waiting in the ready queue.
+                return
+            webStream.IsPoolScheduled = True
+            self.ReadyStreams.append((webStream, time.time()))
+            # Only start a new worker if all of the current ones are busy.
+            if len(self.ReadyStreams) > self.IdleWorkerCount:
+                if self.WorkerCount < self.MaxWorkers:
+                    self._StartWorker_UnderLock()
+                else:
+                    # All of the workers are busy, make sure the stream doesn't wait too long.
+                    self._StartOverflowMonitorIfNeeded_UnderLock()
+                    self.OverflowCheck.notify()
+            self.WorkAvailable.notify()
+
+
+    # Returns the current state of the pool, used for debugging and the load test.
+    def GetStats(self) -> dict:
+        with self.Lock:
+            return {
+                "Workers": self.WorkerCount,
+                "IdleWorkers": self.IdleWorkerCount,
+                "ReadyStreams": len(self.ReadyStreams),
+                "WorkersHighWaterMark": self.WorkerCountHighWaterMark,
+                "OverflowWorkersAdded": self.OverflowWorkersAdded,
+            }
+
+
+    def _StartWorker_UnderLock(self) -> None:
+        self.WorkerCount += 1
+        self.WorkerCountHighWaterMark = max(self.WorkerCountHighWaterMark, self.WorkerCount)
+        t = threading.Thread(target=self._WorkerThread, name="OctoWebStreamWorker", daemon=True)
+        t.start()
+
+
+    def _StartOverflowMonitorIfNeeded_UnderLock(self) -> None:
+        if self.OverflowMonitorThread is None:
+            self.OverflowMonitorThread = threading.Thread(target=self._OverflowMonitorThread, name="OctoWebStreamPoolMonitor", daemon=True)
+            self.OverflowMonitorThread.start()
+
+
+    # Adds an extra worker if the oldest ready stream has been waiting too long because all of the workers are busy.
+    def _OverflowMonitorThread(self) -> None:
+        with self.Lock:
+            while True:
+                if len(self.ReadyStreams) == 0 or self.WorkerCount < self.MaxWorkers or self.IdleWorkerCount > 0:
+                    self.OverflowCheck.wait()
+                    continue
+                waitedSec = time.time() - self.ReadyStreams[0][1]
+                if waitedSec < OctoWebStreamWorkerPool.MaxQueueWaitSec:
+                    self.OverflowCheck.wait(OctoWebStreamWorkerPool.MaxQueueWaitSec - waitedSec)
+                    continue
+                self.OverflowWorkersAdded += 1
+                self.Logger.info("Web stream worker pool adding an extra worker, all "+str(self.WorkerCount)+" workers are busy and a stream has waited "+str(round(waitedSec, 2))+"s")
+                self._StartWorker_UnderLock()
+                # Give the new worker time to pick up the stream before checking again.
+                self.OverflowCheck.wait(OctoWebStreamWorkerPool.MaxQueueWaitSec)
+
+
+    def _WorkerThread(self) -> None:
+        while True:
+            webStream = None
+            with self.Lock:
+                while len(self.ReadyStreams) == 0:
+                    # Extra workers that were added for long running streams exit once they are idle.
+                    if self.WorkerCount > self.MaxWorkers:
+                        self.WorkerCount -= 1
+                        return
+                    self.IdleWorkerCount += 1
+                    self.WorkAvailable.wait()
+                    self.IdleWorkerCount -= 1
+                webStream, _ = self.ReadyStreams.popleft()
+            try:
+                self._ProcessStream(webStream)
+            except Exception as e:
+                Sentry.Exception("Web stream worker pool exception while processing a stream.", e)
+
+
+    # Processes the stream's queued messages, in order.
+    def _ProcessStream(self, webStream) -> None:
+        processed = 0
+        while True:
+            webStreamMsg = None
+            with self.Lock:
+                if len(webStream.PooledMsgs) == 0:
+                    webStream.IsPoolScheduled = False
+                    return
+                if processed >= OctoWebStreamWorkerPool.MaxMessagesPerTurn:
+                    # Give the other streams a turn, this stream stays scheduled.
+                    self.ReadyStreams.append((webStream, time.time()))
+                    self.WorkAvailable.notify()
+                    return
+                webStreamMsg = webStream.PooledMsgs.popleft()
+            processed += 1
+            if webStream.ProcessPooledMessage(webStreamMsg):
+                # The stream is done, drop anything else that was queued.
+                with self.Lock:
+                    webStream.PooledMsgs.clear()
+                    # Leave the stream marked as scheduled so it's never queued again.
+                return
@@ -0,0 +1,182 @@
+import time
+import logging
+import threading
+
+from ..sentry import Sentry
+from ..octohttprequest import OctoHttpRequest
+
+#
+# Caches the latest snapshot from each camera, so snapshots that are requested at about the same time share one capture.
+#
+# Snapshots are requested by notifications, Gadget, FinalSnap, and the oracle snapshot endpoint used by the website and apps.
+# Before this, each request opened its own connection to the camera, which for a burst of requests could be too much for the camera server.
+#
+# If a snapshot was taken within the max age the caller passes, it's returned right away. If a capture is already in flight, the caller waits on that
+# capture rather than starting another. With a max age of 0, only the in flight captures are shared. The image variants made from a snapshot, like a resized image for notifications, are also
+# cached with the snapshot, so they are only made once.
+#
+class SnapshotCache:
+
+    # How long a caller will wait on an in flight capture. The capture can take up to about 10 seconds for some cameras.
+    InFlightWaitTimeoutSec = 20.0
+
+
+    def __init__(self, logger:logging.Logger) -> None:
+        self.Logger = logger
+        self.Lock = threading.Lock()
+        self.Entries = {}
+        self.InFlight = {}
+        self.Hits = 0
+        self.Misses = 0
+        self.Coalesced = 0
+        self.VariantHits = 0
+        self.VariantMisses = 0
+
+
+    # Returns a snapshot result for the key. If there's a cached snapshot that's newer than the max age, a copy of it is returned.
+    # Otherwise the capture function is called, unless a capture is already in flight, in which case we wait on that one.
+    # The capture function must return an OctoHttpRequest.Result with the full body buffer read, or None.
+    # Each caller gets their own result object, so it can be changed and closed.
+    def Get(self, key:str, captureFunc, maxAgeSec:float) -> OctoHttpRequest.Result:
+        with self.Lock:
+            entry = self.Entries.get(key, None)
+            if entry is not None and time.time() - entry.TimeSec <= maxAgeSec:
+                self.Hits += 1
+                return entry.CreateResult()
+            inFlight = self.InFlight.get(key, None)
+            if inFlight is None:
+                # We will do the capture.
+                self.Misses += 1
+                inFlight = InFlightCapture()
+                self.InFlight[key] = inFlight
+                isCapturing = True
+            else:
+                self.Coalesced += 1
+                isCapturing = False
+
+        # If there's another capture in flight, wait for it.
+        if isCapturing is False:
+            if inFlight.Done.wait(SnapshotCache.InFlightWaitTimeoutSec) is False:
+                self.Logger.warning("Snapshot cache timed out waiting on the in flight capture.")
+                return None
+            if inFlight.Entry is None:
+                return None
+            return inFlight.Entry.CreateResult()
+
+        # Do the capture, and always release anyone waiting on it.
+        result = None
+        entry = None
+        try:
+            result = captureFunc()
+            entry = SnapshotCacheEntry.FromResult(result)
+        except Exception as e:
+            Sentry.Exception("Snapshot cache capture failed.", e)
+        finally:
+            with self.Lock:
+                # Only successful snapshots are cached, but the waiters get the same result as we did.
+                if entry is not None and entry.StatusCode == 200:
+                    self.Entries[key] = entry
+                inFlight.Entry = entry
+                del self.InFlight[key]
+            inFlight.Done.set()
+
+        # If the result couldn't be cached, like if it's not fully read, return it as is.
+        if entry is None:
+            return result
+
+        # The callers all get new results, so make sure the http response is cleaned up, if there is one.
+        try:
+            result.__exit__(None, None, None)
+        except Exception as e:
+            Sentry.Exception("Snapshot cache failed to close the capture result.", e)
+        return entry.CreateResult()
+
+
+    # Removes the cached snapshots for any keys that aren't in the set, like cameras that are no longer configured.
+    def RemoveEntriesNotIn(self, keys:set) -> None:
+        with self.Lock:
+            for key in [k for k in self.Entries if k not in keys]:
+                del self.Entries[key]
+
+
+    # Returns a variant of a snapshot buffer that was returned by Get, like a resized image.
+    # If the variant has already been made from this snapshot, it's returned. Otherwise, makeVariantFunc(buffer) is called to make it.
+    # The variant key must include everything that changes the output.
+    def GetVariant(self, buffer, variantKey:str, makeVariantFunc):
+        with self.Lock:
+            # Find the cached snapshot this buffer came from. The cached results share the buffer object, so we match on it.
+            entry = None
+            for e in self.Entries.values():
+                if e.Buffer is buffer:
+                    entry = e
+                    break
+            if entry is not None:
+                variant = entry.Variants.get(variantKey, None)
+                if variant is not None:
+                    self.VariantHits += 1
+                    return variant
+            self.VariantMisses += 1
+
+        # Make the variant outside of the lock, since it can be slow.
+        variant = makeVariantFunc(buffer)
+        if entry is not None and variant is not None:
+            with self.Lock:
+                entry.Variants[variantKey] = variant
+        return variant
+
+
+    # Returns the cache stats, used for debugging.
+    def GetStats(self) -> dict:
+        with self.Lock:
+            return {
+                "Hits": self.Hits,
+                "Misses": self.Misses,
+                "Coalesced": self.Coalesced,
+                "VariantHits": self.VariantHits,
+                "VariantMisses": self.VariantMisses,
+                "Cameras": len(self.Entries),
+            }
+
+
+# Waited on by callers that want the snapshot that's being captured.
+class InFlightCapture:
+
+    def __init__(self) -> None:
+        self.Done = threading.Event()
+        self.Entry:SnapshotCacheEntry = None
+
+
+# Holds a snapshot and the image variants made from it.
+class SnapshotCacheEntry:
+
+    def __init__(self, statusCode:int, headers:dict, url:str, didFallback:bool, buffer) -> None:
+        self.StatusCode = statusCode
+        self.Headers = headers
+        self.Url = url
+        self.DidFallback = didFallback
+        self.Buffer = buffer
+        self.TimeSec = time.time()
+        self.Variants = {}
+
+
+    # Returns an entry for the result, or None if the result doesn't have the full body read.
+    @staticmethod
+    def FromResult(result:OctoHttpRequest.Result) -> "SnapshotCacheEntry":
+        if result is None:
+            return None
+        buffer = result.FullBodyBuffer
+        if buffer is None:
+            # Errors without a body can be shared, but anything with a body that's not read can't be.
+            if result.StatusCode == 200 or result.ResponseForBodyRead is not None:
+                return None
+        elif isinstance(buffer, bytearray):
+            # The buffer is shared by all of the results, so make sure it can't be changed.
+            buffer = bytes(buffer)
+        return SnapshotCacheEntry(result.StatusCode, dict(result.Headers), result.Url, result.DidFallback, buffer)
+
+
+    # Returns a new result for the snapshot.
+    def CreateResult(self) -> OctoHttpRequest.Result:
+        if self.Buffer is None:
+            return OctoHttpRequest.Result(self.StatusCode, dict(self.Headers), self.Url, self.DidFallback)
+        return OctoHttpRequest.Result(self.StatusCode, dict(self.Headers), self.Url, self.DidFallback, fullBodyBuffer=self.Buffer)
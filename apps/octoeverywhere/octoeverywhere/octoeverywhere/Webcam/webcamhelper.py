@@ -6,6 +6,7 @@ from typing import List
 from ..sentry import Sentry
 from .webcamutil import WebcamUtil
 from .quickcam import QuickCamManager
+from .snapshotcache import SnapshotCache
 from ..octohttprequest import OctoHttpRequest
 from .webcamsettingitem import WebcamSettingItem
 
@@ -52,6 +53,9 @@ class WebcamHelper:
         self.LocalPluginWebcamSettingsObjects:List[WebcamSettingItem] = []
         self._LoadPluginWebcamSettings()
 
+        # Snapshots that are taken at the same time share one capture, and some callers can reuse a recent snapshot.
+        self.SnapshotCache = SnapshotCache(logger)
+
 
     # Returns if flip H is set in the settings.
     def GetWebcamFlipH(self, cameraIndex:int = None):
@@ -135,13 +139,21 @@ class WebcamHelper:
         # Try to get the URL from the settings.
         webcamStreamUrl = webcamSettingsObj.StreamUrl
         if webcamStreamUrl is not None:
+            # If this is a mjpeg stream and there's already a viewer, the viewers share one upstream stream to the webcam server.
+            # If this is the only viewer or the stream can't be read as a mjpeg stream, this returns None and we proxy the stream directly.
+            result = QuickCamManager.Get().TryGetMjpegStream(webcamStreamUrl)
+            if result is not None:
+                return result
+
             # Try to make a standard http call with this stream url
             # Use use this HTTP call helper system because it might be somewhat tricky to know
             # Where to actually make the webcam request in terms of IP and port.
             # We use the allow redirects flag to make the API more robust, since some webcam images might need that.
             #
             # Whatever this returns, the rest of the request system will handle it, since it's expecting the OctoHttpRequest object
-            return OctoHttpRequest.MakeHttpCall(self.Logger, webcamStreamUrl, OctoHttpRequest.GetPathType(webcamStreamUrl), "GET", {}, allowRedirects=True)
+            result = OctoHttpRequest.MakeHttpCall(self.Logger, webcamStreamUrl, OctoHttpRequest.GetPathType(webcamStreamUrl), "GET", {}, allowRedirects=True)
+            QuickCamManager.Get().TrackDirectMjpegStream(webcamStreamUrl, result)
+            return result
 
         # If we can't get the webcam stream URL, return None to fail out the request.
         return None
@@ -152,10 +164,44 @@ class WebcamHelper:
     #
     # On failure, this returns None. Returning None will fail out the request.
     # On success, this will return a valid OctoHttpRequest that's fully filled out. The stream will always already be fully read, and will be FullBodyBuffer var.
-    def GetSnapshot(self, cameraIndex:int = None) -> OctoHttpRequest.Result:
+    #
+    # If a snapshot is already being taken for this camera, this will wait for it rather than making another request to the camera.
+    # If a snapshot for this camera was taken within maxAgeSec, it's returned rather than taking a new one. This defaults to 0, so
+    # interactive callers always get a new snapshot, but callers like notifications can allow a recent one.
+    def GetSnapshot(self, cameraIndex:int = None, maxAgeSec:float = 0.0) -> OctoHttpRequest.Result:
+        # Get the webcam settings object for this request.
+        # If there are no webcams, this will return None
+        webcamItems = self.ListWebcams()
+        webcamSettingsObj = self._GetWebcamSettingObj(cameraIndex, webcamItems)
+
+        # Drop any cached snapshots for cameras that are no longer configured.
+        self.SnapshotCache.RemoveEntriesNotIn(set() if webcamItems is None else {self._GetSnapshotCacheKey(i) for i in webcamItems})
+        if webcamSettingsObj is None:
+            return None
+        cacheKey = self._GetSnapshotCacheKey(webcamSettingsObj)
+
         # Wrap the entire result in the _EnsureJpegHeaderInfo function, so ensure the returned snapshot can be used by all image processing libs.
         # Wrap the entire result in the add transform function, so on success the header gets added.
-        return self._AddOeWebcamTransformHeader(self._EnsureJpegHeaderInfo(self._GetSnapshotInternal(cameraIndex)), cameraIndex)
+        # The transform header is added after the cache, since each caller gets their own result and the transform settings can change.
+        result = self.SnapshotCache.Get(cacheKey, lambda: self._EnsureJpegHeaderInfo(self._GetSnapshotInternal(cameraIndex)), maxAgeSec)
+        return self._AddOeWebcamTransformHeader(result, cameraIndex)
+
+
+    # The cache is keyed on the camera's urls rather than the index, since the index of a camera can change if the webcam list changes.
+    def _GetSnapshotCacheKey(self, webcamSettingsObj:WebcamSettingItem) -> str:
+        return f"{webcamSettingsObj.SnapshotUrl}|{webcamSettingsObj.StreamUrl}"
+
+
+    # Returns a variant of a snapshot buffer returned by GetSnapshot, like a resized image. The variant is cached with the snapshot,
+    # so if the same snapshot is used again, the variant is only made once. makeVariantFunc(buffer) is called to make the variant if needed.
+    # The variant key must include everything that changes the output.
+    def GetSnapshotVariant(self, snapshotBuffer, variantKey:str, makeVariantFunc):
+        return self.SnapshotCache.GetVariant(snapshotBuffer, variantKey, makeVariantFunc)
+
+
+    # Returns the snapshot cache hit and miss counters.
+    def GetSnapshotCacheStats(self) -> dict:
+        return self.SnapshotCache.GetStats()
 
 
     def _GetSnapshotInternal(self, cameraIndex:int = None) -> OctoHttpRequest.Result:
@@ -232,10 +278,12 @@ class WebcamHelper:
     # Returns the default webcam setting object or None if there isn't one.
     # If there isn't a default webcam name, it's assumed to be the first webcam returned in the list command.
     # If there are no webcams, this will return None
-    def _GetWebcamSettingObj(self, cameraIndex:int = None):
+    # If the caller already has the list of webcams, it can be passed so it's not fetched again.
+    def _GetWebcamSettingObj(self, cameraIndex:int = None, webcamItems:List[WebcamSettingItem] = None):
         try:
             # Get the current list of webcam settings.
-            webcamItems = self.ListWebcams()
+            if webcamItems is None:
+                webcamItems = self.ListWebcams()
             if webcamItems is None or len(webcamItems) == 0:
                 return None
 
@@ -5,6 +5,7 @@ import threading
 from ..octohttprequest import OctoHttpRequest
 
 # Stream Instance is a class that is created per web stream to handle streaming QuickCam images into the http stream.
+# Only the latest image is held, so if the stream can't send as fast as the images come in, it skips images rather than queueing them.
 class WebcamStreamInstance:
 
     # The string doesn't matter what it is, but we define it so it's consistent
@@ -18,6 +19,10 @@ class WebcamStreamInstance:
         self.StreamOpenTimeSec = time.time()
         self.ImageReadyEvent = threading.Event()
         self.AwaitingImage:bytearray = None
+        # Used to report the stream's fps when it closes.
+        self.FirstImageSentTimeSec:float = 0.0
+        self.ImagesSent = 0
+        self.ImagesSkipped = 0
 
 
     # This will attempt to start a stream of the webcam.
@@ -45,6 +50,9 @@ class WebcamStreamInstance:
 
     # Define the callback we will get from QuickCam when there's a new image ready for us to send.
     def _NewImageCallback(self, imgBuffer:bytearray):
+        # If the last image hasn't been sent yet, it's replaced.
+        if self.AwaitingImage is not None:
+            self.ImagesSkipped += 1
         self.AwaitingImage = imgBuffer
         self.ImageReadyEvent.set()
 
@@ -58,6 +66,9 @@ class WebcamStreamInstance:
                 # If so, clear the awaiting image and reset the event.
                 self.AwaitingImage = None
                 self.ImageReadyEvent.clear()
+                self.ImagesSent += 1
+                if self.FirstImageSentTimeSec == 0.0:
+                    self.FirstImageSentTimeSec = time.time()
 
                 # Build the buffer to send
                 header = f"--{WebcamStreamInstance.c_OeStreamBoundaryString}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(capturedImage)}\r\n\r\n"
@@ -79,3 +90,9 @@ class WebcamStreamInstance:
     def _CustomBodyStreamClosed(self) -> None:
         # It's important this is called so the stream will be detached!
         self.QuickCam.DetachImageStreamCallback(self._NewImageCallback)
+
+        # Report the fps this stream got, along with the webcam server's fps and how many other streams are sharing it.
+        if self.FirstImageSentTimeSec != 0.0:
+            durationSec = time.time() - self.FirstImageSentTimeSec
+            fps = self.ImagesSent / durationSec if durationSec > 0 else 0.0
+            self.Logger.info(f"Webcam stream closed after {round(durationSec, 1)}s. Sent {self.ImagesSent} images ({round(fps, 1)} fps), skipped {self.ImagesSkipped}. Upstream fps: {round(self.QuickCam.GetUpstreamFps(), 1)}, other streams: {self.QuickCam.GetImageStreamCallbackCount()}")
@@ -0,0 +1,163 @@
+import time
+import logging
+import threading
+
+from .compression import Compression
+from .telemetry import Telemetry
+
+#
+# Picks the compression level for a session, or if the data should be compressed at all.
+#
+# The compression level used to always be 3, but the best level depends on the system. On a weak printer CPU a big json response is
+# bound by the compression time, so a lower level (or no compression) gets it to the user faster. On a fast host with a slow uplink
+# the response is bound by the upload, so a higher level is worth the extra CPU.
+#
+# The compression and the websocket send run on different threads, so the time it takes to send a body is about the slower of the two.
+# For each level we estimate that time from the measured compression throughput and ratio, which is tracked per level by the
+# Compression class, and the measured send throughput of this session's websocket. The level with the lowest estimate is used.
+#
+# The send throughput is measured from how fast the websocket's send queue drains while it's backlogged, since the time a single
+# send takes only measures the copy into the socket buffer. Until that's been measured, the current level is kept, and the data
+# is never sent uncompressed, since on a slow uplink that would be the worst choice.
+#
+# Levels that haven't been used yet are estimated from the closest measured level, and every so often a neighboring level is used
+# so its measurements stay current.
+#
+class AdaptiveCompression:
+
+    # Returned when the data should be sent without compression.
+    NoCompression = -1
+
+    # The levels we pick from, each with the rough (throughput, ratio) relative to the default level.
+    # These are only used until the level has been measured on this system.
+    ZStandardLevels = {1: (1.4, 1.08), 3: (1.0, 1.0), 6: (0.45, 0.95), 9: (0.3, 0.93)}
+    ZlibLevels = {1: (1.3, 1.1), 3: (1.0, 1.0), 6: (0.5, 0.93)}
+
+    # How often the level is re-evaluated.
+    EvaluateIntervalSec = 2.0
+
+    # A new level must be at least this much faster than the current one, so we don't flip between levels.
+    MinImprovement = 0.1
+
+    # Every this many requests, a neighboring level is used to keep its measurements current.
+    ExploreInterval = 20
+
+    # The min time between telemetry reports of level changes.
+    TelemetryIntervalSec = 10 * 60
+
+
+    def __init__(self, logger:logging.Logger, sessionId, getSendBytesPerSecFunc) -> None:
+        self.Logger = logger
+        self.SessionId = sessionId
+        self.GetSendBytesPerSecFunc = getSendBytesPerSecFunc
+        self.Lock = threading.Lock()
+        self.CurrentLevel = Compression.DefaultLevel
+        self.RequestCount = 0
+        self.LastEvaluateSec = 0.0
+        self.LastTelemetrySec = 0.0
+        self.LevelChanges = 0
+        self.LastEstimate = {}
+
+
+    # Returns the compression level to use, or AdaptiveCompression.NoCompression if the data shouldn't be compressed.
+    def GetCompressionLevel(self) -> int:
+        with self.Lock:
+            self.RequestCount += 1
+            now = time.time()
+            if now - self.LastEvaluateSec >= AdaptiveCompression.EvaluateIntervalSec:
+                self.LastEvaluateSec = now
+                self._Evaluate_UnderLock(now)
+            level = self.CurrentLevel
+            if self.RequestCount % AdaptiveCompression.ExploreInterval == 0:
+                level = self._GetNeighborLevel(level)
+            return level
+
+
+    # Returns the current state, used for debugging.
+    def GetStats(self) -> dict:
+        with self.Lock:
+            return {
+                "Level": self.CurrentLevel,
+                "LevelChanges": self.LevelChanges,
+                "SendBytesPerSec": self.GetSendBytesPerSecFunc(),
+                "Estimates": dict(self.LastEstimate),
+            }
+
+
+    def _GetLevels(self) -> dict:
+        if Compression.Get().CanUseZStandardLib:
+            return AdaptiveCompression.ZStandardLevels
+        return AdaptiveCompression.ZlibLevels
+
+
+    # Returns the next level up or down, alternating, so both sides are measured.
+    def _GetNeighborLevel(self, level:int) -> int:
+        levels = sorted(self._GetLevels().keys())
+        if level == AdaptiveCompression.NoCompression:
+            return levels[0]
+        index = levels.index(level) if level in levels else 0
+        goUp = (self.RequestCount // AdaptiveCompression.ExploreInterval) % 2 == 0
+        if (goUp and index + 1 < len(levels)) or index == 0:
+            return levels[min(index + 1, len(levels) - 1)]
+        return levels[index - 1]
+
+
+    # Returns the (input bytes per second, ratio) for a level, or None if no level has been measured.
+    def _EstimateLevel(self, level:int, levels:dict):
+        stats = Compression.Get().GetLevelStats(level)
+        if stats is not None:
+            return stats
+        # Scale the closest measured level by the rough relative values.
+        for measuredLevel in sorted(levels.keys(), key=lambda l: abs(l - level)):
+            measured = Compression.Get().GetLevelStats(measuredLevel)
+            if measured is None:
+                continue
+            bytesPerSec = measured[0] * levels[level][0] / levels[measuredLevel][0]
+            ratio = min(1.0, measured[1] * levels[level][1] / levels[measuredLevel][1])
+            return (bytesPerSec, ratio)
+        return None
+
+
+    def _Evaluate_UnderLock(self, now:float) -> None:
+        # Until the send throughput has been measured from a backlogged send queue, stay on the current level.
+        # The link might be too slow to send uncompressed, so we never switch to NoCompression without knowing.
+        sendBytesPerSec = self.GetSendBytesPerSecFunc()
+        if sendBytesPerSec is None or sendBytesPerSec <= 0:
+            return
+
+        # The estimated time per byte of body is the slower of the compression and the send of the compressed data.
+        # With no compression, it's just the send time.
+        levels = self._GetLevels()
+        costs = {AdaptiveCompression.NoCompression: 1.0 / sendBytesPerSec}
+        estimates = {}
+        for level in levels:
+            estimate = self._EstimateLevel(level, levels)
+            if estimate is None:
+                # Nothing has been measured yet.
+                return
+            estimates[level] = estimate
+            costs[level] = max(1.0 / estimate[0], estimate[1] / sendBytesPerSec)
+        self.LastEstimate = {str(level): (round(e[0] / 1024.0), round(e[1], 3)) for level, e in estimates.items()}
+
+        bestLevel = min(costs, key=costs.get)
+        currentCost = costs.get(self.CurrentLevel, costs[AdaptiveCompression.NoCompression])
+        if bestLevel == self.CurrentLevel or costs[bestLevel] > currentCost * (1.0 - AdaptiveCompression.MinImprovement):
+            return
+
+        # Switch levels.
+        oldLevel = self.CurrentLevel
+        self.CurrentLevel = bestLevel
+        self.LevelChanges += 1
+        sendKBps = round(sendBytesPerSec / 1024.0)
+        compressKBps = 0 if bestLevel == AdaptiveCompression.NoCompression else round(estimates[bestLevel][0] / 1024.0)
+        ratio = 1.0 if bestLevel == AdaptiveCompression.NoCompression else round(estimates[bestLevel][1], 3)
+        self.Logger.info(f"Adaptive compression for session {self.SessionId} changed level {self._LevelStr(oldLevel)} -> {self._LevelStr(bestLevel)}. Send: {sendKBps}KB/s Compress: {compressKBps}KB/s Ratio: {ratio} Estimates (KB/s, ratio): {self.LastEstimate}")
+        if now - self.LastTelemetrySec >= AdaptiveCompression.TelemetryIntervalSec:
+            self.LastTelemetrySec = now
+            Telemetry.Write("AdaptiveCompression", 1, {"Level": bestLevel, "OldLevel": oldLevel, "SendKBps": sendKBps, "CompressKBps": compressKBps, "Ratio": ratio}, {"ZStandard": str(Compression.Get().CanUseZStandardLib)})
+
+
+    def _LevelStr(self, level:int) -> str:
+        if level == AdaptiveCompression.NoCompression:
+            return "none"
+        return str(level)
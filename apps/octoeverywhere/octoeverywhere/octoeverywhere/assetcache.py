@@ -0,0 +1,519 @@
+import os
+import re
+import json
+import time
+import zlib
+import queue
+import hashlib
+import logging
+import threading
+import collections
+
+from requests.structures import CaseInsensitiveDict
+
+from .sentry import Sentry
+from .compression import Compression
+from .octohttprequest import OctoHttpRequest
+from .octostreammsgbuilder import OctoStreamMsgBuilder
+from .zstandarddictionary import ZStandardDictionary
+from .Proto.PathTypes import PathTypes
+from .Proto.DataCompression import DataCompression
+
+
+# The state of one request that can be served from the asset cache.
+class AssetCacheLookup:
+
+    def __init__(self, key:str, sendHeaders:dict) -> None:
+        self.Key = key
+        # The headers to send for the local request, which can include the cache's conditional headers.
+        self.SendHeaders = sendHeaders
+        # Set if this is a cache hit and no local request needs to be made.
+        self.Result:OctoHttpRequest.Result = None
+        # Set if the cached entry is being revalidated with the local server.
+        self.RevalidateEntry:dict = None
+        self.RevalidateBody:bytes = None
+
+
+#
+# A disk backed LRU cache of web UI assets, stored pre-compressed.
+#
+# Slipstream only caches a handful of known OctoPrint files, so every other asset of Mainsail, Fluidd, OctoPrint, and the other
+# web UIs is read from the local server and compressed again on every remote load. This cache stores the responses for static assets,
+# compressed at a high level with the pre-trained zstandard dictionary, and serves them with the full body buffer path, so they are sent
+# without any compression work.
+#
+# There are two kinds of entries:
+#   - Immutable - The asset is web UI build output with a content hash in the file name (/assets/index-3f9a7c2b.js) or a version in the
+#                 query string (/static/webassets/packed_libs.js?4d3b4c5e), or the local server said it's immutable with its cache-control header.
+#                 The content for the URL can never change, so these are served without making a local request at all.
+#   - Revalidated - Other static assets with an ETag or Last-Modified header. For these we send a conditional request to the local server,
+#                   and if it returns a 304 the cached body is used.
+#
+# On a miss, the full body is read and sent like normal, and then it's compressed and written to disk on a background thread.
+#
+class AssetCache:
+
+    # The max size of all of the cached bodies on disk.
+    MaxCacheSizeBytes = 50 * 1024 * 1024
+
+    # Responses larger than this aren't cached.
+    MaxEntrySizeBytes = 10 * 1024 * 1024
+
+    # The zstandard level used for the cached bodies. This is a lot higher than the realtime level, since it's only done once per asset.
+    ZStandardLevel = 19
+
+    # If the compressed body isn't at least this much smaller, it's stored uncompressed. (images, fonts, and such)
+    MinCompressionRatio = 0.9
+
+    # The max number of responses that can be waiting to be compressed and stored, anything more isn't cached.
+    MaxPendingStores = 16
+
+    # How often the stats are logged.
+    StatsLogInterval = 200
+
+    # Bump this if the index format changes, the old cache will be dropped.
+    IndexVersion = 2
+
+    # Only these file types are cached.
+    CacheableExtensions = (".js", ".mjs", ".css", ".html", ".htm", ".json", ".svg", ".png", ".jpg", ".jpeg", ".gif", ".webp", ".ico", ".woff", ".woff2", ".ttf", ".eot", ".otf", ".wasm", ".map")
+
+    # The paths the web UIs serve their build output from. Only assets under these paths are immutable based on their url.
+    # Other paths, like Moonraker's /server/files/, have user files with names that can look hashed, like "Benchy-PLA_0_2mm_1h30m.png",
+    # and can be overwritten, so they are always revalidated.
+    BuildAssetPathRegex = re.compile(r"^/(?:assets|js|css|static|plugin/[^/]+/static)/")
+
+    # If the local server sends a cache-control max-age at least this long, the asset is treated as immutable.
+    ImmutableMinMaxAgeSec = 30 * 24 * 60 * 60
+    MaxAgeRegex = re.compile(r"(?:^|[\s,])max-age\s*=\s*\"?(\d+)")
+
+    # Content hashes in file names, like "index-BPx1Y8Q9.js", "app.3f9a7c2b.css", or "chunk-vendors.1a2b3c4d5e6f.js"
+    # The hash must be the last part of the name, at least 8 chars, and have a digit, so names like "fa-solid-900.woff2" don't match.
+    HashedFileNameRegex = re.compile(r"[.\-](?=[A-Za-z0-9_]*[0-9])[A-Za-z0-9_]{8,}\.[a-z0-9]+$")
+
+    # Version query strings like "?4d3b4c5e" or "?v=1.10.2-3f9a7c2b"
+    VersionQueryRegex = re.compile(r"^(?:v=|ver=|version=|hash=)?[A-Za-z0-9_.\-]*[0-9][A-Za-z0-9_.\-]*$")
+
+    _Instance = None
+
+    @staticmethod
+    def Init(logger:logging.Logger, localFileStoragePath:str):
+        AssetCache._Instance = AssetCache(logger, localFileStoragePath)
+
+
+    # Returns None if the asset cache isn't enabled.
+    @staticmethod
+    def Get():
+        return AssetCache._Instance
+
+
+    def __init__(self, logger:logging.Logger, localFileStoragePath:str) -> None:
+        self.Logger = logger
+        self.CacheDir = os.path.join(localFileStoragePath, "AssetCache")
+        self.IndexFilePath = os.path.join(self.CacheDir, "index.json")
+        self.Lock = threading.Lock()
+        # The entries in LRU order, the most recently used are at the end.
+        self.Entries = collections.OrderedDict()
+        self.TotalSizeBytes = 0
+        self.PendingStores = queue.Queue(AssetCache.MaxPendingStores)
+        self.StoreThread = None
+        self.HighLevelCompressor = None
+
+        # Stats
+        self.Lookups = 0
+        self.Hits = 0
+        self.RevalidatedHits = 0
+        self.Misses = 0
+        self.Stores = 0
+        self.Evictions = 0
+        self.BytesServed = 0
+
+        try:
+            os.makedirs(self.CacheDir, exist_ok=True)
+            self._LoadIndex()
+        except Exception as e:
+            Sentry.Exception("AssetCache failed to load the cache index.", e)
+            self._ClearAllEntries()
+        self.Logger.info(f"AssetCache loaded {len(self.Entries)} entries, {self.TotalSizeBytes} bytes")
+
+
+    # Called before a http request is made.
+    # If the request can be cached, this returns a lookup object. If the lookup has a Result, it's a cache hit and the result should be used.
+    # Otherwise the request should be made with the lookup's SendHeaders, and the response must be passed to OnResponse.
+    # Returns None if the request can't be cached.
+    def Lookup(self, httpInitialContext, method:str, sendHeaders:dict) -> AssetCacheLookup:
+        if method != "GET" or httpInitialContext.PathType() != PathTypes.Relative:
+            return None
+        path = OctoStreamMsgBuilder.BytesToString(httpInitialContext.Path())
+        if path is None:
+            return None
+        # Remove any anchors.
+        posOfHashtag = path.find('#')
+        if posOfHashtag != -1:
+            path = path[:posOfHashtag]
+        if self._IsCacheablePath(path) is False:
+            return None
+
+        # Check the request headers. If the client sent conditional headers, we don't add our own, but we can still
+        # return a cached result because the web stream will turn it into a 304 if it matches.
+        clientHasConditionalHeaders = False
+        for key in sendHeaders:
+            keyLower = key.lower()
+            if keyLower == "range":
+                return None
+            if keyLower in ("if-none-match", "if-modified-since"):
+                clientHasConditionalHeaders = True
+
+        lookup = AssetCacheLookup(path, sendHeaders)
+        entry = None
+        with self.Lock:
+            self.Lookups += 1
+            if self.Lookups % AssetCache.StatsLogInterval == 0:
+                self.Logger.info(f"AssetCache stats: {self._GetStats_UnderLock()}")
+            entry = self.Entries.get(path, None)
+            if entry is not None:
+                self.Entries.move_to_end(path)
+        if entry is None:
+            return lookup
+
+        # Read the body, if this fails, treat it as a miss.
+        body = self._ReadEntryBody(entry)
+        if body is None:
+            return lookup
+
+        # Immutable assets never change, so we can return them without asking the local server.
+        if entry["Immutable"]:
+            lookup.Result = self._BuildResult(entry, body)
+            with self.Lock:
+                self.Hits += 1
+                self.BytesServed += len(body)
+            return lookup
+
+        # Otherwise, ask the local server if our copy is still current.
+        # We can't do this if the client has its own conditional headers, since a 304 would be for the client's copy.
+        if clientHasConditionalHeaders:
+            return lookup
+        lookup.SendHeaders = dict(sendHeaders)
+        if entry.get("ETag", None) is not None:
+            lookup.SendHeaders["If-None-Match"] = entry["ETag"]
+        if entry.get("LastModified", None) is not None:
+            lookup.SendHeaders["If-Modified-Since"] = entry["LastModified"]
+        lookup.RevalidateEntry = entry
+        lookup.RevalidateBody = body
+        return lookup
+
+
+    # Called with the response of a request that was made for a lookup.
+    # Returns the result that should be used for the response.
+    def OnResponse(self, lookup:AssetCacheLookup, octoHttpResult:OctoHttpRequest.Result) -> OctoHttpRequest.Result:
+        if octoHttpResult is None:
+            return None
+        try:
+            # If we asked the local server to revalidate our copy and it's still current, use it.
+            if lookup.RevalidateEntry is not None and octoHttpResult.StatusCode == 304:
+                # Close the 304 response, since we don't use it.
+                with octoHttpResult:
+                    pass
+                with self.Lock:
+                    self.RevalidatedHits += 1
+                    self.BytesServed += len(lookup.RevalidateBody)
+                return self._BuildResult(lookup.RevalidateEntry, lookup.RevalidateBody)
+
+            # Otherwise, this is a miss. Cache the response if we can.
+            with self.Lock:
+                self.Misses += 1
+            self._TryToCacheResponse(lookup, octoHttpResult)
+        except Exception as e:
+            Sentry.Exception("AssetCache failed to handle a response.", e)
+        return octoHttpResult
+
+
+    # Returns the current stats of the cache.
+    def GetStats(self) -> dict:
+        with self.Lock:
+            return self._GetStats_UnderLock()
+
+
+    def _GetStats_UnderLock(self) -> dict:
+        hits = self.Hits + self.RevalidatedHits
+        requests = hits + self.Misses
+        return {
+            "Entries": len(self.Entries),
+            "SizeBytes": self.TotalSizeBytes,
+            "Hits": self.Hits,
+            "RevalidatedHits": self.RevalidatedHits,
+            "Misses": self.Misses,
+            "HitRate": 0.0 if requests == 0 else round(float(hits) / float(requests), 3),
+            "Stores": self.Stores,
+            "Evictions": self.Evictions,
+            "BytesServed": self.BytesServed,
+        }
+
+
+    def _IsCacheablePath(self, path:str) -> bool:
+        filePath = path
+        posOfQuestionMark = path.find('?')
+        if posOfQuestionMark != -1:
+            filePath = path[:posOfQuestionMark]
+        return filePath.lower().endswith(AssetCache.CacheableExtensions)
+
+
+    # Returns true if the content of the url can never change.
+    def _IsImmutablePath(self, path:str) -> bool:
+        if AssetCache.BuildAssetPathRegex.match(path) is None:
+            return False
+        posOfQuestionMark = path.find('?')
+        if posOfQuestionMark != -1:
+            # OctoPrint and others add the version or hash of the file as the query string.
+            query = path[posOfQuestionMark+1:]
+            if len(query) >= 8 and AssetCache.VersionQueryRegex.match(query) is not None:
+                return True
+            path = path[:posOfQuestionMark]
+        fileName = path[path.rfind('/')+1:]
+        return AssetCache.HashedFileNameRegex.search(fileName) is not None
+
+
+    # Returns true if the cache-control header says the response can't change.
+    def _IsImmutableCacheControl(self, valueLower:str) -> bool:
+        if "no-cache" in valueLower:
+            return False
+        if "immutable" in valueLower:
+            return True
+        match = AssetCache.MaxAgeRegex.search(valueLower)
+        return match is not None and int(match.group(1)) >= AssetCache.ImmutableMinMaxAgeSec
+
+
+    # Reads the response body and queues it to be stored, if the response can be cached.
+    def _TryToCacheResponse(self, lookup:AssetCacheLookup, octoHttpResult:OctoHttpRequest.Result) -> None:
+        # If the result doesn't have a response object, it's already been handled by something else.
+        if octoHttpResult.StatusCode != 200 or octoHttpResult.ResponseForBodyRead is None or octoHttpResult.FullBodyBuffer is not None:
+            return
+
+        contentLength = None
+        etag = None
+        lastModified = None
+        isImmutableHeader = False
+        for key, value in octoHttpResult.Headers.items():
+            keyLower = key.lower()
+            if keyLower == "content-length":
+                contentLength = int(value)
+            elif keyLower == "etag":
+                etag = value
+            elif keyLower == "last-modified":
+                lastModified = value
+            elif keyLower == "set-cookie":
+                # This is a per user response.
+                return
+            elif keyLower == "cache-control":
+                valueLower = value.lower()
+                if "no-store" in valueLower or "private" in valueLower:
+                    return
+                isImmutableHeader = self._IsImmutableCacheControl(valueLower)
+            elif keyLower == "vary":
+                # We don't send accept-encoding to the local server, so that's the only vary we can handle.
+                if value.strip().lower() != "accept-encoding":
+                    return
+            elif keyLower in ("content-range", "transfer-encoding"):
+                return
+
+        # We must know the size, so the body read is bounded.
+        if contentLength is None or contentLength <= 0 or contentLength > AssetCache.MaxEntrySizeBytes:
+            return
+
+        # If it's not immutable, we can only use it if the local server can revalidate it.
+        isImmutable = isImmutableHeader or self._IsImmutablePath(lookup.Key)
+        if isImmutable is False and etag is None and lastModified is None:
+            return
+
+        # Only take the work if the store thread has room for it, otherwise it's not cached this time.
+        if self.PendingStores.full():
+            return
+
+        # Read the full body, the web stream will send it with the full body buffer path.
+        octoHttpResult.ReadAllContentFromStreamResponse(self.Logger)
+        body = octoHttpResult.FullBodyBuffer
+        if body is None or len(body) != contentLength:
+            return
+
+        # Copy the headers now, since the web stream might edit them.
+        headers = []
+        for key, value in octoHttpResult.Headers.items():
+            headers.append([key, value])
+        entry = {
+            "Key": lookup.Key,
+            "Immutable": isImmutable,
+            "ETag": etag,
+            "LastModified": lastModified,
+            "Headers": headers,
+        }
+        try:
+            self.PendingStores.put_nowait((entry, body))
+        except queue.Full:
+            return
+        self._StartStoreThreadIfNeeded()
+
+
+    def _StartStoreThreadIfNeeded(self) -> None:
+        with self.Lock:
+            if self.StoreThread is None:
+                self.StoreThread = threading.Thread(target=self._StoreThread, name="AssetCacheStore", daemon=True)
+                self.StoreThread.start()
+
+
+    def _StoreThread(self) -> None:
+        while True:
+            entry, body = self.PendingStores.get()
+            try:
+                self._StoreEntry(entry, body)
+            except Exception as e:
+                Sentry.Exception("AssetCache failed to store an entry.", e)
+
+
+    # Compresses the body and writes it to disk, then adds the entry to the index.
+    def _StoreEntry(self, entry:dict, body:bytes) -> None:
+        start = time.time()
+        compressed, compressionType = self._Compress(body)
+        compressDuration = time.time() - start
+
+        entry["FileName"] = hashlib.sha1(entry["Key"].encode("utf-8")).hexdigest()
+        entry["CompressionType"] = compressionType
+        entry["OriginalSize"] = len(body)
+        entry["Size"] = len(compressed)
+
+        # Write to a temp file first, so a partial file is never used.
+        filePath = os.path.join(self.CacheDir, entry["FileName"])
+        tempFilePath = filePath + ".tmp"
+        with open(tempFilePath, "wb") as f:
+            f.write(compressed)
+
+        with self.Lock:
+            # Remove the old version of this entry if there is one.
+            self._RemoveEntry_UnderLock(entry["Key"], deleteFile=False)
+            os.replace(tempFilePath, filePath)
+            self.Entries[entry["Key"]] = entry
+            self.TotalSizeBytes += entry["Size"]
+            self.Stores += 1
+            # Evict the least recently used entries until we are under the limit.
+            while self.TotalSizeBytes > AssetCache.MaxCacheSizeBytes and len(self.Entries) > 1:
+                oldestKey = next(iter(self.Entries))
+                self._RemoveEntry_UnderLock(oldestKey, deleteFile=True)
+                self.Evictions += 1
+            # Note that the LRU order of the hits is only written to disk when an entry is stored.
+            self._WriteIndex_UnderLock()
+
+        self.Logger.debug(f"AssetCache stored [compression:{format(compressDuration, '.3f')}] [{len(body)}->{len(compressed)}] {entry['Key']}")
+
+
+    # Returns the compressed body and the compression type.
+    def _Compress(self, body:bytes):
+        compressed = None
+        compressionType = DataCompression.None_
+        if Compression.Get().CanUseZStandardLib:
+            if self.HighLevelCompressor is None:
+                #pylint: disable=import-outside-toplevel
+                import zstandard as zstd
+                # The shared dict is precomputed for the realtime level, which would override the level we ask for.
+                # So we load a new dict from the same data, which the service can decompress with the same dictionary.
+                highLevelDict = zstd.ZstdCompressionDict(ZStandardDictionary.Get().PreTrainedDict.as_bytes(), dict_type=zstd.DICT_TYPE_FULLDICT)
+                self.HighLevelCompressor = zstd.ZstdCompressor(level=AssetCache.ZStandardLevel, dict_data=highLevelDict)
+            compressed = self.HighLevelCompressor.compress(body)
+            compressionType = DataCompression.ZStandard
+        else:
+            compressed = zlib.compress(body, 9)
+            compressionType = DataCompression.Zlib
+
+        # Things like images and fonts are already compressed, so store them as they are.
+        if len(compressed) > len(body) * AssetCache.MinCompressionRatio:
+            return body, DataCompression.None_
+        return compressed, compressionType
+
+
+    def _ReadEntryBody(self, entry:dict) -> bytes:
+        try:
+            with open(os.path.join(self.CacheDir, entry["FileName"]), "rb") as f:
+                body = f.read()
+            if len(body) == entry["Size"]:
+                return body
+            self.Logger.warn(f"AssetCache entry file is the wrong size, removing it. {entry['Key']}")
+        except Exception as e:
+            self.Logger.warn(f"AssetCache failed to read entry file, removing it. {entry['Key']} - {e}")
+        # The entry's file is only replaced under the lock, along with the entry. If the entry was replaced since we read it, the file we read
+        # might have been the new version, so only remove it if this is still the current entry.
+        with self.Lock:
+            if self.Entries.get(entry["Key"], None) is entry:
+                self._RemoveEntry_UnderLock(entry["Key"], deleteFile=True)
+        return None
+
+
+    def _BuildResult(self, entry:dict, body:bytes) -> OctoHttpRequest.Result:
+        headers = CaseInsensitiveDict()
+        for key, value in entry["Headers"]:
+            headers[key] = value
+        headers["x-oe-asset-cache"] = "1"
+        result = OctoHttpRequest.Result(200, headers, entry["Key"], False)
+        result.SetFullBodyBuffer(body, entry["CompressionType"], entry["OriginalSize"])
+        return result
+
+
+    def _RemoveEntry_UnderLock(self, key:str, deleteFile:bool) -> None:
+        entry = self.Entries.pop(key, None)
+        if entry is None:
+            return
+        self.TotalSizeBytes -= entry["Size"]
+        if deleteFile:
+            try:
+                os.remove(os.path.join(self.CacheDir, entry["FileName"]))
+            except Exception:
+                pass
+
+
+    # The compression settings the cached bodies depend on, if they change the cache must be dropped.
+    def _GetCompressionId(self) -> str:
+        if Compression.Get().CanUseZStandardLib:
+            return "zstd-" + str(ZStandardDictionary.Get().PreTrainedDict.dict_id())
+        return "zlib"
+
+
+    def _LoadIndex(self) -> None:
+        if os.path.exists(self.IndexFilePath) is False:
+            self._ClearAllEntries()
+            return
+        with open(self.IndexFilePath, encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("Version", None) != AssetCache.IndexVersion or index.get("CompressionId", None) != self._GetCompressionId():
+            self.Logger.info("AssetCache index is from a different version or compression, clearing the cache.")
+            self._ClearAllEntries()
+            return
+        fileNames = set()
+        for entry in index["Entries"]:
+            filePath = os.path.join(self.CacheDir, entry["FileName"])
+            if os.path.exists(filePath) is False or os.path.getsize(filePath) != entry["Size"]:
+                continue
+            self.Entries[entry["Key"]] = entry
+            self.TotalSizeBytes += entry["Size"]
+            fileNames.add(entry["FileName"])
+        # Remove any files that aren't in the index.
+        for fileName in os.listdir(self.CacheDir):
+            if fileName != "index.json" and fileName not in fileNames:
+                os.remove(os.path.join(self.CacheDir, fileName))
+
+
+    def _WriteIndex_UnderLock(self) -> None:
+        index = {
+            "Version": AssetCache.IndexVersion,
+            "CompressionId": self._GetCompressionId(),
+            "Entries": list(self.Entries.values()),
+        }
+        tempFilePath = self.IndexFilePath + ".tmp"
+        with open(tempFilePath, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tempFilePath, self.IndexFilePath)
+
+
+    def _ClearAllEntries(self) -> None:
+        self.Entries.clear()
+        self.TotalSizeBytes = 0
+        try:
+            for fileName in os.listdir(self.CacheDir):
+                os.remove(os.path.join(self.CacheDir, fileName))
+        except Exception as e:
+            self.Logger.warn(f"AssetCache failed to clear the cache dir. {e}")
@@ -44,6 +44,8 @@ class CompressionContext:
         self.CompressionByteBuffer:bytes = None
         # The compression is more efficient if we know the size of the data of the og data.
         self.CompressionTotalSizeOfDataBytes:int = CompressionContext.TOTAL_SIZE_UNKNOWN
+        # The compression level, which can be changed by the adaptive compression before compression starts.
+        self.CompressionLevel:int = Compression.DefaultLevel
 
         # Decompression - can't be shared to be thread safe
         self.Decompressor = None
@@ -91,7 +93,7 @@ class CompressionContext:
         if streamWriter is not None:
             streamWriter.__exit__(exc_type, exc_value, traceback)
         if compressor is not None:
-            Compression.Get().ReturnZStandardCompressor(compressor)
+            Compression.Get().ReturnZStandardCompressor(compressor, self.CompressionLevel)
         if streamReader is not None:
             streamReader.__exit__(exc_type, exc_value, traceback)
         if decompressor is not None:
@@ -105,6 +107,13 @@ class CompressionContext:
         self.CompressionTotalSizeOfDataBytes = totalSizeBytes
 
 
+    # Sets the compression level used for this context, this must be set before compression starts.
+    def SetCompressionLevel(self, level:int):
+        if self.Compressor is not None:
+            raise Exception("CompressionContext SetCompressionLevel tried to be set after compression started")
+        self.CompressionLevel = level
+
+
     # This is the callback from stream_writer that get called when it has data to write.
     def write(self, data):
         # A bytearray is a better option if we are continuously appending data, since we can allocate a bigger buffer
@@ -125,7 +134,7 @@ class CompressionContext:
             if self.IsClosed:
                 raise Exception("The compression context is closed, we can't compress data")
             if self.Compressor is None:
-                self.Compressor = Compression.Get().RentZStandardCompressor()
+                self.Compressor = Compression.Get().RentZStandardCompressor(self.CompressionLevel)
                 if self.Compressor is None:
                     raise Exception("CompressionContext failed to rent a compressor")
 
@@ -227,6 +236,13 @@ class Compression:
     # That said, zstandard actually does quite well with small payloads, so we can set this quite low.
     MinSizeToCompress = 200
 
+    # The default compression level for both zstandard and zlib, see the comment at the bottom of the file.
+    # The adaptive compression can pick other levels per request.
+    DefaultLevel = 3
+
+    # Only compressions of at least this size are used for the throughput and ratio measurements, smaller ones are too noisy.
+    MinSizeForStats = 4 * 1024
+
     # Since zstandard can't be a required dep since it will fail on some platforms, we try to install it via the runtime or
     # the linux installer if possible. Due to that, this is the package version string they will use ty to to install it.
     # We currently have this set to 21, which still supports PY3.7, which is from 2019.
@@ -249,7 +265,10 @@ class Compression:
     def __init__(self, logger: logging.Logger, localFileStoragePath:str) -> None:
         self.Logger = logger
         self.LocalFileStoragePath = localFileStoragePath
-        self.ZStandardCompressorPool = []
+        # The compressors are pooled per level, since the level is set when the compressor is created.
+        self.ZStandardCompressorPools = {}
+        # The pre-trained dict is precomputed for the default level, other levels need their own precomputed copy.
+        self.ZStandardLevelDicts = {}
         self.ZStandardCompressorPoolLock = threading.Lock()
         self.ZStandardCompressorCreatedCount = 0
 
@@ -257,6 +276,10 @@ class Compression:
         self.ZStandardDecompressorPoolLock = threading.Lock()
         self.ZStandardDecompressorCreatedCount = 0
 
+        # The measured compression throughput and ratio per level, used by the adaptive compression.
+        self.LevelStatsLock = threading.Lock()
+        self.LevelStats = {}
+
         # Determine the thread count we will allow zstandard to use.
         # If there are 3 or less cores, we will only use one thread.
         # If there are 4 or more cores, we will use all but 2.
@@ -308,15 +331,40 @@ class Compression:
     # Given a buffer of data, compress it using the best available compression library.
     def Compress(self, compressionContext:CompressionContext, data: bytes) -> CompressionResult:
         # If we have zstandard lib, use that, since it's better.
+        result = None
         if self.CanUseZStandardLib:
             # If we are training, submit the data to be sampled.
             # ZStandardDictionary.Get().SubmitData(data)
-            return compressionContext.Compress(data)
+            result = compressionContext.Compress(data)
+        else:
+            # If we can't use zStandard lib, fallback to zlib
+            startSec = time.time()
+            compressed = zlib.compress(data, compressionContext.CompressionLevel)
+            result = CompressionResult(compressed, time.time() - startSec, DataCompression.Zlib)
 
-        # If we can't use zStandard lib, fallback to zlib
-        startSec = time.time()
-        compressed = zlib.compress(data, 3)
-        return CompressionResult(compressed, time.time() - startSec, DataCompression.Zlib)
+        # Keep track of how fast each level is and how well it compresses.
+        if len(data) >= Compression.MinSizeForStats:
+            self._RecordLevelStats(compressionContext.CompressionLevel, len(data), len(result.Bytes), result.CompressionTimeSec)
+        return result
+
+
+    # Returns the measured (input bytes per second, compressed size ratio) of a level, or None if it hasn't been measured.
+    def GetLevelStats(self, level:int):
+        with self.LevelStatsLock:
+            return self.LevelStats.get(level, None)
+
+
+    def _RecordLevelStats(self, level:int, inputSize:int, outputSize:int, durationSec:float) -> None:
+        # The timer resolution can be coarse on some platforms, so make sure we never divide by zero.
+        bytesPerSec = float(inputSize) / max(durationSec, 0.0001)
+        ratio = float(outputSize) / float(inputSize)
+        # Use an exponential moving average, so the stats follow changes in the CPU load and the content.
+        with self.LevelStatsLock:
+            current = self.LevelStats.get(level, None)
+            if current is None:
+                self.LevelStats[level] = (bytesPerSec, ratio)
+            else:
+                self.LevelStats[level] = (current[0] * 0.8 + bytesPerSec * 0.2, current[1] * 0.8 + ratio * 0.2)
 
 
     # Given a buffer of data and the compression type, decompresses it.
@@ -338,13 +386,14 @@ class Compression:
 
     # Returns a compressor or None if it fails to load.
     # The compressor warps the zstandard lib context, they are reusable but not thread safe.
-    def RentZStandardCompressor(self):
+    def RentZStandardCompressor(self, level:int = DefaultLevel):
         if self.CanUseZStandardLib is False:
             return None
         try:
             with self.ZStandardCompressorPoolLock:
-                if len(self.ZStandardCompressorPool) > 0:
-                    return self.ZStandardCompressorPool.pop()
+                pool = self.ZStandardCompressorPools.get(level, None)
+                if pool is not None and len(pool) > 0:
+                    return pool.pop()
 
                 # Report how many we have created for leak detection.
                 self.ZStandardCompressorCreatedCount += 1
@@ -354,18 +403,26 @@ class Compression:
                 #pylint: disable=import-outside-toplevel
                 import zstandard as zstd
                 # We must use the pre-trained dict, since the service uses it as well and it must match.
-                return zstd.ZstdCompressor(threads=self.ZStandardThreadCount, dict_data=ZStandardDictionary.Get().PreTrainedDict)
+                # The precomputed dict sets the compression level, so other levels need a copy of the dict precomputed for that level.
+                levelDict = ZStandardDictionary.Get().PreTrainedDict
+                if level != Compression.DefaultLevel:
+                    levelDict = self.ZStandardLevelDicts.get(level, None)
+                    if levelDict is None:
+                        levelDict = zstd.ZstdCompressionDict(ZStandardDictionary.Get().PreTrainedDict.as_bytes(), dict_type=zstd.DICT_TYPE_FULLDICT)
+                        levelDict.precompute_compress(level=level)
+                        self.ZStandardLevelDicts[level] = levelDict
+                return zstd.ZstdCompressor(level=level, threads=self.ZStandardThreadCount, dict_data=levelDict)
         except Exception as e:
             self.Logger.error(f"Failed to rent zstandard compressor. Error: {e}")
         return None
 
 
     # Puts the compressor back into the pool
-    def ReturnZStandardCompressor(self, compressor):
+    def ReturnZStandardCompressor(self, compressor, level:int = DefaultLevel):
         if compressor is None:
             return
         with self.ZStandardCompressorPoolLock:
-            self.ZStandardCompressorPool.append(compressor)
+            self.ZStandardCompressorPools.setdefault(level, []).append(compressor)
 
 
     # Returns a decompressor or None if it fails to load.
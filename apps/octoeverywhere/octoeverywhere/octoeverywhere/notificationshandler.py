@@ -63,6 +63,10 @@ class NotificationsHandler:
         self.Gadget = Gadget(logger, self, self.PrinterStateInterface)
         self.BedCooldownWatcher = BedCooldownWatcher(logger, self, self.PrinterStateInterface)
 
+        # How old a webcam snapshot can be and still be used for a notification, rather than taking a new one.
+        # This can be changed in the config by the user.
+        self.SnapshotMaxAgeSec = 2.0
+
         # Define all the vars we use locally in the notification handler
         self.PrintCookie = ""
         self.FallbackProgressInt = 0
@@ -214,6 +218,11 @@ class NotificationsHandler:
         self.BedCooldownWatcher.SetBedCooldownThresholdTemp(tempC)
 
 
+    # Sets how old a webcam snapshot can be and still be used for a notification, 0 always takes a new snapshot.
+    def SetSnapshotMaxAgeSec(self, maxAgeSec:float):
+        self.SnapshotMaxAgeSec = max(0.0, maxAgeSec)
+
+
     # A special case used by moonraker and bambu to restore the state of an ongoing print that we don't know of.
     # What we want to do is check moonraker or bambu's current state and our current state, to see if there's anything that needs to be synced.
     # Remember that we might be syncing because our service restarted during a print, or moonraker restarted, so we might already have
@@ -783,7 +792,8 @@ class NotificationsHandler:
 
             # Use the snapshot helper to get the snapshot. This will handle advance logic like relative and absolute URLs
             # as well as getting a snapshot directly from a mjpeg stream if there's no snapshot URL.
-            octoHttpResponse = WebcamHelper.Get().GetSnapshot()
+            # A recent snapshot can be used, so notifications, Gadget, and FinalSnap that happen at about the same time share one.
+            octoHttpResponse = WebcamHelper.Get().GetSnapshot(maxAgeSec=self.SnapshotMaxAgeSec)
 
             # Check for a valid response.
             if octoHttpResponse is None or octoHttpResponse.StatusCode != 200:
@@ -807,130 +817,12 @@ class NotificationsHandler:
             flipV = WebcamHelper.Get().GetWebcamFlipV()
             rotation = WebcamHelper.Get().GetWebcamRotation()
             if rotation != 0 or flipH or flipV or snapshotResizeParams is not None:
-                try:
-                    if Image is not None:
-
-                        # We noticed that on some under powered or otherwise bad systems the image returned
-                        # by mjpeg is truncated. We aren't sure why this happens, but setting this flag allows us to sill
-                        # manipulate the image even though we didn't get the whole thing. Otherwise, we would use the raw snapshot
-                        # buffer, which is still an incomplete image.
-                        # Use a try catch incase the import of ImageFile failed
-                        try:
-                            ImageFile.LOAD_TRUNCATED_IMAGES = True
-                        except Exception as _:
-                            pass
-
-                        # In pillow ~9.1.0 these constants moved.
-                        # pylint: disable=no-member
-                        OE_FLIP_LEFT_RIGHT = 0
-                        OE_FLIP_TOP_BOTTOM = 0
-                        try:
-                            OE_FLIP_LEFT_RIGHT = Image.FLIP_LEFT_RIGHT
-                            OE_FLIP_TOP_BOTTOM = Image.FLIP_TOP_BOTTOM
-                        except Exception:
-                            OE_FLIP_LEFT_RIGHT = Image.Transpose.FLIP_LEFT_RIGHT
-                            OE_FLIP_TOP_BOTTOM = Image.Transpose.FLIP_TOP_BOTTOM
-                        # pylint: enable=no-member
-
-                        # Update the image
-                        # Note the order of the flips and the rotates are important!
-                        # If they are reordered, when multiple are applied the result will not be correct.
-                        didWork = False
-                        pilImage = Image.open(io.BytesIO(snapshot))
-                        if flipH:
-                            pilImage = pilImage.transpose(OE_FLIP_LEFT_RIGHT)
-                            didWork = True
-                        if flipV:
-                            pilImage = pilImage.transpose(OE_FLIP_TOP_BOTTOM)
-                            didWork = True
-                        if rotation != 0:
-                            # Our rotation is clockwise while PIL is counter clockwise.
-                            # Subtract from 360 to get the opposite rotation.
-                            rotation = 360 - rotation
-                            pilImage = pilImage.rotate(rotation)
-                            didWork = True
-
-                        #
-                        # Now apply any resize operations needed.
-                        #
-                        if snapshotResizeParams is not None:
-                            # First, if we want to scale and crop to center, we will use the resize operation to get the image
-                            # scale (preserving the aspect ratio). We will use the smallest side to scale to the desired outcome.
-                            if snapshotResizeParams.CropSquareCenterNoPadding:
-                                # We will only do the crop resize if the source image is smaller than or equal to the desired size.
-                                if pilImage.height >= snapshotResizeParams.Size and pilImage.width >= snapshotResizeParams.Size:
-                                    if pilImage.height < pilImage.width:
-                                        snapshotResizeParams.ResizeToHeight = True
-                                        snapshotResizeParams.ResizeToWidth = False
-                                    else:
-                                        snapshotResizeParams.ResizeToHeight = False
-                                        snapshotResizeParams.ResizeToWidth = True
-
-                            # Do any resizing required.
-                            resizeHeight = None
-                            resizeWidth = None
-                            if snapshotResizeParams.ResizeToHeight:
-                                if pilImage.height > snapshotResizeParams.Size:
-                                    resizeHeight = snapshotResizeParams.Size
-                                    resizeWidth = int((float(snapshotResizeParams.Size) / float(pilImage.height)) * float(pilImage.width))
-                            if snapshotResizeParams.ResizeToWidth:
-                                if pilImage.width > snapshotResizeParams.Size:
-                                    resizeHeight = int((float(snapshotResizeParams.Size) / float(pilImage.width)) * float(pilImage.height))
-                                    resizeWidth = snapshotResizeParams.Size
-                            # If we have things to resize, do it.
-                            if resizeHeight is not None and resizeWidth is not None:
-                                pilImage = pilImage.resize((resizeWidth, resizeHeight))
-                                didWork = True
-
-                            # Now if we want to crop square, use the resized image to crop the remaining side.
-                            if snapshotResizeParams.CropSquareCenterNoPadding:
-                                left = 0
-                                upper = 0
-                                right = 0
-                                lower = 0
-                                if snapshotResizeParams.ResizeToHeight:
-                                    # Crop the width - use floor to ensure if there's a remainder we float left.
-                                    centerX = math.floor(float(pilImage.width) / 2.0)
-                                    halfWidth = math.floor(float(snapshotResizeParams.Size) / 2.0)
-                                    upper = 0
-                                    lower = snapshotResizeParams.Size
-                                    left = centerX - halfWidth
-                                    right = (snapshotResizeParams.Size - halfWidth) + centerX
-                                else:
-                                    # Crop the height - use floor to ensure if there's a remainder we float left.
-                                    centerY = math.floor(float(pilImage.height) / 2.0)
-                                    halfHeight = math.floor(float(snapshotResizeParams.Size) / 2.0)
-                                    upper = centerY - halfHeight
-                                    lower = (snapshotResizeParams.Size - halfHeight) + centerY
-                                    left = 0
-                                    right = snapshotResizeParams.Size
-
-                                # Sanity check bounds
-                                if left < 0 or left > right or right > pilImage.width or upper > 0 or upper > lower or lower > pilImage.height:
-                                    self.Logger.error("Failed to crop image. height: "+str(pilImage.height)+", width: "+str(pilImage.width)+", size: "+str(snapshotResizeParams.Size))
-                                else:
-                                    pilImage = pilImage.crop((left, upper, right, lower))
-                                    didWork = True
-
-                        #
-                        # If we did some operation, save the image buffer back to a jpeg and overwrite the
-                        # current snapshot buffer. If we didn't do work, keep the original, to preserve quality.
-                        #
-                        if didWork:
-                            buffer = io.BytesIO()
-                            pilImage.save(buffer, format="JPEG", quality=95)
-                            snapshot = buffer.getvalue()
-                            buffer.close()
-                    else:
-                        self.Logger.warn("Can't manipulate image because the Image rotation lib failed to import.")
-                except Exception as e:
-                    # Note that in the case of an exception we don't overwrite the original snapshot buffer, so something can still be sent.
-                    if "name 'Image' is not defined" in str(e):
-                        self.Logger.info("Can't manipulate image because the Image rotation lib failed to import.")
-                    if "cannot identify image file" in str(e):
-                        self.Logger.info("Can't manipulate image because the Image lib can't figure out the image type.")
-                    else:
-                        Sentry.Exception("Failed to manipulate image for notifications", e)
+                # The manipulated image is cached with the snapshot, so if the same snapshot is used again with the same options, like
+                # by a few notifications at once, the image is only processed once. Note the key must be made first, since the resize params can be changed.
+                variantKey = f"notification-{flipH}-{flipV}-{rotation}"
+                if snapshotResizeParams is not None:
+                    variantKey += f"-{snapshotResizeParams.Size}-{snapshotResizeParams.ResizeToHeight}-{snapshotResizeParams.ResizeToWidth}-{snapshotResizeParams.CropSquareCenterNoPadding}"
+                snapshot = WebcamHelper.Get().GetSnapshotVariant(snapshot, variantKey, lambda buf: self._ManipulateSnapshot(buf, flipH, flipV, rotation, snapshotResizeParams))
 
             # Ensure in the end, the snapshot is a reasonable size.
             if len(snapshot) > NotificationsHandler.MaxSnapshotFileSizeBytes:
@@ -950,6 +842,136 @@ class NotificationsHandler:
         return None
 
 
+    # Applies the webcam flip and rotation settings and the resize params to the snapshot.
+    # Returns the new snapshot buffer, or the original buffer if there was nothing to do or it failed.
+    def _ManipulateSnapshot(self, snapshot, flipH, flipV, rotation, snapshotResizeParams):
+        try:
+            if Image is not None:
+
+                # We noticed that on some under powered or otherwise bad systems the image returned
+                # by mjpeg is truncated. We aren't sure why this happens, but setting this flag allows us to sill
+                # manipulate the image even though we didn't get the whole thing. Otherwise, we would use the raw snapshot
+                # buffer, which is still an incomplete image.
+                # Use a try catch incase the import of ImageFile failed
+                try:
+                    ImageFile.LOAD_TRUNCATED_IMAGES = True
+                except Exception as _:
+                    pass
+
+                # In pillow ~9.1.0 these constants moved.
+                # pylint: disable=no-member
+                OE_FLIP_LEFT_RIGHT = 0
+                OE_FLIP_TOP_BOTTOM = 0
+                try:
+                    OE_FLIP_LEFT_RIGHT = Image.FLIP_LEFT_RIGHT
+                    OE_FLIP_TOP_BOTTOM = Image.FLIP_TOP_BOTTOM
+                except Exception:
+                    OE_FLIP_LEFT_RIGHT = Image.Transpose.FLIP_LEFT_RIGHT
+                    OE_FLIP_TOP_BOTTOM = Image.Transpose.FLIP_TOP_BOTTOM
+                # pylint: enable=no-member
+
+                # Update the image
+                # Note the order of the flips and the rotates are important!
+                # If they are reordered, when multiple are applied the result will not be correct.
+                didWork = False
+                pilImage = Image.open(io.BytesIO(snapshot))
+                if flipH:
+                    pilImage = pilImage.transpose(OE_FLIP_LEFT_RIGHT)
+                    didWork = True
+                if flipV:
+                    pilImage = pilImage.transpose(OE_FLIP_TOP_BOTTOM)
+                    didWork = True
+                if rotation != 0:
+                    # Our rotation is clockwise while PIL is counter clockwise.
+                    # Subtract from 360 to get the opposite rotation.
+                    rotation = 360 - rotation
+                    pilImage = pilImage.rotate(rotation)
+                    didWork = True
+
+                #
+                # Now apply any resize operations needed.
+                #
+                if snapshotResizeParams is not None:
+                    # First, if we want to scale and crop to center, we will use the resize operation to get the image
+                    # scale (preserving the aspect ratio). We will use the smallest side to scale to the desired outcome.
+                    if snapshotResizeParams.CropSquareCenterNoPadding:
+                        # We will only do the crop resize if the source image is smaller than or equal to the desired size.
+                        if pilImage.height >= snapshotResizeParams.Size and pilImage.width >= snapshotResizeParams.Size:
+                            if pilImage.height < pilImage.width:
+                                snapshotResizeParams.ResizeToHeight = True
+                                snapshotResizeParams.ResizeToWidth = False
+                            else:
+                                snapshotResizeParams.ResizeToHeight = False
+                                snapshotResizeParams.ResizeToWidth = True
+
+                    # Do any resizing required.
+                    resizeHeight = None
+                    resizeWidth = None
+                    if snapshotResizeParams.ResizeToHeight:
+                        if pilImage.height > snapshotResizeParams.Size:
+                            resizeHeight = snapshotResizeParams.Size
+                            resizeWidth = int((float(snapshotResizeParams.Size) / float(pilImage.height)) * float(pilImage.width))
+                    if snapshotResizeParams.ResizeToWidth:
+                        if pilImage.width > snapshotResizeParams.Size:
+                            resizeHeight = int((float(snapshotResizeParams.Size) / float(pilImage.width)) * float(pilImage.height))
+                            resizeWidth = snapshotResizeParams.Size
+                    # If we have things to resize, do it.
+                    if resizeHeight is not None and resizeWidth is not None:
+                        pilImage = pilImage.resize((resizeWidth, resizeHeight))
+                        didWork = True
+
+                    # Now if we want to crop square, use the resized image to crop the remaining side.
+                    if snapshotResizeParams.CropSquareCenterNoPadding:
+                        left = 0
+                        upper = 0
+                        right = 0
+                        lower = 0
+                        if snapshotResizeParams.ResizeToHeight:
+                            # Crop the width - use floor to ensure if there's a remainder we float left.
+                            centerX = math.floor(float(pilImage.width) / 2.0)
+                            halfWidth = math.floor(float(snapshotResizeParams.Size) / 2.0)
+                            upper = 0
+                            lower = snapshotResizeParams.Size
+                            left = centerX - halfWidth
+                            right = (snapshotResizeParams.Size - halfWidth) + centerX
+                        else:
+                            # Crop the height - use floor to ensure if there's a remainder we float left.
+                            centerY = math.floor(float(pilImage.height) / 2.0)
+                            halfHeight = math.floor(float(snapshotResizeParams.Size) / 2.0)
+                            upper = centerY - halfHeight
+                            lower = (snapshotResizeParams.Size - halfHeight) + centerY
+                            left = 0
+                            right = snapshotResizeParams.Size
+
+                        # Sanity check bounds
+                        if left < 0 or left > right or right > pilImage.width or upper > 0 or upper > lower or lower > pilImage.height:
+                            self.Logger.error("Failed to crop image. height: "+str(pilImage.height)+", width: "+str(pilImage.width)+", size: "+str(snapshotResizeParams.Size))
+                        else:
+                            pilImage = pilImage.crop((left, upper, right, lower))
+                            didWork = True
+
+                #
+                # If we did some operation, save the image buffer back to a jpeg and overwrite the
+                # current snapshot buffer. If we didn't do work, keep the original, to preserve quality.
+                #
+                if didWork:
+                    buffer = io.BytesIO()
+                    pilImage.save(buffer, format="JPEG", quality=95)
+                    snapshot = buffer.getvalue()
+                    buffer.close()
+            else:
+                self.Logger.warn("Can't manipulate image because the Image rotation lib failed to import.")
+        except Exception as e:
+            # Note that in the case of an exception we don't overwrite the original snapshot buffer, so something can still be sent.
+            if "name 'Image' is not defined" in str(e):
+                self.Logger.info("Can't manipulate image because the Image rotation lib failed to import.")
+            if "cannot identify image file" in str(e):
+                self.Logger.info("Can't manipulate image because the Image lib can't figure out the image type.")
+            else:
+                Sentry.Exception("Failed to manipulate image for notifications", e)
+        return snapshot
+
+
     # Assuming the current time is set at the start of the printer correctly.
     # This is also a live duration, if this is called once the print is over it will keep incrementing.
     def GetCurrentDurationSecFloat(self):
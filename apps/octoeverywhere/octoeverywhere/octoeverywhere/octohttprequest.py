@@ -96,6 +96,7 @@ class OctoHttpRequest:
             self._customBodyStreamClosedCallback = customBodyStreamClosedCallback
             if (self._customBodyStreamCallback is not None and self._customBodyStreamClosedCallback is None) or (self._customBodyStreamCallback is None and self._customBodyStreamClosedCallback is not None):
                 raise Exception("Both the customBodyStreamCallback and customBodyStreamClosedCallback must be set!")
+            self._closedCallback = None
 
 
         # Allows for a quick way to create a Result object with no body.
@@ -219,6 +220,10 @@ class OctoHttpRequest:
         def GetCustomBodyStreamClosedCallback(self):
             return self._customBodyStreamClosedCallback
 
+        # Sets a callback that's called when this Result object is closed, which is when the body is done being read.
+        def SetClosedCallback(self, callback) -> None:
+            self._closedCallback = callback
+
         # We need to support the with keyword incase we have an actual Response object.
         def __enter__(self):
             if self._requestLibResponseObj is not None:
@@ -231,6 +236,8 @@ class OctoHttpRequest:
                 self._requestLibResponseObj.__exit__(t, v, tb)
             if self._customBodyStreamClosedCallback is not None:
                 self._customBodyStreamClosedCallback()
+            if self._closedCallback is not None:
+                self._closedCallback()
 
 
     # Handles making all http calls out of the plugin to OctoPrint or other services running locally on the device or
@@ -253,6 +260,9 @@ class OctoHttpRequest:
     # Instead, the system needs to handle the redirect 301 or 302 call as normal, sending it back to the caller, and allowing them to follow the redirect if needed.
     # The X-Forwarded-Host header will tell the OctoPrint server the correct place to set the location redirect header.
     # However, for calls that aren't proxy calls, things like local snapshot requests and such, we want to allow redirects to be more robust.
+    #
+    # Note the data can be a body that's read as it's sent, like a streaming upload, which can't be sent again once any of it has been read.
+    # For those bodies the fallback URLs and the no headers retry are only tried if none of the body was read by the failed attempt.
     @staticmethod
     def MakeHttpCall(logger, pathOrUrl, pathOrUrlType, method, headers, data=None, allowRedirects=False) -> Result:
         # First of all, we need to figure out what the URL is. There are two options
@@ -382,7 +392,8 @@ class OctoHttpRequest:
         ret = OctoHttpRequest.MakeHttpCallAttempt(logger, "Main request", method, url, headers, data, None, False, fallbackUrl, allowRedirects)
         # If the function reports the chain is done, the next fallback URL is invalid and we should always return
         # whatever is in the Response, even if it's None.
-        if ret.IsChainDone:
+        # If the body was read by the failed attempt, it can't be sent to a fallback, so we are also done.
+        if ret.IsChainDone or OctoHttpRequest.CanResendData(data) is False:
             return ret.Result
 
         # We keep track of the main response, if all future fallbacks fail. (This can be None)
@@ -392,7 +403,7 @@ class OctoHttpRequest:
         ret = OctoHttpRequest.MakeHttpCallAttempt(logger, "Http proxy fallback", method, fallbackUrl, headers, data, mainResult, True, fallbackLocalIpHttpProxySuffix, allowRedirects)
         # If the function reports the chain is done, the next fallback URL is invalid and we should always return
         # whatever is in the Response, even if it's None.
-        if ret.IsChainDone:
+        if ret.IsChainDone or OctoHttpRequest.CanResendData(data) is False:
             return ret.Result
 
         # Try to get the local IP of this device and try to use the same ports with it.
@@ -405,7 +416,7 @@ class OctoHttpRequest:
         ret = OctoHttpRequest.MakeHttpCallAttempt(logger, "Local IP Http Proxy Fallback", method, localIpFallbackUrl, headers, data, mainResult, True, fallbackLocalIpOctoPrintPortSuffix, allowRedirects)
         # If the function reports the chain is done, the next fallback URL is invalid and we should always return
         # whatever is in the Response, even if it's None.
-        if ret.IsChainDone:
+        if ret.IsChainDone or OctoHttpRequest.CanResendData(data) is False:
             return ret.Result
 
         # Now try the OcotoPrint direct port with the local IP.
@@ -413,7 +424,7 @@ class OctoHttpRequest:
         ret = OctoHttpRequest.MakeHttpCallAttempt(logger, "Local IP fallback", method, localIpFallbackUrl, headers, data, mainResult, True, fallbackWebcamUrl, allowRedirects)
         # If the function reports the chain is done, the next fallback URL is invalid and we should always return
         # whatever is in the Response, even if it's None.
-        if ret.IsChainDone:
+        if ret.IsChainDone or OctoHttpRequest.CanResendData(data) is False:
             return ret.Result
 
         # If all others fail, try the hardcoded webcam URL.
@@ -423,6 +434,14 @@ class OctoHttpRequest:
         # No matter what, always return the result now.
         return ret.Result
 
+    # Returns false if the request body can't be sent again.
+    # Most bodies are bytes and can be sent any number of times, but bodies that are read as they are sent, like streaming uploads,
+    # implement CanBeResent, which returns false once any of the body has been read.
+    @staticmethod
+    def CanResendData(data) -> bool:
+        canBeResent = getattr(data, "CanBeResent", None)
+        return canBeResent is None or canBeResent()
+
     # Returned by a single http request attempt.
     # IsChainDone - indicates if the fallback chain is done and the response should be returned
     # Result - is the final result. Note the result can be unsuccessful or even `None` if everything failed.
@@ -468,7 +487,8 @@ class OctoHttpRequest:
         # most of these systems don't need auth headers or anything.
         # Strangely this seems to only work on Linux, where as on Windows the request.request function will throw a 'An existing connection was forcibly closed by the remote host' error.
         # Thus for windows, if the response is ever null, try again. This isn't ideal, but most windows users are just doing dev anyways.
-        if response is not None and response.status_code == 431 or (platform.system() == "Windows" and response is None):
+        # The retry is skipped if the body was read by the first call and can't be sent again.
+        if (response is not None and response.status_code == 431 or (platform.system() == "Windows" and response is None)) and OctoHttpRequest.CanResendData(data):
             if response is not None and response.status_code == 431:
                 logger.info(url + " http call returned 431, too many headers. Trying again with no headers.")
             else:
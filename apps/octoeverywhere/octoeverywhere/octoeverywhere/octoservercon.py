@@ -52,6 +52,10 @@ class OctoServerCon:
     # Having a wider window allows the client to reconnect at different times, which is good for the server.
     WsConnectRandomMaxSec = 30
 
+    # The max bytes queued to send on the websocket. If the uplink stalls, senders block rather than buffering the bodies in memory.
+    # This is above the web stream send scheduler's in flight limit, so normally only the scheduler holds back the web streams.
+    MaxSendQueueBytes = 4 * 1024 * 1024
+
 
     def __init__(self, host, endpoint, isPrimaryConnection, shouldUseLowestLatencyServer, printerId, privateKey, logger, uiPopupInvoker, statusChangeHandler, pluginVersion, runForSeconds, summonMethod, serverHostType, isCompanion):
         self.ProtocolVersion = 1
@@ -337,13 +341,13 @@ class OctoServerCon:
 
                     # Connect to the service.
                     # When this returns, make sure it's fully closed.
-                    self.Ws = Client(endpoint, self.OnOpened, self.OnMsg, None, self.OnClosed, self.OnError)
+                    self.Ws = Client(endpoint, self.OnOpened, self.OnMsg, None, self.OnClosed, self.OnError, maxSendQueueBytes=OctoServerCon.MaxSendQueueBytes)
                     with self.Ws:
                         self.Logger.info("Attempting to talk to OctoEverywhere, server con "+self.GetConnectionString() + " wsId:"+self.GetWsId(self.Ws))
                         self.Ws.RunUntilClosed()
 
                     # Handle disconnects
-                    self.Logger.info("Disconnected from OctoEverywhere, server con "+self.GetConnectionString())
+                    self.Logger.info("Disconnected from OctoEverywhere, server con "+self.GetConnectionString()+" send queue stats: "+str(self.Ws.GetSendQueueStats()))
 
                     # Ensure all proxy sockets are closed.
                     if self.OctoSession:
@@ -385,10 +389,18 @@ class OctoServerCon:
                 runForTimeChecker.Stop()
 
 
-    def SendMsg(self, buffer:bytearray, msgStartOffsetBytes:int, msgSize:int):
+    def SendMsg(self, buffer:bytearray, msgStartOffsetBytes:int, msgSize:int, sentCallback = None):
         # When we send any message, consider it user activity.
         self.LastUserActivityTime = datetime.now()
-        self.Ws.Send(buffer, msgStartOffsetBytes, msgSize, True)
+        self.Ws.Send(buffer, msgStartOffsetBytes, msgSize, True, sentCallback)
+
+
+    # Returns the measured send throughput of the websocket in bytes per second, or 0 if it's not known.
+    def GetSendBytesPerSec(self) -> float:
+        ws = self.Ws
+        if ws is not None:
+            return ws.GetSendBytesPerSec()
+        return 0.0
 
 
     def GetWsId(self, ws):
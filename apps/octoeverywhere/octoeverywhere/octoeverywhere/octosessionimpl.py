@@ -10,6 +10,7 @@ import logging
 #
 
 from .WebStream import octowebstream
+from .WebStream.octowebstreamsendscheduler import OctoWebStreamSendScheduler
 from .octohttprequest import OctoHttpRequest
 from .localip import LocalIpHelper
 from .octostreammsgbuilder import OctoStreamMsgBuilder
@@ -18,6 +19,7 @@ from .sentry import Sentry
 from .ostypeidentifier import OsTypeIdentifier
 from .threaddebug import ThreadDebug
 from .compression import Compression
+from .adaptivecompression import AdaptiveCompression
 from .deviceid import DeviceId
 
 from .Proto import OctoStreamMessage
@@ -50,15 +52,27 @@ class OctoSession:
         # Create our server auth helper.
         self.ServerAuth = ServerAuthHelper(self.Logger)
 
+        # Picks the compression level for the web streams of this session.
+        self.AdaptiveCompression = AdaptiveCompression(self.Logger, self.SessionId, self.GetSendBytesPerSec)
+
+        # Schedules the messages the web streams send, so they share the websocket by priority.
+        self.SendScheduler = OctoWebStreamSendScheduler(self.Logger, self.Send, self.GetSendBytesPerSec, lambda: self.OnSessionError(0))
+
 
     def OnSessionError(self, backoffModifierSec):
         # Just forward
         self.OctoStream.OnSessionError(self.SessionId, backoffModifierSec)
 
 
-    def Send(self, buffer:bytearray, msgStartOffsetBytes:int, msgSize:int):
+    # If the optional sentCallback is set, it's called once the buffer has been sent and can be reused.
+    def Send(self, buffer:bytearray, msgStartOffsetBytes:int, msgSize:int, sentCallback = None):
         # The message is already encoded, pass it along to the socket.
-        self.OctoStream.SendMsg(buffer, msgStartOffsetBytes, msgSize)
+        self.OctoStream.SendMsg(buffer, msgStartOffsetBytes, msgSize, sentCallback)
+
+
+    # Returns the measured send throughput of the connection in bytes per second, or 0 if it's not known.
+    def GetSendBytesPerSec(self) -> float:
+        return self.OctoStream.GetSendBytesPerSec()
 
 
     def HandleSummonRequest(self, msg):
@@ -197,8 +211,9 @@ class OctoSession:
                 localStream = octowebstream.OctoWebStream(name="OctoWebStreamPumper", args=(self.Logger, streamId, self, ))
                 # Set it in the map
                 self.ActiveWebStreams[streamId] = localStream
-                # Start it's main worker thread
-                localStream.start()
+                # Start it's main worker thread, unless the web stream worker pool engine will run it.
+                if localStream.UsesOwnThread():
+                    localStream.start()
 
         # If we get here, we know we must have a localStream
         localStream.OnIncomingServerMessage(webStreamMsg)
@@ -240,6 +255,9 @@ class OctoSession:
         except Exception as ex:
             Sentry.Exception("Exception thrown while closing all web streams.", ex)
 
+        # Hand anything that's still queued to the websocket and stop scheduling.
+        self.SendScheduler.Close()
+
 
     def StartHandshake(self, summonMethod):
         # Send the handshakesyn
@@ -273,7 +291,7 @@ class OctoSession:
 
 
     # This is the main receive function for all messages coming from the server.
-    # Since all web stream messages use their own threads, we don't spin off a thread
+    # Since all web stream messages use their own threads (or the web stream worker pool), we don't spin off a thread
     # for messages here. However, that means we need to be careful to not do any
     # long processing in the function, since it will delay all incoming messages.
     def HandleMessage(self, msgBytes):
@@ -1,5 +1,6 @@
-import queue
+import time
 import threading
+import collections
 import certifi
 import octowebsocket
 from octowebsocket import WebSocketApp
@@ -9,7 +10,17 @@ from .sentry import Sentry
 # This class gives a bit of an abstraction over the normal ws
 class Client:
 
-    def __init__(self, url, onWsOpen = None, onWsMsg = None, onWsData = None, onWsClose = None, onWsError = None, headers:dict = None, subProtocolList:list = None):
+    # Messages smaller than this that are queued back to back are sent with one socket send, up to the max coalesced size.
+    # Each send is a syscall and, over SSL, a TLS record, so this saves a lot of overhead when there are many small messages.
+    c_CoalesceMaxMsgSize = 16 * 1024
+    c_CoalesceMaxBytes = 64 * 1024
+
+    # How often a sender blocked on a full send queue wakes up to check if the websocket has closed.
+    c_SendQueueWaitCheckSec = 1.0
+
+    # If maxSendQueueBytes is set, the send queue is bounded to about that many bytes, and Send will block until there's room.
+    # If it's None, the send queue is unbounded.
+    def __init__(self, url, onWsOpen = None, onWsMsg = None, onWsData = None, onWsClose = None, onWsError = None, headers:dict = None, subProtocolList:list = None, maxSendQueueBytes:int = None):
 
         # Set the default timeout for the socket. There's no other way to do this than this global var, and it will be shared by all websockets.
         # This is used when the system is writing or receiving, but not when it's waiting to receive, as that's a select()
@@ -28,9 +39,26 @@ class Client:
 
         # We use a send queue thread because it allows us to process downloads about 2x faster.
         # This is because the downstream work of the WS can be made faster if it's done in parallel
-        self.SendQueue = queue.Queue()
+        # The queue is bounded by bytes rather than messages, since the messages range from a few bytes to about 500KB.
+        self.SendQueue = collections.deque()
+        self.SendQueueCondition = threading.Condition()
+        self.SendQueueBytes = 0
+        self.MaxSendQueueBytes = maxSendQueueBytes
         self.SendThread:threading.Thread = None
 
+        # Send queue stats, used for debugging. The latency is the time a message waits in the queue before it's sent.
+        self.SendQueueHighWaterBytes = 0
+        self.SendQueueAvgLatencySec = 0.0
+        self.SendQueueMaxLatencySec = 0.0
+        self.SentMsgs = 0
+        self.CoalescedSends = 0
+        self.CoalescedMsgs = 0
+        self.BlockedSends = 0
+        self.BlockedSec = 0.0
+
+        # Measures the send throughput of the websocket, used by the adaptive compression.
+        self.SendThroughput = SendThroughputMeter()
+
         # Used to log more details about what's going on with the websocket.
         # websocket.enableTrace(True)
 
@@ -172,7 +200,10 @@ class Client:
         # Always ensure we close the send queue.
         try:
             # Push an empty buffer to the send queue, which will close it.
-            self.SendQueue.put(SendQueueContext(None))
+            # This also wakes up any senders blocked on a full queue, which will see the closed flag.
+            with self.SendQueueCondition:
+                self.SendQueue.append(SendQueueContext(None))
+                self.SendQueueCondition.notify_all()
         except Exception as e:
             Sentry.Exception("Exception while trying to close the send queue.", e)
 
@@ -231,41 +262,158 @@ class Client:
         self._Close()
 
 
-    def Send(self, buffer:bytearray, msgStartOffsetBytes:int = None, msgSize:int = None, isData:bool = True):
+    def Send(self, buffer:bytearray, msgStartOffsetBytes:int = None, msgSize:int = None, isData:bool = True, sentCallback = None):
         if isData:
-            self.SendWithOptCode(buffer, msgStartOffsetBytes, msgSize, octowebsocket.ABNF.OPCODE_BINARY)
+            self.SendWithOptCode(buffer, msgStartOffsetBytes, msgSize, octowebsocket.ABNF.OPCODE_BINARY, sentCallback)
         else:
-            self.SendWithOptCode(buffer, msgStartOffsetBytes, msgSize, octowebsocket.ABNF.OPCODE_TEXT)
+            self.SendWithOptCode(buffer, msgStartOffsetBytes, msgSize, octowebsocket.ABNF.OPCODE_TEXT, sentCallback)
 
 
     # Sends a buffer, with an optional message start offset and size.
     # If the message start offset and size are not provided, it's assumed the buffer starts at 0 and the size is the full buffer.
     # Providing a bytearray with room in the front allows the system to avoid copying the buffer.
-    def SendWithOptCode(self, buffer:bytearray, msgStartOffsetBytes:int = None, msgSize:int = None, optCode = octowebsocket.ABNF.OPCODE_BINARY):
+    # The buffer is sent on the send thread, so it must not be changed until then. If the optional sentCallback is set, it's called
+    # on the send thread once the buffer has been sent and can be reused. It's not called if the websocket closes before the send.
+    # If the send queue is bounded and full, this blocks until there's room, which slows down whatever is producing the data.
+    def SendWithOptCode(self, buffer:bytearray, msgStartOffsetBytes:int = None, msgSize:int = None, optCode = octowebsocket.ABNF.OPCODE_BINARY, sentCallback = None):
         try:
             # Make sure we have a buffer, this is invalid and it will also shutdown our send thread.
             if buffer is None:
                 raise Exception("We tired to send a message to the websocket with a None buffer.")
-            self.SendQueue.put(SendQueueContext(buffer, msgStartOffsetBytes, msgSize, optCode))
+            context = SendQueueContext(buffer, msgStartOffsetBytes, msgSize, optCode, sentCallback)
+            with self.SendQueueCondition:
+                # A message is always allowed into an empty queue, so a message bigger than the limit can't block forever.
+                # Sends from the send thread itself, like from a sent callback, must never block, since only that thread can make room.
+                if self.MaxSendQueueBytes is not None and threading.current_thread() is not self.SendThread:
+                    blockStartSec = None
+                    while self.SendQueueBytes > 0 and self.SendQueueBytes + context.Size > self.MaxSendQueueBytes and self.isClosed is False:
+                        if blockStartSec is None:
+                            blockStartSec = time.time()
+                            self.BlockedSends += 1
+                        self.SendQueueCondition.wait(Client.c_SendQueueWaitCheckSec)
+                    if blockStartSec is not None:
+                        self.BlockedSec += time.time() - blockStartSec
+                context.QueuedSec = time.time()
+                self.SendQueue.append(context)
+                self.SendQueueBytes += context.Size
+                self.SendQueueHighWaterBytes = max(self.SendQueueHighWaterBytes, self.SendQueueBytes)
+                self.SendQueueCondition.notify_all()
         except Exception as e:
             # If any exception happens during sending, we want to report the error
             # and shutdown the entire websocket.
             self.handleWsError(e)
 
 
+    # Returns the measured send throughput in bytes per second, or 0 if it's not known yet.
+    def GetSendBytesPerSec(self) -> float:
+        return self.SendThroughput.GetBytesPerSec()
+
+
+    # Returns the send queue stats, used for debugging. The max latency is reset each time this is called.
+    def GetSendQueueStats(self) -> dict:
+        with self.SendQueueCondition:
+            stats = {
+                "QueuedBytes": self.SendQueueBytes,
+                "QueuedMsgs": len(self.SendQueue),
+                "MaxQueuedBytes": self.MaxSendQueueBytes,
+                "HighWaterBytes": self.SendQueueHighWaterBytes,
+                "AvgLatencyMs": round(self.SendQueueAvgLatencySec * 1000.0, 1),
+                "MaxLatencyMs": round(self.SendQueueMaxLatencySec * 1000.0, 1),
+                "SentMsgs": self.SentMsgs,
+                "CoalescedSends": self.CoalescedSends,
+                "CoalescedMsgs": self.CoalescedMsgs,
+                "BlockedSends": self.BlockedSends,
+                "BlockedSec": round(self.BlockedSec, 2),
+                "SendBytesPerSec": round(self.SendThroughput.GetBytesPerSec()),
+            }
+            self.SendQueueMaxLatencySec = 0.0
+            return stats
+
+
+    def _UpdateSendThroughput(self, sentBytes:int) -> None:
+        with self.SendQueueCondition:
+            isBacklogged = self.SendQueueBytes > 0
+        self.SendThroughput.OnSent(sentBytes, isBacklogged, time.time())
+
+
+    def _FireSentCallback(self, context) -> None:
+        # The callback must not take down the send thread.
+        try:
+            context.SentCallback()
+        except Exception as e:
+            Sentry.Exception("Websocket client exception in the sent callback.", e)
+
+
+    # Blocks until there's something to send, and returns a list of one or more messages to send.
+    # Small messages that are already queued back to back are returned together, so they can be sent at once.
+    # Returns None if the send queue is closed.
+    def _GetNextSendContexts(self):
+        with self.SendQueueCondition:
+            while len(self.SendQueue) == 0:
+                self.SendQueueCondition.wait()
+            context = self.SendQueue.popleft()
+            # If it's None, that means we are shutting down.
+            if context.Buffer is None:
+                return None
+            contexts = [context]
+            totalSize = context.Size
+            if context.Size < Client.c_CoalesceMaxMsgSize:
+                while len(self.SendQueue) > 0:
+                    nextContext = self.SendQueue[0]
+                    if nextContext.Buffer is None or nextContext.Size >= Client.c_CoalesceMaxMsgSize or totalSize + nextContext.Size > Client.c_CoalesceMaxBytes:
+                        break
+                    contexts.append(self.SendQueue.popleft())
+                    totalSize += nextContext.Size
+            # Update the stats and wake up any senders waiting for room.
+            now = time.time()
+            for c in contexts:
+                self.SendQueueBytes -= c.Size
+                latencySec = now - c.QueuedSec
+                self.SendQueueAvgLatencySec = self.SendQueueAvgLatencySec * 0.9 + latencySec * 0.1
+                self.SendQueueMaxLatencySec = max(self.SendQueueMaxLatencySec, latencySec)
+            self.SentMsgs += len(contexts)
+            if len(contexts) > 1:
+                self.CoalescedSends += 1
+                self.CoalescedMsgs += len(contexts)
+            self.SendQueueCondition.notify_all()
+            return contexts
+
+
+    # Sends many messages with one socket send, by formatting each frame and sending them all as one buffer.
+    def _SendCoalesced(self, contexts:list) -> int:
+        data = bytearray()
+        for c in contexts:
+            data += octowebsocket.ABNF.create_frame(c.Buffer, c.OptCode, use_frame_mask=False, data_start_offset_bytes=c.MsgStartOffsetBytes, data_msg_length_bytes=c.MsgSize).format()
+        # Like WebSocketApp.send, make sure the socket exists, and use the socket's send_frame so the send is done under its lock.
+        # This keeps the pings sent by the WebSocketApp from being written in the middle of our frames.
+        sock = self.Ws.sock
+        if sock is None or sock.send_frame(FormattedFrames(data)) == 0:
+            raise octowebsocket.WebSocketConnectionClosedException("Connection is already closed.")
+        return len(data)
+
+
     def _SendQueueThread(self):
         try:
             while self.isClosed is False:
                 # Wait on something to send.
-                context = self.SendQueue.get()
+                contexts = self._GetNextSendContexts()
                 # If it's None, that means we are shutting down.
-                if context is None or context.Buffer is None:
+                if contexts is None:
                     return
                 # Send it!
                 # Important! We don't want to use the frame mask because it adds about 30% CPU usage on low end devices.
                 # The frame masking was only need back when websockets were used over the internet without SSL.
                 # Our server, OctoPrint, and Moonraker all accept unmasked frames, so its safe to do this for all WS.
-                self.Ws.send(context.Buffer, context.OptCode, False, context.MsgStartOffsetBytes, context.MsgSize)
+                if len(contexts) == 1:
+                    context = contexts[0]
+                    self.Ws.send(context.Buffer, context.OptCode, False, context.MsgStartOffsetBytes, context.MsgSize)
+                    sentBytes = context.Size
+                else:
+                    sentBytes = self._SendCoalesced(contexts)
+                self._UpdateSendThroughput(sentBytes)
+                for context in contexts:
+                    if context.SentCallback is not None:
+                        self._FireSentCallback(context)
         except Exception as e:
             # If any exception happens during sending, we want to report the error
             # and shutdown the entire websocket.
@@ -332,8 +480,85 @@ class Client:
 
 
 class SendQueueContext():
-    def __init__(self, buffer:bytearray, msgStartOffsetBytes:int = None, msgSize:int = None, optCode = octowebsocket.ABNF.OPCODE_BINARY) -> None:
+    def __init__(self, buffer:bytearray, msgStartOffsetBytes:int = None, msgSize:int = None, optCode = octowebsocket.ABNF.OPCODE_BINARY, sentCallback = None) -> None:
         self.Buffer = buffer
         self.MsgStartOffsetBytes = msgStartOffsetBytes
         self.MsgSize = msgSize
         self.OptCode = optCode
+        self.SentCallback = sentCallback
+        # The size used for the send queue limit.
+        self.Size = 0
+        if msgSize is not None:
+            self.Size = msgSize
+        elif buffer is not None:
+            self.Size = len(buffer) - (msgStartOffsetBytes if msgStartOffsetBytes is not None else 0)
+        # Set when the message is added to the send queue.
+        self.QueuedSec = 0.0
+
+
+# Measures the send throughput of a websocket from how fast its send queue drains.
+# A socket send returns as soon as the data is copied into the socket buffer, so the time a send takes says nothing about the link.
+# But while the send queue is backlogged the send thread never waits on the senders, so the rate the queue drains is the rate of the link.
+# So the throughput is only measured over windows where the queue stayed backlogged, and it's not reported until a few windows were measured.
+class SendThroughputMeter():
+
+    # How long the queue must stay backlogged for one sample.
+    c_WindowSec = 1.0
+
+    # The number of samples needed before the throughput is reported.
+    c_MinSamples = 3
+
+    def __init__(self) -> None:
+        self.BytesPerSec = 0.0
+        self.Samples = 0
+        self.WindowStartSec = None
+        self.WindowBytes = 0
+        self.IsFirstWindow = True
+
+
+    # Called after each send, with if the send queue still has data queued.
+    def OnSent(self, sentBytes:int, isBacklogged:bool, nowSec:float) -> None:
+        if isBacklogged is False:
+            # The link might go idle, so the next window has to start over.
+            self.WindowStartSec = None
+            return
+        if self.WindowStartSec is None:
+            # The window starts at the end of this send, so its bytes aren't counted.
+            self.WindowStartSec = nowSec
+            self.WindowBytes = 0
+            self.IsFirstWindow = True
+            return
+        self.WindowBytes += sentBytes
+        elapsedSec = nowSec - self.WindowStartSec
+        if elapsedSec < SendThroughputMeter.c_WindowSec:
+            return
+        bytesPerSec = float(self.WindowBytes) / elapsedSec
+        self.WindowStartSec = nowSec
+        self.WindowBytes = 0
+        # The first sends of a backlog only fill the socket buffer, so the first window is too high and is skipped.
+        if self.IsFirstWindow:
+            self.IsFirstWindow = False
+            return
+        if self.Samples == 0:
+            self.BytesPerSec = bytesPerSec
+        else:
+            self.BytesPerSec = self.BytesPerSec * 0.8 + bytesPerSec * 0.2
+        self.Samples += 1
+
+
+    # Returns the measured throughput in bytes per second, or 0 if not enough samples have been measured yet.
+    def GetBytesPerSec(self) -> float:
+        if self.Samples < SendThroughputMeter.c_MinSamples:
+            return 0.0
+        return self.BytesPerSec
+
+
+# Used to send frames that are already formatted with the websocket's send_frame.
+class FormattedFrames():
+    def __init__(self, data:bytearray) -> None:
+        self.Data = data
+        # Set by send_frame if the websocket uses a custom mask key function, which isn't used since the data is already formatted.
+        self.get_mask_key = None
+
+    def format(self):
+        return self.Data
@@ -16,6 +16,7 @@ from octoeverywhere.notificationshandler import NotificationsHandler
 from octoeverywhere.octopingpong import OctoPingPong
 from octoeverywhere.httpsessions import HttpSessions
 from octoeverywhere.compression import Compression
+from octoeverywhere.assetcache import AssetCache
 from octoeverywhere.telemetry import Telemetry
 from octoeverywhere.deviceid import DeviceId
 from octoeverywhere.sentry import Sentry
@@ -184,6 +185,9 @@ class OctoeverywherePlugin(octoprint.plugin.StartupPlugin,
         # Setup compression
         Compression.Init(self._logger, self.get_plugin_data_folder())
 
+        # Setup the asset cache, which depends on compression.
+        AssetCache.Init(self._logger, self.get_plugin_data_folder())
+
         # Init the static local auth helper
         LocalAuth.Init(self._logger, self._user_manager)
 
@@ -11,6 +11,7 @@ from octoeverywhere.commandhandler import CommandHandler
 from octoeverywhere.octopingpong import OctoPingPong
 from octoeverywhere.httpsessions import HttpSessions
 from octoeverywhere.compression import Compression
+from octoeverywhere.assetcache import AssetCache
 from octoeverywhere.telemetry import Telemetry
 from octoeverywhere.deviceid import DeviceId
 from octoeverywhere.sentry import Sentry
@@ -184,6 +185,9 @@ if __name__ == '__main__':
     # Setup compression
     Compression.Init(logger, PluginFilePathRoot)
 
+    # Setup the asset cache, which depends on compression.
+    AssetCache.Init(logger, PluginFilePathRoot)
+
     # Init the mdns client
     MDns.Init(logger, PluginFilePathRoot)
     #MDns.Get().Test()
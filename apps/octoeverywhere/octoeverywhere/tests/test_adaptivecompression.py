@@ -0,0 +1,113 @@
+# pylint: disable=protected-access # The tests check the compression internals.
+import shutil
+import logging
+import tempfile
+import unittest
+
+from octoeverywhere.compression import Compression
+from octoeverywhere.adaptivecompression import AdaptiveCompression
+from octoeverywhere.websocketimpl import SendThroughputMeter
+
+
+# Simulates the send thread of a websocket on a link, with a socket buffer that takes data without waiting until it's full.
+class FakeLink:
+
+    SocketBufferBytes = 256 * 1024
+
+    # The time it takes to copy a message into the socket buffer.
+    LocalSendSec = 0.0001
+
+    def __init__(self, linkBytesPerSec:float) -> None:
+        self.LinkBytesPerSec = linkBytesPerSec
+        self.NowSec = 1000.0
+        self.BufferedBytes = 0.0
+
+
+    # Sends a message and returns how long the send blocked.
+    def Send(self, size:int) -> float:
+        startSec = self.NowSec
+        self.NowSec += FakeLink.LocalSendSec
+        self.BufferedBytes = max(0.0, self.BufferedBytes - FakeLink.LocalSendSec * self.LinkBytesPerSec)
+        overflow = self.BufferedBytes + size - FakeLink.SocketBufferBytes
+        if overflow > 0:
+            # Wait for the link to make room.
+            self.NowSec += overflow / self.LinkBytesPerSec
+            self.BufferedBytes -= overflow
+        self.BufferedBytes += size
+        return self.NowSec - startSec
+
+
+class TestAdaptiveCompression(unittest.TestCase):
+
+    MsgSize = 32 * 1024
+
+
+    def setUp(self) -> None:
+        self.Logger = logging.getLogger("test_adaptivecompression")
+        self.TempDir = tempfile.mkdtemp()
+        Compression.Init(self.Logger, self.TempDir)
+        # Measure every level as fast, with a good ratio, like a fast host would.
+        for level in list(AdaptiveCompression.ZStandardLevels.keys()) + list(AdaptiveCompression.ZlibLevels.keys()):
+            Compression.Get()._RecordLevelStats(level, 1000000, 300000, 0.02)
+        self.Meter = SendThroughputMeter()
+        self.Adaptive = AdaptiveCompression(self.Logger, "test", self.Meter.GetBytesPerSec)
+
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.TempDir, ignore_errors=True)
+
+
+    # Sends back to back messages for the given time, while the send queue stays backlogged, and returns the levels picked.
+    def _SendBacklogged(self, link:FakeLink, durationSec:float) -> list:
+        levels = []
+        endSec = link.NowSec + durationSec
+        while link.NowSec < endSec:
+            link.Send(TestAdaptiveCompression.MsgSize)
+            self.Meter.OnSent(TestAdaptiveCompression.MsgSize, True, link.NowSec)
+            # Evaluate after every send.
+            self.Adaptive.LastEvaluateSec = 0.0
+            levels.append(self.Adaptive.GetCompressionLevel())
+        return levels
+
+
+    def test_fast_local_send_on_slow_link_keeps_compression(self):
+        link = FakeLink(64 * 1024)
+        # The first sends only fill the socket buffer, so they return right away.
+        self.assertLess(link.Send(TestAdaptiveCompression.MsgSize), 0.001)
+        levels = self._SendBacklogged(link, 30.0)
+        self.assertNotIn(AdaptiveCompression.NoCompression, levels)
+        self.assertNotEqual(self.Adaptive.CurrentLevel, AdaptiveCompression.NoCompression)
+        self.assertAlmostEqual(self.Meter.GetBytesPerSec(), link.LinkBytesPerSec, delta=link.LinkBytesPerSec * 0.1)
+
+
+    def test_not_backlogged_keeps_default_level(self):
+        link = FakeLink(64 * 1024)
+        for _ in range(1000):
+            link.Send(TestAdaptiveCompression.MsgSize)
+            self.Meter.OnSent(TestAdaptiveCompression.MsgSize, False, link.NowSec)
+            # The link goes idle between the sends.
+            link.NowSec += 1.0
+            self.Adaptive.LastEvaluateSec = 0.0
+            self.Adaptive.GetCompressionLevel()
+        self.assertEqual(self.Meter.GetBytesPerSec(), 0.0)
+        self.assertEqual(self.Adaptive.CurrentLevel, Compression.DefaultLevel)
+
+
+    def test_throughput_needs_min_samples(self):
+        link = FakeLink(64 * 1024)
+        self._SendBacklogged(link, SendThroughputMeter.c_WindowSec * SendThroughputMeter.c_MinSamples)
+        # The first window only fills the socket buffer, so it's not counted.
+        self.assertEqual(self.Meter.GetBytesPerSec(), 0.0)
+        self.assertEqual(self.Adaptive.CurrentLevel, Compression.DefaultLevel)
+        self._SendBacklogged(link, SendThroughputMeter.c_WindowSec * 2)
+        self.assertGreater(self.Meter.GetBytesPerSec(), 0.0)
+
+
+    def test_fast_link_turns_compression_off(self):
+        link = FakeLink(1000 * 1024 * 1024)
+        self._SendBacklogged(link, 5.0)
+        self.assertEqual(self.Adaptive.CurrentLevel, AdaptiveCompression.NoCompression)
+
+
+if __name__ == '__main__':
+    unittest.main()
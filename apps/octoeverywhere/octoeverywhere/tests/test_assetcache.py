@@ -0,0 +1,113 @@
+# pylint: disable=protected-access # The tests check the cache internals.
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+
+from octoeverywhere.compression import Compression
+from octoeverywhere.assetcache import AssetCache
+from octoeverywhere.Proto.PathTypes import PathTypes
+
+
+class FakeHttpInitialContext:
+
+    def __init__(self, path:str) -> None:
+        self.Path_ = path
+
+    def Path(self):
+        return self.Path_.encode("utf-8")
+
+    def PathType(self):
+        return PathTypes.Relative
+
+
+class TestAssetCache(unittest.TestCase):
+
+    # User files from Moonraker and friends, with names that look like they have a content hash or version.
+    UserFilePaths = [
+        "/server/files/gcodes/.thumbs/calibration-cube_20mm.png",
+        "/server/files/gcodes/.thumbs/Benchy-PLA_0_2mm_1h30m.png",
+        "/server/files/gcodes/.thumbs/my-print_v2_final1.png",
+        "/server/files/config/printer_data.20240101.json",
+        "/server/files/gcodes/.thumbs/Benchy-PLA_0_2mm_1h30m.png?timestamp=1700000000",
+        "/calibration-cube_20mm.png",
+        "/printer_data.20240101.json",
+        "/webcam/my-print_v2_final1.png",
+    ]
+
+
+    def setUp(self) -> None:
+        self.Logger = logging.getLogger("test_assetcache")
+        self.TempDir = tempfile.mkdtemp()
+        Compression.Init(self.Logger, self.TempDir)
+        self.Cache = AssetCache(self.Logger, self.TempDir)
+
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.TempDir, ignore_errors=True)
+
+
+    def _Store(self, path:str, body:bytes, isImmutable:bool) -> dict:
+        entry = {
+            "Key": path,
+            "Immutable": isImmutable,
+            "ETag": "\"1\"",
+            "LastModified": None,
+            "Headers": [["Content-Type", "image/png"]],
+        }
+        self.Cache._StoreEntry(entry, body)
+        return self.Cache.Entries[path]
+
+
+    def test_user_files_are_not_immutable(self):
+        for path in TestAssetCache.UserFilePaths:
+            self.assertFalse(self.Cache._IsImmutablePath(path), path)
+
+
+    def test_user_files_are_revalidated(self):
+        for path in TestAssetCache.UserFilePaths:
+            self._Store(path, os.urandom(1000), self.Cache._IsImmutablePath(path))
+            lookup = self.Cache.Lookup(FakeHttpInitialContext(path), "GET", {})
+            self.assertIsNone(lookup.Result, path)
+            self.assertIsNotNone(lookup.RevalidateEntry, path)
+            self.assertEqual(lookup.SendHeaders["If-None-Match"], "\"1\"")
+
+
+    def test_build_assets_are_immutable(self):
+        for path in ["/assets/index-BPx1Y8Q9.js", "/assets/app.3f9a7c2b.css", "/static/webassets/packed_libs.js?4d3b4c5e", "/plugin/foo/static/js/foo.js?v=1.10.2"]:
+            self.assertTrue(self.Cache._IsImmutablePath(path), path)
+        for path in ["/assets/logo.png", "/assets/fa-solid-900.woff2", "/static/webassets/packed_libs.js"]:
+            self.assertFalse(self.Cache._IsImmutablePath(path), path)
+
+
+    def test_immutable_cache_control(self):
+        self.assertTrue(self.Cache._IsImmutableCacheControl("public, max-age=31536000, immutable"))
+        self.assertTrue(self.Cache._IsImmutableCacheControl("max-age=31536000"))
+        self.assertFalse(self.Cache._IsImmutableCacheControl("max-age=60"))
+        self.assertFalse(self.Cache._IsImmutableCacheControl("s-maxage=31536000"))
+        self.assertFalse(self.Cache._IsImmutableCacheControl("no-cache, max-age=31536000"))
+
+
+    def test_read_mismatch_keeps_newer_entry(self):
+        path = "/assets/index-BPx1Y8Q9.js"
+        oldEntry = self._Store(path, os.urandom(1000), True)
+        # A new version of the entry is stored after the old entry was looked up, so reading with the old entry sees the new file's size.
+        newEntry = self._Store(path, os.urandom(2000), True)
+        self.assertIsNone(self.Cache._ReadEntryBody(oldEntry))
+        self.assertIs(self.Cache.Entries[path], newEntry)
+        self.assertIsNotNone(self.Cache._ReadEntryBody(newEntry))
+
+
+    def test_read_mismatch_removes_current_entry(self):
+        path = "/assets/index-BPx1Y8Q9.js"
+        entry = self._Store(path, os.urandom(1000), True)
+        with open(os.path.join(self.Cache.CacheDir, entry["FileName"]), "wb") as f:
+            f.write(b"short")
+        self.assertIsNone(self.Cache._ReadEntryBody(entry))
+        self.assertNotIn(path, self.Cache.Entries)
+        self.assertFalse(os.path.exists(os.path.join(self.Cache.CacheDir, entry["FileName"])))
+
+
+if __name__ == '__main__':
+    unittest.main()
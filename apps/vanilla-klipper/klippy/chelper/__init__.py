@@ -3,7 +3,7 @@
 # Copyright (C) 2016-2021  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import os, logging
+import os, logging, importlib
 import cffi
 
 
@@ -24,6 +24,7 @@ SOURCE_FILES = [
     'kin_extruder.c', 'kin_shaper.c', 'kin_idex.c',
 ]
 DEST_LIB = "c_helper.so"
+FFI_MODULE = "c_helper_ffi"
 OTHER_FILES = [
     'list.h', 'serialqueue.h', 'stepcompress.h', 'itersolve.h', 'pyhelper.h',
     'trapq.h', 'pollreactor.h', 'msgblock.h'
@@ -262,6 +263,32 @@ def do_build_code(cmd):
         logging.error(msg)
         raise Exception(msg)
 
+# Generate a python module containing the pre-parsed cffi declarations
+def do_build_ffi_module(destfile):
+    ffi_main = cffi.FFI()
+    for d in defs_all:
+        ffi_main.cdef(d)
+    ffi_main.set_source(FFI_MODULE, None)
+    tmpfile = destfile + ".tmp"
+    ffi_main.emit_python_code(tmpfile)
+    os.rename(tmpfile, destfile)
+
+# Load the cffi declarations (from the pre-parsed module if possible)
+def load_ffi(srcdir):
+    destfile = get_abs_files(srcdir, [FFI_MODULE + ".py"])[0]
+    try:
+        if check_build_code([__file__], destfile):
+            logging.info("Building cffi module %s", FFI_MODULE)
+            do_build_ffi_module(destfile)
+        mod = importlib.import_module('.' + FFI_MODULE, __name__)
+        return mod.ffi
+    except Exception:
+        logging.exception("Unable to load cffi module %s", FFI_MODULE)
+    ffi_main = cffi.FFI()
+    for d in defs_all:
+        ffi_main.cdef(d)
+    return ffi_main
+
 FFI_main = None
 FFI_lib = None
 pyhelper_logging_callback = None
@@ -285,9 +312,7 @@ def get_ffi():
                 cmd = "%s %s" % (GCC_CMD, COMPILE_ARGS)
             logging.info("Building C code module %s", DEST_LIB)
             do_build_code(cmd % (destlib, ' '.join(srcfiles)))
-        FFI_main = cffi.FFI()
-        for d in defs_all:
-            FFI_main.cdef(d)
+        FFI_main = load_ffi(srcdir)
         FFI_lib = FFI_main.dlopen(destlib)
         # Setup error logging
         pyhelper_logging_callback = FFI_main.callback("void func(const char *)",
@@ -39,20 +39,46 @@ class AccelQueryHelper:
         self.request_start_time = self.request_end_time = print_time
         self.msgs = []
         self.samples = []
+        self.samples_callback = None
+        self.keep_msgs = True
+        self.is_finishing = False
+        self.streamed_count = 0
+    def set_samples_callback(self, callback, keep_msgs=True):
+        # Deliver the measured samples to 'callback' as they arrive.  If
+        # keep_msgs is False the samples are not stored, so long
+        # measurements use bounded memory.
+        self.samples_callback = callback
+        self.keep_msgs = keep_msgs
     def finish_measurements(self):
         toolhead = self.printer.lookup_object('toolhead')
         self.request_end_time = toolhead.get_last_move_time()
+        self.is_finishing = True
         toolhead.wait_moves()
         self.is_finished = True
+    def _stream_batch(self, msg):
+        start_time = self.request_start_time
+        samples = [s for s in msg['data'] if s[0] >= start_time]
+        if self.is_finishing:
+            end_time = self.request_end_time
+            samples = [s for s in samples if s[0] <= end_time]
+        if samples:
+            self.streamed_count += len(samples)
+            self.samples_callback(samples)
     def handle_batch(self, msg):
         if self.is_finished:
             return False
+        if self.samples_callback is not None:
+            self._stream_batch(msg)
+            if not self.keep_msgs:
+                return True
         if len(self.msgs) >= 10000:
             # Avoid filling up memory with too many samples
             return False
         self.msgs.append(msg)
         return True
     def has_valid_samples(self):
+        if self.streamed_count:
+            return True
         for msg in self.msgs:
             data = msg['data']
             first_sample_time = data[0][0]
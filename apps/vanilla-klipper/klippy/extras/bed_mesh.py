@@ -3,7 +3,7 @@
 # Copyright (C) 2018-2019 Eric Callahan <arksine.code@gmail.com>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import logging, math, json, collections
+import logging, math, json, collections, itertools
 from . import probe
 
 PROFILE_VERSION = 1
@@ -170,6 +170,11 @@ class BedMesh:
         gcode_move = self.printer.lookup_object('gcode_move')
         gcode_move.reset_last_position()
         self.update_status()
+        if mesh is not None:
+            # The new mesh is long lived - freeze it at the next full gc
+            gcol = self.printer.lookup_object('garbage_collection', None)
+            if gcol is not None:
+                gcol.request_refreeze()
     def get_z_factor(self, z_pos):
         z_pos += self.tool_offset
         if z_pos >= self.fade_end:
@@ -332,8 +337,9 @@ class BedMeshCalibrate:
         self.mesh_config = collections.OrderedDict()
         self._init_mesh_config(config)
         self.probe_mgr = ProbeManager(
-            config, self.orig_config, self.probe_finalize
+            config, self.orig_config, self.probe_finalize, self.probe_point
         )
+        self.result_collector = None
         try:
             self.probe_mgr.generate_points(
                 self.mesh_config, self.mesh_min, self.mesh_max,
@@ -645,168 +651,250 @@ class BedMeshCalibrate:
         if not self._profile_name.strip():
             raise gcmd.error("Value for parameter 'PROFILE' must be specified")
         self.bedmesh.set_mesh(None)
+        self.result_collector = None
         try:
             self.update_config(gcmd)
         except BedMeshError as e:
             raise gcmd.error(str(e))
         self.probe_mgr.start_probe(gcmd)
+    def probe_point(self, offsets, pos):
+        # Fold each probed point into the mesh as it is reported
+        if self.result_collector is None:
+            self.result_collector = MeshResultCollector(self, offsets)
+        self.result_collector.add_point(pos)
     def probe_finalize(self, offsets, positions):
-        z_offset = offsets[2]
-        positions = [[round(p[0], 2), round(p[1], 2), p[2]]
-                     for p in positions]
-        if self.probe_mgr.get_zero_ref_mode() == ZrefMode.PROBE:
-            ref_pos = positions.pop()
+        collector = self.result_collector
+        self.result_collector = None
+        if collector is None:
+            collector = MeshResultCollector(self, offsets)
+        for pos in positions[collector.get_point_count():]:
+            collector.add_point(pos)
+        z_mesh = collector.finalize()
+        if self.probe_mgr.get_zero_ref_mode() == ZrefMode.IN_MESH:
+            # The reference can be anywhere in the mesh, therefore
+            # it is necessary to set the reference after the initial mesh
+            # is generated to lookup the correct z value.
+            zero_ref_pos = self.probe_mgr.get_zero_ref_pos()
+            z_mesh.set_zero_reference(*zero_ref_pos)
+        self.bedmesh.set_mesh(z_mesh)
+        self.gcode.respond_info("Mesh Bed Leveling Complete")
+        if self._profile_name is not None:
+            self.bedmesh.save_profile(self._profile_name)
+    def dump_points(self, probed_pts, corrected_pts, offsets):
+        # logs generated points with offset applied, points received
+        # from the finalize callback, and the list of corrected points
+        points = self.probe_mgr.get_base_points()
+        logging.info(
+            "bed_mesh: calibration point dump\nIndex | %-17s| %-25s|"
+            " Corrected Point" % ("Generated Point", "Probed Point"))
+        all_pts = itertools.zip_longest(points, probed_pts, corrected_pts)
+        for i, (point, probed, corrected) in enumerate(all_pts):
+            gen_pt = probed_pt = corr_pt = ""
+            if point is not None:
+                off_pt = [p - o for p, o in zip(point, offsets[:2])]
+                gen_pt = "(%.2f, %.2f)" % tuple(off_pt)
+            if probed is not None:
+                probed_pt = "(%.2f, %.2f, %.4f)" % tuple(probed)
+            if corrected is not None:
+                corr_pt = "(%.2f, %.2f, %.4f)" % tuple(corrected)
+            logging.info(
+                "  %-4d| %-17s| %-25s| %s" % (i, gen_pt, probed_pt, corr_pt))
+
+# Build the mesh from probe results as they are reported.  Each probed
+# row is interpolated from a reactor callback as soon as it is complete
+# so that little work remains once the last point is probed.
+class MeshResultCollector:
+    def __init__(self, calibrate, offsets):
+        self.printer = calibrate.printer
+        self.gcode = calibrate.gcode
+        self.calibrate = calibrate
+        probe_mgr = calibrate.probe_mgr
+        self.base_points = probe_mgr.get_base_points()
+        self.substitutes = probe_mgr.get_substitutes()
+        self.zref_mode = probe_mgr.get_zero_ref_mode()
+        self.radius = calibrate.radius
+        self.offsets = offsets
+        self.z_offset = offsets[2]
+        # When the z offset is probed it isn't known until the last point,
+        # so rows hold the raw probed values until finalize
+        self.defer_offset = self.zref_mode == ZrefMode.PROBE
+        params = dict(calibrate.mesh_config)
+        params['min_x'] = min(self.base_points, key=lambda p: p[0])[0]
+        params['max_x'] = max(self.base_points, key=lambda p: p[0])[0]
+        params['min_y'] = min(self.base_points, key=lambda p: p[1])[1]
+        params['max_y'] = max(self.base_points, key=lambda p: p[1])[1]
+        self.x_cnt = params['x_count']
+        self.y_cnt = params['y_count']
+        self.z_mesh = ZMesh(params, calibrate._profile_name)
+        self.z_mesh.start_mesh()
+        # Point tracking
+        self.point_count = 0
+        self.probed_pts = []
+        self.corrected_pts = []
+        self.substitute_pts = []
+        self.ref_pos = None
+        # Matrix tracking
+        self.probed_matrix = []
+        self.row = []
+        self.prev_pos = self.base_points[0]
+        self.invalid_round_row = False
+        self.rows_valid = True
+        self.pending_rows = []
+        self.mesh_error = None
+    def get_point_count(self):
+        return self.point_count
+    def add_point(self, pos):
+        self.point_count += 1
+        pos = [round(pos[0], 2), round(pos[1], 2), pos[2]]
+        idx = len(self.corrected_pts)
+        if idx >= len(self.base_points):
+            # Zero reference position (or unexpected extra points)
+            if self.zref_mode != ZrefMode.PROBE:
+                self.probed_pts.append(pos)
+                self.corrected_pts.append(pos)
+                return
+            if self.ref_pos is not None:
+                self.probed_pts.append(self.ref_pos)
+                self.corrected_pts.append(self.ref_pos)
+            self.ref_pos = pos
+            return
+        self.probed_pts.append(pos)
+        pts = self.substitutes.get(idx)
+        if pts is None:
+            self._add_result(idx, pos)
+            return
+        # Replace substituted points with the original generated
+        # point.  Its Z Value is the average probed Z of the
+        # substituted points.
+        self.substitute_pts.append(pos)
+        if len(self.substitute_pts) < len(pts):
+            return
+        fpt = [p - o for p, o in zip(self.base_points[idx], self.offsets[:2])]
+        avg_z = sum([p[2] for p in self.substitute_pts]) / len(pts)
+        self.substitute_pts = []
+        fpt.append(avg_z)
+        logging.info(
+            "bed_mesh: Replacing value at faulty index %d"
+            " (%.4f, %.4f): avg value = %.6f, avg w/ z_offset = %.6f"
+            % (idx, fpt[0], fpt[1], avg_z, avg_z - self.z_offset))
+        self._add_result(idx, fpt)
+    def _add_result(self, idx, result):
+        self.corrected_pts.append(result)
+        pos = self.base_points[idx]
+        offset_pos = [p - o for p, o in zip(pos, self.offsets[:2])]
+        if (
+            not isclose(offset_pos[0], result[0], abs_tol=.5) or
+            not isclose(offset_pos[1], result[1], abs_tol=.5)
+        ):
+            logging.info(
+                "bed_mesh: point deviation > .5mm: orig pt = (%.2f, %.2f)"
+                ", probed pt = (%.2f, %.2f)"
+                % (offset_pos[0], offset_pos[1], result[0], result[1])
+            )
+        z_pos = result[2]
+        if not self.defer_offset:
+            z_pos -= self.z_offset
+        if not isclose(pos[1], self.prev_pos[1], abs_tol=.1):
+            # y has changed, append row and start new
+            self._finish_row()
+        if pos[0] > self.prev_pos[0]:
+            # probed in the positive direction
+            self.row.append(z_pos)
+        else:
+            # probed in the negative direction
+            self.row.insert(0, z_pos)
+        self.prev_pos = pos
+    def _finish_row(self):
+        row = self.row
+        self.row = []
+        self.probed_matrix.append(row)
+        if self.radius is not None:
+            # round bed, extrapolate probed values to create a square mesh
+            row_size = len(row)
+            if not row_size & 1:
+                # an even number of points in a row shouldn't be possible
+                self.invalid_round_row = True
+                self.rows_valid = False
+                return
+            buf_cnt = (self.x_cnt - row_size) // 2
+            if buf_cnt > 0:
+                row[0:0] = [row[0]] * buf_cnt
+                row.extend([row[row_size-1]] * buf_cnt)
+        if len(row) != self.x_cnt or len(self.probed_matrix) > self.y_cnt:
+            self.rows_valid = False
+        if not self.rows_valid:
+            return
+        self.pending_rows.append(row)
+        if self.defer_offset:
+            return
+        reactor = self.printer.get_reactor()
+        reactor.register_callback(self._process_rows)
+    def _process_rows(self, eventtime=None):
+        while self.pending_rows and self.mesh_error is None:
+            try:
+                self.z_mesh.add_probed_row(self.pending_rows.pop(0))
+            except BedMeshError as e:
+                self.mesh_error = str(e)
+    def finalize(self):
+        z_offset = self.z_offset
+        if self.zref_mode == ZrefMode.PROBE and self.ref_pos is not None:
+            ref_pos = self.ref_pos
             logging.info(
                 "bed_mesh: z-offset replaced with probed z value at "
                 "position (%.2f, %.2f, %.6f)"
                 % (ref_pos[0], ref_pos[1], ref_pos[2])
             )
             z_offset = ref_pos[2]
-        base_points = self.probe_mgr.get_base_points()
-        params = dict(self.mesh_config)
-        params['min_x'] = min(base_points, key=lambda p: p[0])[0]
-        params['max_x'] = max(base_points, key=lambda p: p[0])[0]
-        params['min_y'] = min(base_points, key=lambda p: p[1])[1]
-        params['max_y'] = max(base_points, key=lambda p: p[1])[1]
-        x_cnt = params['x_count']
-        y_cnt = params['y_count']
-
-        substitutes = self.probe_mgr.get_substitutes()
-        probed_pts = positions
-        if substitutes:
-            # Replace substituted points with the original generated
-            # point.  Its Z Value is the average probed Z of the
-            # substituted points.
-            corrected_pts = []
-            idx_offset = 0
-            start_idx = 0
-            for i, pts in substitutes.items():
-                fpt = [p - o for p, o in zip(base_points[i], offsets[:2])]
-                # offset the index to account for additional samples
-                idx = i + idx_offset
-                # Add "normal" points
-                corrected_pts.extend(positions[start_idx:idx])
-                avg_z = sum([p[2] for p in positions[idx:idx+len(pts)]]) \
-                    / len(pts)
-                idx_offset += len(pts) - 1
-                start_idx = idx + len(pts)
-                fpt.append(avg_z)
-                logging.info(
-                    "bed_mesh: Replacing value at faulty index %d"
-                    " (%.4f, %.4f): avg value = %.6f, avg w/ z_offset = %.6f"
-                    % (i, fpt[0], fpt[1], avg_z, avg_z - z_offset))
-                corrected_pts.append(fpt)
-            corrected_pts.extend(positions[start_idx:])
-            positions = corrected_pts
-
         # validate length of result
-        if len(base_points) != len(positions):
-            self._dump_points(probed_pts, positions, offsets)
+        corrected_count = len(self.corrected_pts)
+        if self.zref_mode == ZrefMode.PROBE and self.ref_pos is None:
+            # The last probed point would have been the reference
+            corrected_count -= 1
+        if len(self.base_points) != corrected_count:
+            self.calibrate.dump_points(self.probed_pts, self.corrected_pts,
+                                       self.offsets)
             raise self.gcode.error(
                 "bed_mesh: invalid position list size, "
                 "generated count: %d, probed count: %d"
-                % (len(base_points), len(positions))
+                % (len(self.base_points), corrected_count)
             )
-
-        probed_matrix = []
-        row = []
-        prev_pos = base_points[0]
-        for pos, result in zip(base_points, positions):
-            offset_pos = [p - o for p, o in zip(pos, offsets[:2])]
-            if (
-                not isclose(offset_pos[0], result[0], abs_tol=.5) or
-                not isclose(offset_pos[1], result[1], abs_tol=.5)
-            ):
-                logging.info(
-                    "bed_mesh: point deviation > .5mm: orig pt = (%.2f, %.2f)"
-                    ", probed pt = (%.2f, %.2f)"
-                    % (offset_pos[0], offset_pos[1], result[0], result[1])
-                )
-            z_pos = result[2] - z_offset
-            if not isclose(pos[1], prev_pos[1], abs_tol=.1):
-                # y has changed, append row and start new
-                probed_matrix.append(row)
-                row = []
-            if pos[0] > prev_pos[0]:
-                # probed in the positive direction
-                row.append(z_pos)
-            else:
-                # probed in the negative direction
-                row.insert(0, z_pos)
-            prev_pos = pos
         # append last row
-        probed_matrix.append(row)
-
+        self._finish_row()
+        probed_matrix = self.probed_matrix
         # make sure the y-axis is the correct length
-        if len(probed_matrix) != y_cnt:
+        if len(probed_matrix) != self.y_cnt:
             raise self.gcode.error(
                 ("bed_mesh: Invalid y-axis table length\n"
                  "Probed table length: %d Probed Table:\n%s") %
                 (len(probed_matrix), str(probed_matrix)))
-
-        if self.radius is not None:
-            # round bed, extrapolate probed values to create a square mesh
-            for row in probed_matrix:
-                row_size = len(row)
-                if not row_size & 1:
-                    # an even number of points in a row shouldn't be possible
-                    msg = "bed_mesh: incorrect number of points sampled on X\n"
-                    msg += "Probed Table:\n"
-                    msg += str(probed_matrix)
-                    raise self.gcode.error(msg)
-                buf_cnt = (x_cnt - row_size) // 2
-                if buf_cnt == 0:
-                    continue
-                left_buffer = [row[0]] * buf_cnt
-                right_buffer = [row[row_size-1]] * buf_cnt
-                row[0:0] = left_buffer
-                row.extend(right_buffer)
-
+        if self.invalid_round_row:
+            msg = "bed_mesh: incorrect number of points sampled on X\n"
+            msg += "Probed Table:\n"
+            msg += str(probed_matrix)
+            raise self.gcode.error(msg)
         #  make sure that the x-axis is the correct length
         for row in probed_matrix:
-            if len(row) != x_cnt:
+            if len(row) != self.x_cnt:
                 raise self.gcode.error(
                     ("bed_mesh: invalid x-axis table length\n"
                         "Probed table length: %d Probed Table:\n%s") %
                     (len(probed_matrix), str(probed_matrix)))
-
-        z_mesh = ZMesh(params, self._profile_name)
+        if self.defer_offset:
+            for row in probed_matrix:
+                row[:] = [z - z_offset for z in row]
+        # Complete any remaining interpolation
+        self._process_rows()
+        if self.mesh_error is not None:
+            raise self.gcode.error(self.mesh_error)
+        z_mesh = self.z_mesh
         try:
-            z_mesh.build_mesh(probed_matrix)
+            z_mesh.finish_mesh()
         except BedMeshError as e:
             raise self.gcode.error(str(e))
-        if self.probe_mgr.get_zero_ref_mode() == ZrefMode.IN_MESH:
-            # The reference can be anywhere in the mesh, therefore
-            # it is necessary to set the reference after the initial mesh
-            # is generated to lookup the correct z value.
-            zero_ref_pos = self.probe_mgr.get_zero_ref_pos()
-            z_mesh.set_zero_reference(*zero_ref_pos)
-        self.bedmesh.set_mesh(z_mesh)
-        self.gcode.respond_info("Mesh Bed Leveling Complete")
-        if self._profile_name is not None:
-            self.bedmesh.save_profile(self._profile_name)
-    def _dump_points(self, probed_pts, corrected_pts, offsets):
-        # logs generated points with offset applied, points received
-        # from the finalize callback, and the list of corrected points
-        points = self.probe_mgr.get_base_points()
-        max_len = max([len(points), len(probed_pts), len(corrected_pts)])
-        logging.info(
-            "bed_mesh: calibration point dump\nIndex | %-17s| %-25s|"
-            " Corrected Point" % ("Generated Point", "Probed Point"))
-        for i in list(range(max_len)):
-            gen_pt = probed_pt = corr_pt = ""
-            if i < len(points):
-                off_pt = [p - o for p, o in zip(points[i], offsets[:2])]
-                gen_pt = "(%.2f, %.2f)" % tuple(off_pt)
-            if i < len(probed_pts):
-                probed_pt = "(%.2f, %.2f, %.4f)" % tuple(probed_pts[i])
-            if i < len(corrected_pts):
-                corr_pt = "(%.2f, %.2f, %.4f)" % tuple(corrected_pts[i])
-            logging.info(
-                "  %-4d| %-17s| %-25s| %s" % (i, gen_pt, probed_pt, corr_pt))
+        return z_mesh
 
 class ProbeManager:
-    def __init__(self, config, orig_config, finalize_cb):
+    def __init__(self, config, orig_config, finalize_cb, point_cb=None):
         self.printer = config.get_printer()
         self.cfg_overshoot = config.getfloat("scan_overshoot", 0, minval=1.)
         self.orig_config = orig_config
@@ -821,6 +909,7 @@ class ProbeManager:
         self.is_round = orig_config["radius"] is not None
         self.probe_helper = probe.ProbePointsHelper(config, finalize_cb, [])
         self.probe_helper.use_xy_offsets(True)
+        self.probe_helper.set_point_callback(point_cb)
         self.rapid_scan_helper = RapidScanHelper(config, self, finalize_cb)
         self._init_faulty_regions(config)
 
@@ -1336,11 +1425,14 @@ class ZMesh:
                self.mesh_x_max, self.mesh_y_max))
         # Set the interpolation algorithm
         interpolation_algos = {
-            'lagrange': self._sample_lagrange,
-            'bicubic': self._sample_bicubic,
-            'direct': self._sample_direct
+            'lagrange': (self._sample_lagrange_x, self._sample_lagrange_y),
+            'bicubic': (self._sample_bicubic_x, self._sample_bicubic_y),
+            'direct': (None, None)
         }
-        self._sample = interpolation_algos.get(params['algo'])
+        self._sample_x, self._sample_y = interpolation_algos.get(
+            params['algo'])
+        self.y_segments_done = 0
+        self.x_lagrange_factors = None
         # Number of points to interpolate per segment
         mesh_x_pps = params['mesh_x_pps']
         mesh_y_pps = params['mesh_y_pps']
@@ -1402,8 +1494,34 @@ class ZMesh:
         else:
             print_func("bed_mesh: Z Mesh not generated")
     def build_mesh(self, z_matrix):
-        self.probed_matrix = z_matrix
-        self._sample(z_matrix)
+        self.start_mesh()
+        for z_row in z_matrix:
+            self.add_probed_row(z_row)
+        self.finish_mesh()
+    # Incremental mesh generation - probed rows must be added in y order
+    def start_mesh(self):
+        self.probed_matrix = []
+        self.y_segments_done = 0
+        if self._sample_x is None:
+            # Direct sampling
+            self.mesh_matrix = self.probed_matrix
+            return
+        self.mesh_matrix = [[0.] * self.mesh_x_count
+                            for j in range(self.mesh_y_count)]
+    def add_probed_row(self, z_row):
+        row_idx = len(self.probed_matrix)
+        self.probed_matrix.append(z_row)
+        if self._sample_x is None:
+            return
+        x_mult = self.x_mult
+        mesh_row = self.mesh_matrix[row_idx * self.y_mult]
+        for i, z in enumerate(z_row):
+            mesh_row[i * x_mult] = z
+        self._sample_x(row_idx * self.y_mult)
+        self._sample_y(row_idx)
+    def finish_mesh(self):
+        if self._sample_y is not None:
+            self._sample_y(None)
         self.print_mesh(logging.debug)
     def set_zero_reference(self, xpos, ypos):
         offset = self.calc_z(xpos, ypos)
@@ -1469,34 +1587,31 @@ class ZMesh:
         idx = constrain(idx, 0, mesh_cnt - 2)
         t = (coord - cfunc(idx)) / mesh_dist
         return constrain(t, 0., 1.), idx
-    def _sample_direct(self, z_matrix):
-        self.mesh_matrix = z_matrix
-    def _sample_lagrange(self, z_matrix):
-        x_mult = self.x_mult
-        y_mult = self.y_mult
-        self.mesh_matrix = \
-            [[0. if ((i % x_mult) or (j % y_mult))
-             else z_matrix[j//y_mult][i//x_mult]
-             for i in range(self.mesh_x_count)]
-             for j in range(self.mesh_y_count)]
+    def _sample_lagrange_x(self, y):
+        # Interpolate X coordinates of a probed row
+        if self.x_lagrange_factors is None:
+            xpts, ypts = self._get_lagrange_coords()
+            self.x_lagrange_factors = [
+                self._get_lagrange_factors(xpts, self.get_x_coordinate(j))
+                for j in range(self.mesh_x_count)]
+        mesh_row = self.mesh_matrix[y]
+        for j in range(self.mesh_x_count):
+            if j % self.x_mult == 0:
+                continue
+            factors = self.x_lagrange_factors[j]
+            mesh_row[j] = self._calc_lagrange(factors, y, 0)
+    def _sample_lagrange_y(self, row_idx):
+        # Interpolate Y coordinates (requires all rows be probed)
+        if row_idx is not None:
+            return
         xpts, ypts = self._get_lagrange_coords()
-        # Interpolate X coordinates
-        for i in range(self.mesh_y_count):
-            # only interpolate X-rows that have probed coordinates
-            if i % y_mult != 0:
+        for j in range(self.mesh_y_count):
+            if j % self.y_mult == 0:
                 continue
-            for j in range(self.mesh_x_count):
-                if j % x_mult == 0:
-                    continue
-                x = self.get_x_coordinate(j)
-                self.mesh_matrix[i][j] = self._calc_lagrange(xpts, x, i, 0)
-        # Interpolate Y coordinates
-        for i in range(self.mesh_x_count):
-            for j in range(self.mesh_y_count):
-                if j % y_mult == 0:
-                    continue
-                y = self.get_y_coordinate(j)
-                self.mesh_matrix[j][i] = self._calc_lagrange(ypts, y, i, 1)
+            y = self.get_y_coordinate(j)
+            factors = self._get_lagrange_factors(ypts, y)
+            for i in range(self.mesh_x_count):
+                self.mesh_matrix[j][i] = self._calc_lagrange(factors, i, 1)
     def _get_lagrange_coords(self):
         xpts = []
         ypts = []
@@ -1505,9 +1620,9 @@ class ZMesh:
         for j in range(self.mesh_params['y_count']):
             ypts.append(self.get_y_coordinate(j * self.y_mult))
         return xpts, ypts
-    def _calc_lagrange(self, lpts, c, vec, axis=0):
+    def _get_lagrange_factors(self, lpts, c):
         pt_cnt = len(lpts)
-        total = 0.
+        factors = []
         for i in range(pt_cnt):
             n = 1.
             d = 1.
@@ -1516,6 +1631,11 @@ class ZMesh:
                     continue
                 n *= (c - lpts[j])
                 d *= (lpts[i] - lpts[j])
+            factors.append((n, d))
+        return factors
+    def _calc_lagrange(self, factors, vec, axis=0):
+        total = 0.
+        for i, (n, d) in enumerate(factors):
             if axis == 0:
                 # Calc X-Axis
                 z = self.mesh_matrix[vec][i*self.x_mult]
@@ -1524,32 +1644,30 @@ class ZMesh:
                 z = self.mesh_matrix[i*self.y_mult][vec]
             total += z * n / d
         return total
-    def _sample_bicubic(self, z_matrix):
-        # should work for any number of probe points above 3x3
-        x_mult = self.x_mult
-        y_mult = self.y_mult
+    def _sample_bicubic_x(self, y):
+        # Interpolate X values of a probed row
         c = self.mesh_params['tension']
-        self.mesh_matrix = \
-            [[0. if ((i % x_mult) or (j % y_mult))
-             else z_matrix[j//y_mult][i//x_mult]
-             for i in range(self.mesh_x_count)]
-             for j in range(self.mesh_y_count)]
-        # Interpolate X values
-        for y in range(self.mesh_y_count):
-            if y % y_mult != 0:
-                continue
-            for x in range(self.mesh_x_count):
-                if x % x_mult == 0:
-                    continue
-                pts = self._get_x_ctl_pts(x, y)
-                self.mesh_matrix[y][x] = self._cardinal_spline(pts, c)
-        # Interpolate Y values
         for x in range(self.mesh_x_count):
-            for y in range(self.mesh_y_count):
-                if y % y_mult == 0:
-                    continue
-                pts = self._get_y_ctl_pts(x, y)
-                self.mesh_matrix[y][x] = self._cardinal_spline(pts, c)
+            if x % self.x_mult == 0:
+                continue
+            pts = self._get_x_ctl_pts(x, y)
+            self.mesh_matrix[y][x] = self._cardinal_spline(pts, c)
+    def _sample_bicubic_y(self, row_idx):
+        # Interpolate Y values between probed rows once all of their
+        # control rows are available
+        c = self.mesh_params['tension']
+        seg_count = self.mesh_params['y_count'] - 1
+        last_seg = seg_count - 1
+        if row_idx is not None and row_idx < seg_count:
+            last_seg = row_idx - 2
+        y_mult = self.y_mult
+        while self.y_segments_done <= last_seg:
+            seg_start = self.y_segments_done * y_mult
+            for y in range(seg_start + 1, seg_start + y_mult):
+                for x in range(self.mesh_x_count):
+                    pts = self._get_y_ctl_pts(x, y)
+                    self.mesh_matrix[y][x] = self._cardinal_spline(pts, c)
+            self.y_segments_done += 1
     def _get_x_ctl_pts(self, x, y):
         # Fetch control points and t for a X value in the mesh
         x_mult = self.x_mult
@@ -1566,19 +1684,12 @@ class ZMesh:
             p2 = p3 = x_row[last_pt + x_mult]
             t = (x - last_pt) / float(x_mult)
         else:
-            found = False
-            for i in range(x_mult, last_pt, x_mult):
-                if x > i and x < (i + x_mult):
-                    p0 = x_row[i - x_mult]
-                    p1 = x_row[i]
-                    p2 = x_row[i + x_mult]
-                    p3 = x_row[i + 2*x_mult]
-                    t = (x - i) / float(x_mult)
-                    found = True
-                    break
-            if not found:
-                raise BedMeshError(
-                    "bed_mesh: Error finding x control points")
+            i = x - x % x_mult
+            p0 = x_row[i - x_mult]
+            p1 = x_row[i]
+            p2 = x_row[i + x_mult]
+            p3 = x_row[i + 2*x_mult]
+            t = (x - i) / float(x_mult)
         return p0, p1, p2, p3, t
     def _get_y_ctl_pts(self, x, y):
         # Fetch control points and t for a Y value in the mesh
@@ -1596,19 +1707,12 @@ class ZMesh:
             p2 = p3 = y_col[last_pt + y_mult][x]
             t = (y - last_pt) / float(y_mult)
         else:
-            found = False
-            for i in range(y_mult, last_pt, y_mult):
-                if y > i and y < (i + y_mult):
-                    p0 = y_col[i - y_mult][x]
-                    p1 = y_col[i][x]
-                    p2 = y_col[i + y_mult][x]
-                    p3 = y_col[i + 2*y_mult][x]
-                    t = (y - i) / float(y_mult)
-                    found = True
-                    break
-            if not found:
-                raise BedMeshError(
-                    "bed_mesh: Error finding y control points")
+            i = y - y % y_mult
+            p0 = y_col[i - y_mult][x]
+            p1 = y_col[i][x]
+            p2 = y_col[i + y_mult][x]
+            p3 = y_col[i + 2*y_mult][x]
+            t = (y - i) / float(y_mult)
         return p0, p1, p2, p3, t
     def _cardinal_spline(self, p, tension):
         t = p[4]
@@ -3,7 +3,7 @@
 # Copyright (C) 2020-2023  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import logging, threading, struct
+import logging, threading, struct, array
 
 # This "bulk sensor" module facilitates the processing of sensor chip
 # measurements that do not require the host to respond with low
@@ -131,6 +131,67 @@ class BulkDataQueue:
     def clear_queue(self):
         self.pull_queue()
 
+BULK_RING_MESSAGES = 4096
+
+# Helper class to store incoming fixed size messages in a preallocated
+# ring buffer.  The message payloads are copied directly into the
+# buffer, avoiding a Python object per message.  Messages returned by
+# pull_queue() remain valid until the next call to pull_queue() (or
+# clear_queue()).  If the ring fills, new messages are dropped and
+# counted in 'overflows'.
+class BulkDataRing:
+    def __init__(self, mcu, block_size, msg_name="sensor_bulk_data", oid=None,
+                 max_messages=BULK_RING_MESSAGES):
+        self.block_size = block_size
+        self.max_messages = max_messages
+        # Measurement storage (accessed from background thread)
+        self.lock = threading.Lock()
+        self.data = bytearray(max_messages * block_size)
+        self.sequences = array.array('H', [0]) * max_messages
+        self.lengths = array.array('H', [0]) * max_messages
+        self.head = self.tail = self.pulled = 0
+        self.overflows = 0
+        # Register callback with mcu
+        mcu.register_response(self._handle_data, msg_name, oid)
+    def _handle_data(self, params):
+        data = params['data']
+        dlen = min(len(data), self.block_size)
+        with self.lock:
+            head = self.head
+            if head - self.tail >= self.max_messages:
+                self.overflows += 1
+                return
+            slot = head % self.max_messages
+            pos = slot * self.block_size
+            self.data[pos:pos+dlen] = memoryview(data)[:dlen]
+            self.sequences[slot] = params['sequence']
+            self.lengths[slot] = dlen
+            self.head = head + 1
+    def pull_queue(self):
+        # Release previously pulled messages and return the new ones as
+        # a list of (data, sequences, lengths) contiguous segments
+        with self.lock:
+            self.tail = tail = self.pulled
+            self.pulled = head = self.head
+        segments = []
+        data_view = memoryview(self.data)
+        block_size = self.block_size
+        while tail < head:
+            slot = tail % self.max_messages
+            count = min(head - tail, self.max_messages - slot)
+            segments.append((data_view[slot*block_size
+                                       :(slot+count)*block_size],
+                             self.sequences[slot:slot+count],
+                             self.lengths[slot:slot+count]))
+            tail += count
+        return segments
+    def clear_queue(self):
+        with self.lock:
+            self.tail = self.pulled = self.head
+            self.overflows = 0
+    def get_overflows(self):
+        return self.overflows
+
 
 ######################################################################
 # Clock synchronization
@@ -210,6 +271,7 @@ class FixedFreqReader:
         self.unpack_from = unpack.unpack_from
         self.bytes_per_sample = unpack.size
         self.samples_per_block = MAX_BULK_MSG_SIZE // self.bytes_per_sample
+        self.block_size = self.samples_per_block * self.bytes_per_sample
         self.last_sequence = self.max_query_duration = 0
         self.last_overflows = 0
         self.bulk_queue = self.oid = self.query_status_cmd = None
@@ -220,10 +282,13 @@ class FixedFreqReader:
             msgformat, "sensor_bulk_status oid=%c clock=%u query_ticks=%u"
             " next_sequence=%hu buffered=%u possible_overflows=%hu",
             oid=oid, cq=cq)
-        # Read sensor_bulk_data messages and store in a queue
-        self.bulk_queue = BulkDataQueue(self.mcu, oid=oid)
+        # Read sensor_bulk_data messages and store in a ring buffer
+        self.bulk_queue = BulkDataRing(self.mcu, self.block_size, oid=oid)
     def get_last_overflows(self):
-        return self.last_overflows
+        # Report both mcu overflows and messages dropped by the host
+        if self.bulk_queue is None:
+            return self.last_overflows
+        return self.last_overflows + self.bulk_queue.get_overflows()
     def _clear_duration_filter(self):
         self.max_query_duration = 1 << 31
     def note_start(self):
@@ -236,7 +301,7 @@ class FixedFreqReader:
         self._update_clock(is_reset=True)
         self._clear_duration_filter()
     def note_end(self):
-        # Clear local queue (free no longer needed memory)
+        # Clear local queue (release no longer needed messages)
         self.bulk_queue.clear_queue()
     def _update_clock(self, is_reset=False):
         params = self.query_status_cmd.send([self.oid])
@@ -268,30 +333,35 @@ class FixedFreqReader:
     def pull_samples(self):
         # Query MCU for sample timing and update clock synchronization
         self._update_clock()
-        # Pull sensor_bulk_data messages from local queue
-        raw_samples = self.bulk_queue.pull_queue()
-        if not raw_samples:
+        # Pull sensor_bulk_data messages from local ring buffer
+        segments = self.bulk_queue.pull_queue()
+        if not segments:
             return []
+        return self._unpack_segments(segments)
+    def _unpack_segments(self, segments):
         # Load variables to optimize inner loop below
         last_sequence = self.last_sequence
         time_base, chip_base, inv_freq = self.clock_sync.get_time_translation()
         unpack_from = self.unpack_from
         bytes_per_sample = self.bytes_per_sample
         samples_per_block = self.samples_per_block
-        # Process every message in raw_samples
-        count = seq = 0
-        samples = [None] * (len(raw_samples) * samples_per_block)
-        for params in raw_samples:
-            seq_diff = (params['sequence'] - last_sequence) & 0xffff
-            seq_diff -= (seq_diff & 0x8000) << 1
-            seq = last_sequence + seq_diff
-            msg_cdiff = seq * samples_per_block - chip_base
-            data = params['data']
-            for i in range(len(data) // bytes_per_sample):
-                ptime = time_base + (msg_cdiff + i) * inv_freq
-                udata = unpack_from(data, i * bytes_per_sample)
-                samples[count] = (ptime,) + udata
-                count += 1
+        block_size = self.block_size
+        # Process every message in the ring buffer
+        count = seq = i = 0
+        msg_count = sum([len(sequences) for d, sequences, l in segments])
+        samples = [None] * (msg_count * samples_per_block)
+        for data, sequences, lengths in segments:
+            for j, sequence in enumerate(sequences):
+                seq_diff = (sequence - last_sequence) & 0xffff
+                seq_diff -= (seq_diff & 0x8000) << 1
+                seq = last_sequence + seq_diff
+                msg_cdiff = seq * samples_per_block - chip_base
+                pos = j * block_size
+                for i in range(lengths[j] // bytes_per_sample):
+                    ptime = time_base + (msg_cdiff + i) * inv_freq
+                    udata = unpack_from(data, pos + i * bytes_per_sample)
+                    samples[count] = (ptime,) + udata
+                    count += 1
         self.clock_sync.set_last_chip_clock(seq * samples_per_block + i)
         del samples[count:]
         return samples
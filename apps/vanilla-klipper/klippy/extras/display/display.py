@@ -5,20 +5,21 @@
 # Copyright (C) 2018  Eric Callahan <arksine.code@gmail.com>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import logging, os, ast
-from . import aip31068_spi, hd44780, hd44780_spi, st7920, uc1701, menu
+import logging, os, ast, importlib
 
 # Normal time between each screen redraw
 REDRAW_TIME = 0.500
 # Minimum time between screen redraws
 REDRAW_MIN_TIME = 0.100
 
+# Map of lcd_type to (module, class) - modules are imported on first use
 LCD_chips = {
-    'st7920': st7920.ST7920, 'emulated_st7920': st7920.EmulatedST7920,
-    'hd44780': hd44780.HD44780, 'uc1701': uc1701.UC1701,
-    'ssd1306': uc1701.SSD1306, 'sh1106': uc1701.SH1106,
-    'hd44780_spi': hd44780_spi.hd44780_spi,
-    'aip31068_spi':aip31068_spi.aip31068_spi
+    'st7920': ('st7920', 'ST7920'),
+    'emulated_st7920': ('st7920', 'EmulatedST7920'),
+    'hd44780': ('hd44780', 'HD44780'), 'uc1701': ('uc1701', 'UC1701'),
+    'ssd1306': ('uc1701', 'SSD1306'), 'sh1106': ('uc1701', 'SH1106'),
+    'hd44780_spi': ('hd44780_spi', 'hd44780_spi'),
+    'aip31068_spi': ('aip31068_spi', 'aip31068_spi'),
 }
 
 # Storage of [display_template my_template] config sections
@@ -178,12 +179,15 @@ class PrinterLCD:
         self.printer = config.get_printer()
         self.reactor = self.printer.get_reactor()
         # Load low-level lcd handler
-        self.lcd_chip = config.getchoice('lcd_type', LCD_chips)(config)
+        module_name, class_name = config.getchoice('lcd_type', LCD_chips)
+        lcd_module = importlib.import_module('.' + module_name, __package__)
+        self.lcd_chip = getattr(lcd_module, class_name)(config)
         # Load menu and display_status
         self.menu = None
         name = config.get_name()
         if name == 'display':
             # only load menu for primary display
+            menu = importlib.import_module('.menu', __package__)
             self.menu = menu.MenuManager(config, self)
         self.printer.load_object(config, "display_status")
         # Configurable display
@@ -9,23 +9,118 @@ import logging
 class GarbageCollection:
     def __init__(self, config):
         self.printer = config.get_printer()
+        self.reactor = self.printer.get_reactor()
+        self.max_deferral = config.getfloat('max_deferral', 5., minval=0.)
+        self.refreeze_threshold = config.getint('refreeze_threshold', 20000,
+                                                minval=0)
+        # Collection scheduling state
+        self.pause_estimates = [0., 0., 0.]
+        self.defer_start = None
+        self.refreeze_pending = False
+        # Statistics
+        self.counts = [0, 0, 0]
+        self.total_pauses = [0., 0., 0.]
+        self.max_pauses = [0., 0., 0.]
+        self.period_max_pauses = [0., 0., 0.]
+        self.deferred = self.refreezes = 0
         # feature check ... freeze/unfreeze is only available in python 3.7+
-        can_freeze = hasattr(gc, 'freeze') and hasattr(gc, 'unfreeze')
-        if can_freeze:
+        self.can_freeze = hasattr(gc, 'freeze') and hasattr(gc, 'unfreeze')
+        if self.can_freeze:
             self.printer.register_event_handler("klippy:ready",
                                                 self._handle_ready)
             self.printer.register_event_handler("klippy:disconnect",
                                                 self._handle_disconnect)
+        webhooks = self.printer.lookup_object('webhooks')
+        webhooks.register_endpoint("garbage_collection/stats",
+                                   self._handle_stats_request)
 
     def _handle_ready(self):
         logging.debug("Running full garbage collection and freezing")
         for n in range(3):
             gc.collect(n)
         gc.freeze()
+        self.reactor.set_gc_handler(self._idle_collect)
 
     def _handle_disconnect(self):
         logging.debug("Unfreezing garbage collection")
+        self.reactor.set_gc_handler(None)
         gc.unfreeze()
 
+    def request_refreeze(self):
+        # Freeze the objects that survive the next full collection
+        self.refreeze_pending = True
+
+    def _idle_collect(self, eventtime, deadline, gc_level):
+        # Called by the reactor when it is idle and a collection is due.
+        # Only run generations expected to complete before the next timer.
+        want_level = gc_level
+        if self.refreeze_pending:
+            want_level = 2
+        level = want_level
+        idle_time = deadline - eventtime
+        if (self.defer_start is None
+            or eventtime - self.defer_start < self.max_deferral):
+            while level >= 0 and self.pause_estimates[level] > idle_time:
+                level -= 1
+        if level < want_level:
+            if self.defer_start is None:
+                self.defer_start = eventtime
+                self.deferred += 1
+        else:
+            self.defer_start = None
+        if level < 0:
+            return None
+        start_time = self.reactor.monotonic()
+        gc.collect(level)
+        if level == 2:
+            self._check_refreeze()
+        pause = self.reactor.monotonic() - start_time
+        self._note_pause(level, pause)
+        return level
+
+    def _check_refreeze(self):
+        if not self.refreeze_pending:
+            # Called right after a full collection, so the younger
+            # generations are empty and every unfrozen tracked object is
+            # in generation 2.  (get_objects() has no generation argument
+            # before python 3.8.)
+            if len(gc.get_objects()) < self.refreeze_threshold:
+                return
+        # Many long lived objects were created since the last freeze
+        self.refreeze_pending = False
+        self.refreezes += 1
+        gc.freeze()
+
+    def _note_pause(self, level, pause):
+        self.pause_estimates[level] = max(pause,
+                                          .9 * self.pause_estimates[level])
+        self.counts[level] += 1
+        self.total_pauses[level] += pause
+        self.max_pauses[level] = max(self.max_pauses[level], pause)
+        self.period_max_pauses[level] = max(self.period_max_pauses[level],
+                                            pause)
+
+    def get_stats(self):
+        return {
+            'generations': [
+                {'count': self.counts[i], 'total_pause': self.total_pauses[i],
+                 'max_pause': self.max_pauses[i],
+                 'pause_estimate': self.pause_estimates[i]}
+                for i in range(3)],
+            'deferred': self.deferred, 'refreezes': self.refreezes,
+            'frozen': gc.get_freeze_count() if self.can_freeze else 0}
+
+    def _handle_stats_request(self, web_request):
+        web_request.send(self.get_stats())
+
+    def stats(self, eventtime):
+        msg = "gc: %s deferred=%d refreezes=%d" % (
+            " ".join(["gen%d=%d/%.1fms" % (i, self.counts[i],
+                                          self.period_max_pauses[i] * 1000.)
+                      for i in range(3)]),
+            self.deferred, self.refreezes)
+        self.period_max_pauses = [0., 0., 0.]
+        return (False, msg)
+
 def load_config(config):
     return GarbageCollection(config)
@@ -238,6 +238,8 @@ class PrinterHeaters:
     def __init__(self, config):
         self.printer = config.get_printer()
         self.sensor_factories = {}
+        self.sensor_modules = []
+        self.sensor_config = None
         self.heaters = {}
         self.gcode_id_to_sensor = {}
         self.available_heaters = []
@@ -265,8 +267,27 @@ class PrinterHeaters:
         except Exception:
             logging.exception("Unable to load temperature_sensors.cfg")
             raise config.error("Cannot load config '%s'" % (filename,))
+        self.sensor_config = dconfig
         for c in dconfig.get_prefix_sections(''):
-            self.printer.load_object(dconfig, c.get_name())
+            section = c.get_name()
+            if ' ' in section:
+                self.printer.load_object(dconfig, section)
+            else:
+                # Defer loading the module until one of its sensors is used
+                self.sensor_modules.append(section)
+    def _load_sensor_module(self, sensor_type):
+        # Modules register their sensor types when loaded.  Most are
+        # named after their sensor type, so try that module first and
+        # then the others until the type is registered.
+        modules = list(self.sensor_modules)
+        if sensor_type.lower() in modules:
+            modules.remove(sensor_type.lower())
+            modules.insert(0, sensor_type.lower())
+        for module_name in modules:
+            self.sensor_modules.remove(module_name)
+            self.printer.load_object(self.sensor_config, module_name)
+            if sensor_type in self.sensor_factories:
+                return
     def add_sensor_factory(self, sensor_type, sensor_factory):
         self.sensor_factories[sensor_type] = sensor_factory
     def setup_heater(self, config, gcode_id=None):
@@ -291,6 +312,8 @@ class PrinterHeaters:
         if not self.have_load_sensors:
             self.load_config(config)
         sensor_type = config.get('sensor_type')
+        if sensor_type not in self.sensor_factories:
+            self._load_sensor_module(sensor_type)
         if sensor_type not in self.sensor_factories:
             raise self.printer.config_error(
                 "Unknown temperature sensor '%s'" % (sensor_type,))
@@ -3,7 +3,7 @@
 # Copyright (C) 2017-2024  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import logging
+import logging, math, time
 import pins
 from . import manual_probe
 
@@ -378,6 +378,58 @@ class ProbeOffsetsHelper:
 
 # Helper code that can probe a series of points and report the
 # position at each point.
+ROUTE_TIME_BUDGET = .050
+
+def _calc_route_length(points, route, start):
+    length = 0.
+    x, y = start[:2]
+    for i in route:
+        nx, ny = points[i][:2]
+        length += math.hypot(nx - x, ny - y)
+        x, y = nx, ny
+    return length
+
+# Find a short probing order (nearest neighbour tour improved by 2-opt)
+def optimize_probe_route(points, start, time_budget=ROUTE_TIME_BUDGET):
+    end_time = time.perf_counter() + time_budget
+    # Build a nearest neighbour route
+    remaining = list(range(len(points)))
+    route = []
+    x, y = start[:2]
+    while remaining:
+        if time.perf_counter() > end_time:
+            return None
+        best = min(remaining, key=(lambda i: (points[i][0] - x)**2
+                                   + (points[i][1] - y)**2))
+        remaining.remove(best)
+        route.append(best)
+        x, y = points[best][:2]
+    # Improve the route with 2-opt segment reversals until time runs out
+    pts = [tuple(start[:2])] + [tuple(points[i][:2]) for i in route]
+    dist = lambda a, b: math.hypot(a[0] - b[0], a[1] - b[1])
+    count = len(pts)
+    improved = True
+    while improved and time.perf_counter() < end_time:
+        improved = False
+        for i in range(1, count - 1):
+            if time.perf_counter() > end_time:
+                break
+            a, b = pts[i-1], pts[i]
+            dist_ab = dist(a, b)
+            for j in range(i + 1, count):
+                c = pts[j]
+                delta = dist(a, c) - dist_ab
+                if j + 1 < count:
+                    d = pts[j+1]
+                    delta += dist(b, d) - dist(c, d)
+                if delta < -.000001:
+                    pts[i:j+1] = pts[i:j+1][::-1]
+                    route[i-1:j] = route[i-1:j][::-1]
+                    b = pts[i]
+                    dist_ab = dist(a, b)
+                    improved = True
+    return route
+
 class ProbePointsHelper:
     def __init__(self, config, finalize_callback, default_points=None):
         self.printer = config.get_printer()
@@ -392,11 +444,13 @@ class ProbePointsHelper:
         def_move_z = config.getfloat('horizontal_move_z', 5.)
         self.default_horizontal_move_z = def_move_z
         self.speed = config.getfloat('speed', 50., above=0.)
+        self.optimize_route = config.getboolean('optimize_route', False)
         self.use_offsets = False
         # Internal probing state
         self.lift_speed = self.speed
         self.probe_offsets = (0., 0., 0.)
         self.manual_results = []
+        self.point_callback = None
     def minimum_points(self,n):
         if len(self.probe_points) < n:
             raise self.printer.config_error(
@@ -406,6 +460,9 @@ class ProbePointsHelper:
         self.minimum_points(min_points)
     def use_xy_offsets(self, use_offsets):
         self.use_offsets = use_offsets
+    def set_point_callback(self, point_callback):
+        # Optionally report each result as soon as it has been probed
+        self.point_callback = point_callback
     def get_lift_speed(self):
         return self.lift_speed
     def _move(self, coord, speed):
@@ -423,6 +480,32 @@ class ProbePointsHelper:
         # Invoke callback
         res = self.finalize_callback(self.probe_offsets, results)
         return res != "retry"
+    def _get_probe_order(self, gcmd):
+        fixed_order = list(range(len(self.probe_points)))
+        optimize = gcmd.get_int('OPTIMIZE_ROUTE', int(self.optimize_route),
+                                minval=0, maxval=1)
+        if not optimize or len(fixed_order) < 3:
+            return fixed_order
+        # Probe points are relative to the probe, not the toolhead
+        toolhead = self.printer.lookup_object('toolhead')
+        start = toolhead.get_position()[:2]
+        if self.use_offsets:
+            start = [start[0] + self.probe_offsets[0],
+                     start[1] + self.probe_offsets[1]]
+        route = optimize_probe_route(self.probe_points, start)
+        if route is None:
+            logging.info("%s: probe route optimization exceeded time budget",
+                         self.name)
+            return fixed_order
+        fixed_len = _calc_route_length(self.probe_points, fixed_order, start)
+        route_len = _calc_route_length(self.probe_points, route, start)
+        if route_len >= fixed_len:
+            return fixed_order
+        gcmd.respond_info(
+            "Optimized probe route: travel %.1fmm -> %.1fmm"
+            " (estimated %.1fs saved)" % (fixed_len, route_len,
+                                         (fixed_len - route_len) / self.speed))
+        return route
     def _move_next(self, probe_num):
         # Move to next XY probe point
         nextpos = list(self.probe_points[probe_num])
@@ -451,20 +534,35 @@ class ProbePointsHelper:
         if self.horizontal_move_z < self.probe_offsets[2]:
             raise gcmd.error("horizontal_move_z can't be less than"
                              " probe's z_offset")
+        order = self._get_probe_order(gcmd)
         probe_session = probe.start_probe_session(gcmd)
-        probe_num = 0
+        # Regular probe sessions have each result available immediately
+        report_points = (self.point_callback is not None
+                         and isinstance(probe_session, ProbeSessionHelper))
+        probe_num = reported = 0
+        results = {}
         while 1:
             self._raise_tool(not probe_num)
             if probe_num >= len(self.probe_points):
-                results = probe_session.pull_probed_results()
-                done = self._invoke_callback(results)
+                for pos in probe_session.pull_probed_results():
+                    results[order[len(results)]] = pos
+                done = self._invoke_callback([results[i] for i in
+                                              range(len(results))])
                 if done:
                     break
                 # Caller wants a "retry" - restart probing
-                probe_num = 0
-            self._move_next(probe_num)
+                probe_num = reported = 0
+                results = {}
+            self._move_next(order[probe_num])
             probe_session.run_probe(gcmd)
             probe_num += 1
+            if report_points:
+                for pos in probe_session.pull_probed_results():
+                    results[order[len(results)]] = pos
+                # Report results in point order
+                while reported in results:
+                    self.point_callback(self.probe_offsets, results[reported])
+                    reported += 1
         probe_session.end_probe_session()
     def _manual_probe_start(self):
         self._raise_tool(not self.manual_results)
@@ -482,6 +580,8 @@ class ProbePointsHelper:
         if kin_pos is None:
             return
         self.manual_results.append(kin_pos)
+        if self.point_callback is not None:
+            self.point_callback(self.probe_offsets, kin_pos)
         self._manual_probe_start()
 
 # Helper to obtain a single probe measurement
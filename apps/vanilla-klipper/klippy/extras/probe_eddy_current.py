@@ -18,6 +18,8 @@ class EddyCalibration:
         # Current calibration data
         self.cal_freqs = []
         self.cal_zpos = []
+        self.cal_gains = []
+        self.cal_offsets = []
         cal = config.get('calibrate', None)
         if cal is not None:
             cal = [list(map(float, d.strip().split(':', 1)))
@@ -37,29 +39,49 @@ class EddyCalibration:
         cal = sorted([(c[1], c[0]) for c in cal])
         self.cal_freqs = [c[0] for c in cal]
         self.cal_zpos = [c[1] for c in cal]
-    def apply_calibration(self, samples):
-        cur_temp = self.drift_comp.get_temperature()
-        for i, (samp_time, freq, dummy_z) in enumerate(samples):
-            adj_freq = self.drift_comp.adjust_freq(freq, cur_temp)
-            pos = bisect.bisect(self.cal_freqs, adj_freq)
-            if pos >= len(self.cal_zpos):
+        # Precompute the linear interpolation of each calibration segment
+        self.cal_gains = [0.] * len(cal)
+        self.cal_offsets = [0.] * len(cal)
+        for pos in range(1, len(cal)):
+            prev_freq, prev_zpos = cal[pos - 1]
+            this_freq, this_zpos = cal[pos]
+            if this_freq == prev_freq:
+                # Segment can not be selected by bisect() below
+                continue
+            gain = (this_zpos - prev_zpos) / (this_freq - prev_freq)
+            self.cal_gains[pos] = gain
+            self.cal_offsets[pos] = prev_zpos - prev_freq * gain
+    def _calc_heights(self, adj_freqs):
+        # Convert a list of drift adjusted frequencies to heights
+        cal_freqs = self.cal_freqs
+        gains = self.cal_gains
+        offsets = self.cal_offsets
+        cal_count = len(cal_freqs)
+        heights = []
+        for adj_freq in adj_freqs:
+            pos = bisect.bisect(cal_freqs, adj_freq)
+            if pos >= cal_count:
                 zpos = -OUT_OF_RANGE
             elif pos == 0:
                 zpos = OUT_OF_RANGE
             else:
-                # XXX - could further optimize and avoid div by zero
-                this_freq = self.cal_freqs[pos]
-                prev_freq = self.cal_freqs[pos - 1]
-                this_zpos = self.cal_zpos[pos]
-                prev_zpos = self.cal_zpos[pos - 1]
-                gain = (this_zpos - prev_zpos) / (this_freq - prev_freq)
-                offset = prev_zpos - prev_freq * gain
-                zpos = adj_freq * gain + offset
-            samples[i] = (samp_time, freq, round(zpos, 6))
+                zpos = adj_freq * gains[pos] + offsets[pos]
+            heights.append(round(zpos, 6))
+        return heights
+    def apply_calibration(self, samples):
+        cur_temp = self.drift_comp.get_temperature()
+        adjust_freq = self.drift_comp.adjust_freq
+        heights = self._calc_heights([adjust_freq(freq, cur_temp)
+                                      for samp_time, freq, z in samples])
+        for i, (samp_time, freq, dummy_z) in enumerate(samples):
+            samples[i] = (samp_time, freq, heights[i])
+    def freqs_to_heights(self, freqs):
+        cur_temp = self.drift_comp.get_temperature()
+        adjust_freq = self.drift_comp.adjust_freq
+        return self._calc_heights([adjust_freq(freq, cur_temp)
+                                   for freq in freqs])
     def freq_to_height(self, freq):
-        dummy_sample = [(0., freq, 0.)]
-        self.apply_calibration(dummy_sample)
-        return dummy_sample[0][2]
+        return self.freqs_to_heights([freq])[0]
     def height_to_freq(self, height):
         # XXX - could optimize lookup
         rev_zpos = list(reversed(self.cal_zpos))
@@ -235,49 +257,74 @@ class EddyGatherSamples:
                 raise self._printer.command_error(
                     "probe_eddy_current sensor outage")
             reactor.pause(systime + 0.010)
-    def _pull_freq(self, start_time, end_time):
-        # Find average sensor frequency between time range
-        msg_num = discard_msgs = 0
-        samp_sum = 0.
-        samp_count = 0
-        while msg_num < len(self._samples):
-            msg = self._samples[msg_num]
-            msg_num += 1
-            data = msg['data']
-            if data[0][0] > end_time:
-                break
-            if data[-1][0] < start_time:
-                discard_msgs = msg_num
+    def _pull_freqs(self, windows):
+        # Find average sensor frequency within each (start, end) time range
+        times = []
+        freqs = []
+        for msg in self._samples:
+            msg_times, msg_freqs, msg_z = zip(*msg['data'])
+            times.extend(msg_times)
+            freqs.extend(msg_freqs)
+        results = []
+        for start_time, end_time in windows:
+            start_pos = bisect.bisect_left(times, start_time)
+            end_pos = bisect.bisect_right(times, end_time, start_pos)
+            if start_pos >= end_pos:
+                # No sensor readings - raise error in pull_probed()
+                results.append(0.)
                 continue
-            for time, freq, z in data:
-                if time >= start_time and time <= end_time:
-                    samp_sum += freq
-                    samp_count += 1
+            results.append(sum(freqs[start_pos:end_pos])
+                           / (end_pos - start_pos))
+        # Discard messages that are no longer needed
+        start_time = windows[-1][0]
+        discard_msgs = 0
+        for msg in self._samples:
+            if msg['data'][-1][0] >= start_time:
+                break
+            discard_msgs += 1
         del self._samples[:discard_msgs]
-        if not samp_count:
-            # No sensor readings - raise error in pull_probed()
-            return 0.
-        return samp_sum / samp_count
-    def _lookup_toolhead_pos(self, pos_time):
+        return results
+    def _lookup_toolhead_positions(self, pos_times):
+        if not pos_times:
+            return []
         toolhead = self._printer.lookup_object('toolhead')
         kin = toolhead.get_kinematics()
-        kin_spos = {s.get_name(): s.mcu_to_commanded_position(
-                                      s.get_past_mcu_position(pos_time))
-                    for s in kin.get_steppers()}
-        return kin.calc_position(kin_spos)
+        steppers = kin.get_steppers()
+        positions = []
+        for pos_time in pos_times:
+            kin_spos = {s.get_name(): s.mcu_to_commanded_position(
+                                          s.get_past_mcu_position(pos_time))
+                        for s in steppers}
+            positions.append(kin.calc_position(kin_spos))
+        return positions
     def _check_samples(self):
-        while self._samples and self._probe_times:
-            start_time, end_time, pos_time, toolhead_pos = self._probe_times[0]
-            if self._samples[-1]['data'][-1][0] < end_time:
+        if not self._samples or not self._probe_times:
+            return
+        # Find the probe times that have all their samples available
+        last_sample_time = self._samples[-1]['data'][-1][0]
+        ready = 0
+        for start_time, end_time, pos_time, toolhead_pos in self._probe_times:
+            if last_sample_time < end_time:
                 break
-            freq = self._pull_freq(start_time, end_time)
+            ready += 1
+        if not ready:
+            return
+        probe_times = self._probe_times[:ready]
+        del self._probe_times[:ready]
+        # Process all ready probe times as a single batch
+        freqs = self._pull_freqs([(pt[0], pt[1]) for pt in probe_times])
+        heights = self._calibration.freqs_to_heights(freqs)
+        pos_times = [pt[2] for pt in probe_times if pt[2] is not None]
+        positions = self._lookup_toolhead_positions(pos_times)
+        positions.reverse()
+        for i, (start_time, end_time, pos_time, toolhead_pos) in enumerate(
+                probe_times):
             if pos_time is not None:
-                toolhead_pos = self._lookup_toolhead_pos(pos_time)
+                toolhead_pos = positions.pop()
             sensor_z = None
-            if freq:
-                sensor_z = self._calibration.freq_to_height(freq)
+            if freqs[i]:
+                sensor_z = heights[i]
             self._probe_results.append((sensor_z, toolhead_pos))
-            self._probe_times.pop(0)
     def pull_probed(self):
         self._await_samples()
         results = []
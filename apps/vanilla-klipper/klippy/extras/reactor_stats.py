@@ -0,0 +1,29 @@
+# Reactor callback timing statistics
+#
+# Copyright (C) 2026  Rinkhals contributors
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+
+class ReactorStats:
+    def __init__(self, config):
+        self.printer = config.get_printer()
+        slow_time = config.getfloat('slow_callback_time', 0.100, minval=0.)
+        reactor = self.printer.get_reactor()
+        self.cb_stats = reactor.enable_callback_stats(slow_time)
+        webhooks = self.printer.lookup_object('webhooks')
+        webhooks.register_endpoint("reactor/stats", self._handle_stats)
+    def _handle_stats(self, web_request):
+        reset = web_request.get('reset', False, types=(bool,))
+        web_request.send(self.cb_stats.get_stats())
+        if reset:
+            self.cb_stats.reset()
+    def stats(self, eventtime):
+        count, busy, max_time, max_name = self.cb_stats.get_period_stats()
+        msg = "reactor: callbacks=%d busy=%.3f max=%.3f" % (
+            count, busy, max_time)
+        if max_name is not None:
+            msg += " (%s)" % (max_name,)
+        return (False, msg)
+
+def load_config(config):
+    return ReactorStats(config)
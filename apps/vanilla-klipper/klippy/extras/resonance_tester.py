@@ -3,8 +3,7 @@
 # Copyright (C) 2020-2024  Dmitry Butyugin <dmbutyugin@google.com>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import logging, math, os, time
-from . import shaper_calibrate
+import logging, math, os, time, importlib
 
 class TestAxis:
     def __init__(self, axis=None, vib_dir=None):
@@ -248,16 +247,25 @@ class ResonanceTester:
                 if len(axes) > 1:
                     gcmd.respond_info("Testing axis %s" % axis.get_name())
 
-                raw_values = []
                 if accel_chips is None:
-                    for chip_axis, chip in self.accel_chips:
-                        if axis.matches(chip_axis):
-                            aclient = chip.start_internal_client()
-                            raw_values.append((chip_axis, aclient, chip.name))
+                    chips = [(chip_axis, chip)
+                             for chip_axis, chip in self.accel_chips
+                             if axis.matches(chip_axis)]
                 else:
-                    for chip in accel_chips:
-                        aclient = chip.start_internal_client()
-                        raw_values.append((axis, aclient, chip.name))
+                    chips = [(axis, chip) for chip in accel_chips]
+                raw_values = []
+                psd_accumulators = {}
+                for chip_axis, chip in chips:
+                    aclient = chip.start_internal_client()
+                    if helper is not None:
+                        # Calculate the frequency response while the test
+                        # runs; raw samples are only kept when requested
+                        psd = helper.create_psd_accumulator()
+                        aclient.set_samples_callback(
+                                psd.add_samples,
+                                keep_msgs=raw_name_suffix is not None)
+                        psd_accumulators[aclient] = psd
+                    raw_values.append((chip_axis, aclient, chip.name))
 
                 # Generate moves
                 test_seq = self.generator.gen_test()
@@ -280,7 +288,11 @@ class ResonanceTester:
                         raise gcmd.error(
                             "accelerometer '%s' measured no data" % (
                                 chip_name,))
-                    new_data = helper.process_accelerometer_data(aclient)
+                    new_data = psd_accumulators[aclient].get_calibration_data()
+                    if new_data is None:
+                        raise gcmd.error(
+                            "not enough accelerometer samples for '%s' "
+                            "(test too short)" % (chip_name,))
                     if calibration_data[axis] is None:
                         calibration_data[axis] = new_data
                     else:
@@ -292,6 +304,11 @@ class ResonanceTester:
             chip = self.printer.lookup_object(chip_name.strip())
             parsed_chips.append(chip)
         return parsed_chips
+    def _create_shaper_calibrate(self):
+        # Only load the (slow to import) calibration code when needed
+        shaper_calibrate = importlib.import_module('.shaper_calibrate',
+                                                   __package__)
+        return shaper_calibrate.ShaperCalibrate(self.printer)
     def _get_max_calibration_freq(self):
         return 1.5 * self.generator.get_max_freq()
     cmd_TEST_RESONANCES_help = ("Runs the resonance test for a specifed axis")
@@ -329,7 +346,7 @@ class ResonanceTester:
 
         # Setup calculation of resonances
         if csv_output:
-            helper = shaper_calibrate.ShaperCalibrate(self.printer)
+            helper = self._create_shaper_calibrate()
         else:
             helper = None
 
@@ -367,7 +384,7 @@ class ResonanceTester:
         input_shaper = self.printer.lookup_object('input_shaper', None)
 
         # Setup shaper calibration
-        helper = shaper_calibrate.ShaperCalibrate(self.printer)
+        helper = self._create_shaper_calibrate()
 
         calibration_data = self._run_test(gcmd, calibrate_axes, helper,
                                           accel_chips=accel_chips)
@@ -413,7 +430,7 @@ class ResonanceTester:
         self.printer.lookup_object('toolhead').dwell(meas_time)
         for chip_axis, aclient in raw_values:
             aclient.finish_measurements()
-        helper = shaper_calibrate.ShaperCalibrate(self.printer)
+        helper = self._create_shaper_calibrate()
         for chip_axis, aclient in raw_values:
             if not aclient.has_valid_samples():
                 raise gcmd.error(
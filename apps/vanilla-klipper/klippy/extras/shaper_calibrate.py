@@ -55,6 +55,85 @@ class CalibrationData:
         return self._psd_map[axis]
 
 
+# Welch's PSD calculation that consumes accelerometer samples as they
+# arrive, so that long measurements do not need to be stored
+class PSDAccumulator:
+    def __init__(self, calibrate):
+        self.calibrate = calibrate
+        self.numpy = calibrate.numpy
+        self.pending = []
+        self.pending_count = 0
+        self.window = None
+        self.psd_sum = None
+        self.windows = 0
+        self.sample_count = 0
+        self.first_time = self.last_time = None
+    def _setup_window(self):
+        np = self.numpy
+        sampling_freq = self.sample_count / (self.last_time - self.first_time)
+        # Round up to the nearest power of 2 for faster FFT
+        nfft = 1 << int(sampling_freq * WINDOW_T_SEC - 1).bit_length()
+        self.window = np.kaiser(nfft, 6.)
+        self.psd_sum = np.zeros((3, nfft // 2 + 1))
+    def _process_windows(self):
+        # Add the response of all complete windows to the running sum
+        np = self.numpy
+        nfft = self.window.shape[0]
+        overlap = nfft // 2
+        step = nfft - overlap
+        n_windows = (self.pending_count - overlap) // step
+        if n_windows <= 0:
+            return
+        data = np.concatenate(self.pending, axis=1)
+        for i in range(3):
+            x = self.calibrate._split_into_windows(data[i], nfft, overlap)
+            x = self.window[:, None] * (x - np.mean(x, axis=0))
+            result = np.fft.rfft(x, n=nfft, axis=0)
+            self.psd_sum[i] += (np.conjugate(result) * result).real.sum(
+                    axis=-1)
+        self.windows += n_windows
+        # Keep the samples needed by the following windows
+        rest = data[:, n_windows * step:]
+        self.pending = [rest]
+        self.pending_count = rest.shape[1]
+    def add_samples(self, samples):
+        if not samples:
+            return
+        data = self.numpy.array(samples, dtype=float)
+        if self.first_time is None:
+            self.first_time = data[0, 0]
+        self.last_time = data[-1, 0]
+        self.sample_count += data.shape[0]
+        self.pending.append(data[:, 1:4].T)
+        self.pending_count += data.shape[0]
+        if self.window is None:
+            # Estimate the sampling rate before choosing the window size
+            if self.last_time - self.first_time < 2. * WINDOW_T_SEC:
+                return
+            self._setup_window()
+        self._process_windows()
+    def get_calibration_data(self):
+        # Returns None if the samples did not fill a complete window
+        np = self.numpy
+        if self.sample_count < 2 or self.last_time <= self.first_time:
+            return None
+        if self.window is None:
+            self._setup_window()
+        self._process_windows()
+        if not self.windows:
+            return None
+        sampling_freq = self.sample_count / (self.last_time - self.first_time)
+        # Compensation for windowing loss, averaged over all windows
+        scale = 1. / ((self.window**2).sum() * sampling_freq * self.windows)
+        psd = self.psd_sum * scale
+        # Double the one-sided response, except for 'DC' and Nyquist terms
+        psd[:,1:-1] *= 2.
+        px, py, pz = psd
+        freqs = np.fft.rfftfreq(self.window.shape[0], 1. / sampling_freq)
+        calibration_data = CalibrationData(freqs, px+py+pz, px, py, pz)
+        calibration_data.set_numpy(np)
+        return calibration_data
+
 CalibrationResult = collections.namedtuple(
         'CalibrationResult',
         ('name', 'freq', 'vals', 'vibrs', 'smoothing', 'score', 'max_accel'))
@@ -174,6 +253,9 @@ class ShaperCalibrate:
         fz, pz = self._psd(data[:,3], SAMPLING_FREQ, M)
         return CalibrationData(fx, px+py+pz, px, py, pz)
 
+    def create_psd_accumulator(self):
+        return PSDAccumulator(self)
+
     def process_accelerometer_data(self, data):
         calibration_data = self.background_process_exec(
                 self.calc_freq_response, (data,))
@@ -85,6 +85,76 @@ class FieldHelper:
 # Periodic error checking
 ######################################################################
 
+TMC_POLL_INTERVAL = 1.
+TMC_POLL_STAGGER = .250
+
+# Periodic checks of all drivers sharing a bus (as identified by the
+# bus mutex) are run back-to-back from a single timer
+class TMCPollGroup:
+    def __init__(self, printer, phase):
+        self.printer = printer
+        self.reactor = printer.get_reactor()
+        self.phase = phase
+        self.echecks = []
+        self.poll_timer = None
+        self.last_latency = self.max_latency = 0.
+    def add_check(self, echeck):
+        if echeck in self.echecks:
+            return
+        self.echecks.append(echeck)
+        if self.poll_timer is None:
+            waketime = self.reactor.monotonic() + TMC_POLL_INTERVAL + self.phase
+            self.poll_timer = self.reactor.register_timer(self._do_poll,
+                                                          waketime)
+    def remove_check(self, echeck):
+        if echeck in self.echecks:
+            self.echecks.remove(echeck)
+        if not self.echecks and self.poll_timer is not None:
+            self.reactor.unregister_timer(self.poll_timer)
+            self.poll_timer = None
+    def _do_poll(self, eventtime):
+        starttime = self.reactor.monotonic()
+        for echeck in list(self.echecks):
+            if echeck not in self.echecks:
+                # Check stopped while bus was busy
+                continue
+            if not echeck.do_periodic_check():
+                return self.reactor.NEVER
+        self.last_latency = self.reactor.monotonic() - starttime
+        self.max_latency = max(self.max_latency, self.last_latency)
+        return eventtime + TMC_POLL_INTERVAL
+    def get_status(self, eventtime=None):
+        return {'drivers': len(self.echecks),
+                'last_latency': round(self.last_latency, 6),
+                'max_latency': round(self.max_latency, 6)}
+
+# Track the poll groups of all buses and stagger their start times
+class PrinterTMCPollScheduler:
+    def __init__(self, printer):
+        self.printer = printer
+        self.bus_to_group = {}
+    def lookup_group(self, bus_key):
+        group = self.bus_to_group.get(bus_key)
+        if group is None:
+            phase = ((len(self.bus_to_group) * TMC_POLL_STAGGER)
+                     % TMC_POLL_INTERVAL)
+            group = TMCPollGroup(self.printer, phase)
+            self.bus_to_group[bus_key] = group
+        return group
+    def get_status(self, eventtime=None):
+        groups = [g.get_status(eventtime) for g in self.bus_to_group.values()]
+        return {'bus_count': len(groups),
+                'max_latency': max([g['max_latency'] for g in groups] + [0.]),
+                'groups': groups}
+
+def lookup_tmc_poll_group(config, mcu_tmc):
+    printer = config.get_printer()
+    scheduler = printer.lookup_object('tmc_poll', None)
+    if scheduler is None:
+        scheduler = PrinterTMCPollScheduler(printer)
+        printer.add_object('tmc_poll', scheduler)
+    return scheduler.lookup_group(mcu_tmc.mutex)
+
 class TMCErrorCheck:
     def __init__(self, config, mcu_tmc):
         self.printer = config.get_printer()
@@ -92,7 +162,10 @@ class TMCErrorCheck:
         self.stepper_name = ' '.join(name_parts[1:])
         self.mcu_tmc = mcu_tmc
         self.fields = mcu_tmc.get_fields()
-        self.check_timer = None
+        self.poll_group = lookup_tmc_poll_group(config, mcu_tmc)
+        self.check_active = False
+        self.poll_latency = 0.
+        self.poll_errors = 0
         self.last_drv_status = self.last_drv_fields = None
         # Setup for GSTAT query
         reg_name = self.fields.lookup_register("drv_err")
@@ -137,6 +210,7 @@ class TMCErrorCheck:
                 val = self.mcu_tmc.get_register(reg_name)
             except self.printer.command_error as e:
                 count += 1
+                self.poll_errors += 1
                 if count < 3 and str(e).startswith("Unable to read tmc uart"):
                     # Allow more retries on a TMC UART read error
                     reactor = self.printer.get_reactor()
@@ -151,7 +225,7 @@ class TMCErrorCheck:
                 if not cs_actual_mask or val & cs_actual_mask:
                     break
                 irun = self.fields.get_field(self.irun_field)
-                if self.check_timer is None or irun < 4:
+                if not self.check_active or irun < 4:
                     break
                 if (self.irun_field == "irun"
                     and not self.fields.get_field("ihold")):
@@ -172,9 +246,13 @@ class TMCErrorCheck:
             self.adc_temp = self.mcu_tmc.get_register(self.adc_temp_reg)
         except self.printer.command_error as e:
             # Ignore comms error for temperature
+            self.poll_errors += 1
             self.adc_temp = None
             return
-    def _do_periodic_check(self, eventtime):
+    def do_periodic_check(self):
+        # Invoked from TMCPollGroup - returns False on a fatal error
+        reactor = self.printer.get_reactor()
+        starttime = reactor.monotonic()
         try:
             self._query_register(self.drv_status_reg_info)
             if self.gstat_reg_info is not None:
@@ -183,33 +261,33 @@ class TMCErrorCheck:
                 self._query_temperature()
         except self.printer.command_error as e:
             self.printer.invoke_shutdown(str(e))
-            return self.printer.get_reactor().NEVER
-        return eventtime + 1.
+            return False
+        self.poll_latency = reactor.monotonic() - starttime
+        return True
     def stop_checks(self):
-        if self.check_timer is None:
+        if not self.check_active:
             return
-        self.printer.get_reactor().unregister_timer(self.check_timer)
-        self.check_timer = None
+        self.poll_group.remove_check(self)
+        self.check_active = False
     def start_checks(self):
-        if self.check_timer is not None:
+        if self.check_active:
             self.stop_checks()
         cleared_flags = 0
         self._query_register(self.drv_status_reg_info)
         if self.gstat_reg_info is not None:
             cleared_flags = self._query_register(self.gstat_reg_info,
                                                  try_clear=self.clear_gstat)
-        reactor = self.printer.get_reactor()
-        curtime = reactor.monotonic()
-        self.check_timer = reactor.register_timer(self._do_periodic_check,
-                                                  curtime + 1.)
+        self.poll_group.add_check(self)
+        self.check_active = True
         if cleared_flags:
             reset_mask = self.fields.all_fields["GSTAT"]["reset"]
             if cleared_flags & reset_mask:
                 return True
         return False
     def get_status(self, eventtime=None):
-        if self.check_timer is None:
-            return {'drv_status': None, 'temperature': None}
+        if not self.check_active:
+            return {'drv_status': None, 'temperature': None,
+                    'poll_latency': None, 'poll_errors': self.poll_errors}
         temp = None
         if self.adc_temp is not None:
             temp = round((self.adc_temp - 2038) / 7.7, 2)
@@ -218,7 +296,9 @@ class TMCErrorCheck:
             self.last_drv_status = last_value
             fields = self.fields.get_reg_fields(reg_name, last_value)
             self.last_drv_fields = {n: v for n, v in fields.items() if v}
-        return {'drv_status': self.last_drv_fields, 'temperature': temp}
+        return {'drv_status': self.last_drv_fields, 'temperature': temp,
+                'poll_latency': round(self.poll_latency, 6),
+                'poll_errors': self.poll_errors}
 
 
 ######################################################################
@@ -3,7 +3,7 @@
 # Copyright (C) 2018-2024  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import os, sys, logging, io
+import os, logging, io, threading, collections, re, json, bisect, time
 
 VALID_GCODE_EXTS = ['gcode', 'g', 'gco']
 
@@ -13,16 +13,318 @@ DEFAULT_ERROR_GCODE = """
 {% endif %}
 """
 
+PREFETCH_CHUNK_SIZE = 65536
+STALL_TIMEOUT = 0.250
+
+# Read file data ahead of the print position in a background thread
+class FilePrefetcher:
+    def __init__(self, reactor, filename, buffer_size):
+        self.reactor = reactor
+        self.buffer_size = buffer_size
+        self.fd = os.open(filename, os.O_RDONLY)
+        self.lock = threading.Condition()
+        self.chunks = collections.deque()
+        self.buffered = 0
+        self.read_pos = self.next_pos = 0
+        self.at_eof = self.is_closed = False
+        self.error = None
+        self.waiter = None
+        # Read stall tracking (the initial fill after a seek is not a stall)
+        self.is_filling = True
+        self.is_stalled = False
+        self.stalls = 0
+        self.stall_time = 0.
+        self.thread = threading.Thread(target=self._prefetch)
+        self.thread.daemon = True
+        self.thread.start()
+    def _prefetch(self):
+        self.lock.acquire()
+        while not self.is_closed:
+            if (self.at_eof or self.error is not None
+                or self.buffered >= self.buffer_size):
+                self.lock.wait()
+                continue
+            pos = self.read_pos
+            self.lock.release()
+            data = error = None
+            try:
+                data = os.pread(self.fd, PREFETCH_CHUNK_SIZE, pos)
+            except Exception as e:
+                error = e
+            self.lock.acquire()
+            if pos != self.read_pos:
+                # File was seeked while reading
+                continue
+            if error is not None:
+                self.error = error
+            elif not data:
+                self.at_eof = True
+            else:
+                self.chunks.append(data)
+                self.buffered += len(data)
+                self.read_pos += len(data)
+            if self.waiter is not None:
+                self.reactor.async_complete(self.waiter, None)
+                self.waiter = None
+        self.lock.release()
+        os.close(self.fd)
+    def read(self):
+        # Return the next chunk of data, b'' at end of file, or None if
+        # the data did not arrive in time (caller should retry)
+        with self.lock:
+            if self.chunks:
+                data = self.chunks.popleft()
+                self.buffered -= len(data)
+                self.next_pos += len(data)
+                self.is_filling = self.is_stalled = False
+                self.lock.notify()
+                return data
+            if self.error is not None:
+                raise self.error
+            if self.at_eof:
+                return b''
+            if not self.is_filling and not self.is_stalled:
+                self.is_stalled = True
+                self.stalls += 1
+            completion = self.waiter = self.reactor.completion()
+        start_time = self.reactor.monotonic()
+        completion.wait(start_time + STALL_TIMEOUT)
+        if self.is_stalled:
+            self.stall_time += self.reactor.monotonic() - start_time
+        return None
+    def seek(self, pos):
+        with self.lock:
+            if pos == self.next_pos and self.error is None:
+                return
+            self.chunks.clear()
+            self.buffered = 0
+            self.read_pos = self.next_pos = pos
+            self.at_eof = self.is_stalled = False
+            self.is_filling = True
+            self.error = None
+            self.lock.notify()
+    def close(self):
+        with self.lock:
+            self.is_closed = True
+            self.chunks.clear()
+            self.lock.notify()
+    def get_stall_stats(self):
+        return self.stalls, self.stall_time
+
+INDEX_VERSION = 2
+INDEX_CHUNK_SIZE = 262144
+INDEX_WAIT_TIME = 30.
+
+index_r = re.compile(
+    br'^(?:(;LAYER_CHANGE|;LAYER:)|(G9[01])\b|(M8[23])\b|(G[01]|G92) ([^\n;]*)'
+    br'|EXCLUDE_OBJECT_START NAME=([^\s;]+))', re.M)
+# Once layer markers are found only moves that change Z are needed
+index_z_r = re.compile(
+    br'^(?:(;LAYER_CHANGE|;LAYER:)|(G9[01])\b|(M8[23])\b'
+    br'|(G[01]) ([^\n;]*Z[^\n;]*)|EXCLUDE_OBJECT_START NAME=([^\s;]+))', re.M)
+
+# Return the value of a parameter in a G0/G1/G92 line (or None)
+def get_param(params, letter):
+    pos = params.find(letter)
+    if pos < 0:
+        return None
+    end = params.find(b' ', pos)
+    return float(params[pos+1:] if end < 0 else params[pos+1:end])
+
+# Byte offsets of layers, Z changes and objects in a gcode file.  The
+# index is built in a background thread and stored in a sidecar file.
+class GcodeFileIndex:
+    def __init__(self, reactor, filename):
+        self.reactor = reactor
+        self.filename = filename
+        dname, fname = os.path.split(filename)
+        self.index_filename = os.path.join(dname, "." + fname + ".index")
+        st = os.stat(filename)
+        self.file_id = (st.st_size, st.st_mtime)
+        self.layers = self.z_offsets = self.z_values = self.objects = None
+        self.is_closed = False
+        self.completion = reactor.completion()
+        self.thread = threading.Thread(target=self._build_index)
+        self.thread.daemon = True
+        self.thread.start()
+    def _load_sidecar(self):
+        try:
+            with open(self.index_filename, 'r') as f:
+                data = json.load(f)
+            if (data['version'] == INDEX_VERSION
+                and (data['file_size'], data['file_mtime']) == self.file_id):
+                return data
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+        return None
+    def _set_index(self, data):
+        self.z_offsets = data['z_offsets']
+        self.z_values = data['z_values']
+        self.objects = data['objects']
+        self.layers = data['layers']
+    def _build_index(self):
+        data = self._load_sidecar()
+        if data is not None:
+            self._set_index(data)
+            self.reactor.async_complete(self.completion, True)
+            return
+        try:
+            data = self._scan_file()
+        except:
+            logging.exception("virtual_sdcard index %s", self.filename)
+            self.reactor.async_complete(self.completion, False)
+            return
+        if data is None:
+            return
+        self._set_index(data)
+        self.reactor.async_complete(self.completion, True)
+        try:
+            tmpname = self.index_filename + ".tmp"
+            with open(tmpname, 'w') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.rename(tmpname, self.index_filename)
+        except (IOError, OSError):
+            logging.info("virtual_sdcard: Unable to write index file %s",
+                         self.index_filename)
+    def _scan_file(self):
+        markers = []
+        extrude_layers = []
+        z_offsets = []
+        z_values = []
+        objects = []
+        is_relative = is_relative_e = False
+        cur_z = layer_z = None
+        last_e = 0.
+        with open(self.filename, 'rb') as f:
+            base = 0
+            partial = b""
+            while 1:
+                if self.is_closed:
+                    return None
+                data = f.read(INDEX_CHUNK_SIZE)
+                if not data:
+                    if not partial:
+                        break
+                    data = b"\n"
+                data = partial + data
+                end = data.rfind(b"\n") + 1
+                partial = data[end:]
+                regex = index_z_r if markers else index_r
+                for m in regex.finditer(data, 0, end):
+                    offset = base + m.start()
+                    layer, mode, e_mode, cmd, params, name = m.groups()
+                    if layer is not None:
+                        markers.append(offset)
+                    elif mode is not None:
+                        is_relative = mode == b'G91'
+                    elif e_mode is not None:
+                        is_relative_e = e_mode == b'M83'
+                    elif cmd is not None:
+                        try:
+                            z = get_param(params, b'Z')
+                            # Extrusion is only needed without layer markers
+                            e = None if markers else get_param(params, b'E')
+                        except ValueError:
+                            continue
+                        if cmd == b'G92':
+                            if e is not None:
+                                last_e = e
+                            continue
+                        if z is not None:
+                            if is_relative:
+                                z = None if cur_z is None else z + cur_z
+                            if z is not None and z != cur_z:
+                                cur_z = z
+                                z_offsets.append(offset)
+                                z_values.append(z)
+                        if e is None:
+                            continue
+                        if is_relative or is_relative_e:
+                            extruding = e > 0.
+                            last_e += e
+                        else:
+                            extruding = e > last_e
+                            last_e = e
+                        # A layer starts at the Z move before the first
+                        # extruding move above the previous layer
+                        if (extruding and cur_z is not None
+                            and (layer_z is None or cur_z > layer_z)
+                            and (b'X' in params or b'Y' in params)):
+                            layer_z = cur_z
+                            extrude_layers.append(z_offsets[-1])
+                    else:
+                        objects.append([offset, name.decode(errors='replace')])
+                base += end
+                # Let the main thread run
+                time.sleep(0.)
+        # Use slicer layer comments if present, otherwise the heights
+        # where extrusion first reaches a new maximum
+        return {'version': INDEX_VERSION, 'file_size': self.file_id[0],
+                'file_mtime': self.file_id[1],
+                'layers': markers or extrude_layers,
+                'z_offsets': z_offsets, 'z_values': z_values,
+                'objects': objects}
+    def close(self):
+        self.is_closed = True
+    def wait_ready(self, timeout=INDEX_WAIT_TIME):
+        return self.completion.wait(self.reactor.monotonic() + timeout)
+    def get_layer_count(self):
+        if self.layers is None:
+            return None
+        return len(self.layers)
+    def get_layer(self, pos):
+        # Return the (1 based) layer number that contains file position pos
+        if self.layers is None:
+            return None
+        return bisect.bisect_right(self.layers, pos)
+    def get_layer_offset(self, layer):
+        if self.layers is None or not 1 <= layer <= len(self.layers):
+            return None
+        return self.layers[layer - 1]
+    def get_z(self, pos):
+        if self.z_offsets is None:
+            return None
+        i = bisect.bisect_right(self.z_offsets, pos)
+        if not i:
+            return None
+        return self.z_values[i - 1]
+    def get_objects(self):
+        return self.objects
+
+# Remove index sidecar files whose gcode file was deleted or renamed
+def remove_orphan_indexes(dirname):
+    for root, dirs, files in os.walk(dirname, followlinks=True):
+        for name in files:
+            if not name.startswith('.'):
+                continue
+            if name.endswith(".index"):
+                data_name = name[1:-len(".index")]
+            elif name.endswith(".index.tmp"):
+                data_name = name[1:-len(".index.tmp")]
+            else:
+                continue
+            if data_name in files:
+                continue
+            try:
+                os.remove(os.path.join(root, name))
+            except OSError:
+                logging.info("virtual_sdcard: Unable to remove index file %s",
+                             os.path.join(root, name))
+
 class VirtualSD:
     def __init__(self, config):
         self.printer = config.get_printer()
+        self.printer.register_event_handler("klippy:ready",
+                                            self.handle_ready)
         self.printer.register_event_handler("klippy:shutdown",
                                             self.handle_shutdown)
         # sdcard state
         sd = config.get('path')
         self.sdcard_dirname = os.path.normpath(os.path.expanduser(sd))
-        self.current_file = None
+        self.current_file = self.file_reader = self.file_index = None
         self.file_position = self.file_size = 0
+        self.prefetch_size = config.getint('prefetch_size', 4 * 1024 * 1024,
+                                           minval=PREFETCH_CHUNK_SIZE)
         # Print Stat Tracking
         self.print_stats = self.printer.load_object(config, 'print_stats')
         # Work timer
@@ -46,6 +348,20 @@ class VirtualSD:
         self.gcode.register_command(
             "SDCARD_PRINT_FILE", self.cmd_SDCARD_PRINT_FILE,
             desc=self.cmd_SDCARD_PRINT_FILE_help)
+        self.gcode.register_command(
+            "SDCARD_SEEK", self.cmd_SDCARD_SEEK,
+            desc=self.cmd_SDCARD_SEEK_help)
+    def handle_ready(self):
+        # Sweep stale index files in the background (the sdcard
+        # directory may be large or on slow storage)
+        thread = threading.Thread(target=self._remove_orphan_indexes)
+        thread.daemon = True
+        thread.start()
+    def _remove_orphan_indexes(self):
+        try:
+            remove_orphan_indexes(self.sdcard_dirname)
+        except:
+            logging.exception("virtual_sdcard remove orphan indexes")
     def handle_shutdown(self):
         if self.work_timer is not None:
             self.must_pause_work = True
@@ -63,7 +379,9 @@ class VirtualSD:
     def stats(self, eventtime):
         if self.work_timer is None:
             return False, ""
-        return True, "sd_pos=%d" % (self.file_position,)
+        stalls, stall_time = self._get_stall_stats()
+        return True, "sd_pos=%d sd_stalls=%d sd_stall_time=%.3f" % (
+            self.file_position, stalls, stall_time)
     def get_file_list(self, check_subdirs=False):
         if check_subdirs:
             flist = []
@@ -90,13 +408,26 @@ class VirtualSD:
                 logging.exception("virtual_sdcard get_file_list")
                 raise self.gcode.error("Unable to get file list")
     def get_status(self, eventtime):
+        stalls, stall_time = self._get_stall_stats()
+        current_layer = layer_count = None
+        if self.file_index is not None:
+            current_layer = self.file_index.get_layer(self.file_position)
+            layer_count = self.file_index.get_layer_count()
         return {
             'file_path': self.file_path(),
             'progress': self.progress(),
             'is_active': self.is_active(),
             'file_position': self.file_position,
             'file_size': self.file_size,
+            'read_stalls': stalls,
+            'read_stall_time': stall_time,
+            'current_layer': current_layer,
+            'layer_count': layer_count,
         }
+    def _get_stall_stats(self):
+        if self.file_reader is None:
+            return 0, 0.
+        return self.file_reader.get_stall_stats()
     def file_path(self):
         if self.current_file:
             return self.current_file.name
@@ -122,18 +453,23 @@ class VirtualSD:
     def do_cancel(self):
         if self.current_file is not None:
             self.do_pause()
-            self.current_file.close()
-            self.current_file = None
+            self._close_file()
             self.print_stats.note_cancel()
         self.file_position = self.file_size = 0
     # G-Code commands
     def cmd_error(self, gcmd):
         raise gcmd.error("SD write not supported")
+    def _close_file(self):
+        self.current_file.close()
+        self.current_file = None
+        self.file_reader.close()
+        self.file_reader = None
+        self.file_index.close()
+        self.file_index = None
     def _reset_file(self):
         if self.current_file is not None:
             self.do_pause()
-            self.current_file.close()
-            self.current_file = None
+            self._close_file()
         self.file_position = self.file_size = 0
         self.print_stats.reset()
         self.printer.send_event("virtual_sdcard:reset_file")
@@ -155,6 +491,22 @@ class VirtualSD:
             filename = filename[1:]
         self._load_file(gcmd, filename, check_subdirs=True)
         self.do_resume()
+    cmd_SDCARD_SEEK_help = "Set the SD file position to the start of a layer"
+    def cmd_SDCARD_SEEK(self, gcmd):
+        if self.work_timer is not None:
+            raise gcmd.error("SD busy")
+        if self.file_index is None:
+            raise gcmd.error("No SD file loaded")
+        layer = gcmd.get_int('LAYER', minval=1)
+        if not self.file_index.wait_ready():
+            raise gcmd.error("SD file index not available")
+        pos = self.file_index.get_layer_offset(layer)
+        if pos is None:
+            raise gcmd.error("Layer %d not found (file has %d layers)"
+                             % (layer, self.file_index.get_layer_count()))
+        self.file_position = pos
+        gcmd.respond_info("SD file position set to %d (layer %d)"
+                          % (pos, layer))
     def cmd_M20(self, gcmd):
         # List SD card
         files = self.get_file_list()
@@ -187,12 +539,16 @@ class VirtualSD:
             f.seek(0, os.SEEK_END)
             fsize = f.tell()
             f.seek(0)
+            reader = FilePrefetcher(self.reactor, fname, self.prefetch_size)
+            index = GcodeFileIndex(self.reactor, fname)
         except:
             logging.exception("virtual_sdcard file open")
             raise gcmd.error("Unable to open file")
         gcmd.respond_raw("File opened:%s Size:%d" % (filename, fsize))
         gcmd.respond_raw("File selected")
         self.current_file = f
+        self.file_reader = reader
+        self.file_index = index
         self.file_position = 0
         self.file_size = fsize
         self.print_stats.set_current_file(filename)
@@ -226,32 +582,34 @@ class VirtualSD:
         logging.info("Starting SD card print (position %d)", self.file_position)
         self.reactor.unregister_timer(self.work_timer)
         try:
-            self.current_file.seek(self.file_position)
+            self.file_reader.seek(self.file_position)
         except:
             logging.exception("virtual_sdcard seek")
             self.work_timer = None
             return self.reactor.NEVER
         self.print_stats.note_start()
         gcode_mutex = self.gcode.get_mutex()
-        partial_input = ""
+        partial_input = b""
         lines = []
         error_message = None
         while not self.must_pause_work:
             if not lines:
                 # Read more data
                 try:
-                    data = self.current_file.read(8192)
+                    data = self.file_reader.read()
                 except:
                     logging.exception("virtual_sdcard read")
                     break
+                if data is None:
+                    # Read is stalled - recheck for pause requests
+                    continue
                 if not data:
                     # End of file
-                    self.current_file.close()
-                    self.current_file = None
+                    self._close_file()
                     logging.info("Finished SD card print")
                     self.gcode.respond_raw("Done printing file")
                     break
-                lines = data.split('\n')
+                lines = data.split(b'\n')
                 lines[0] = partial_input + lines[0]
                 partial_input = lines.pop()
                 lines.reverse()
@@ -264,13 +622,10 @@ class VirtualSD:
             # Dispatch command
             self.cmd_from_sd = True
             line = lines.pop()
-            if sys.version_info.major >= 3:
-                next_file_position = self.file_position + len(line.encode()) + 1
-            else:
-                next_file_position = self.file_position + len(line) + 1
+            next_file_position = self.file_position + len(line) + 1
             self.next_file_position = next_file_position
             try:
-                self.gcode.run_script(line)
+                self.gcode.run_script(line.decode())
             except self.gcode.error as e:
                 error_message = str(e)
                 try:
@@ -285,14 +640,9 @@ class VirtualSD:
             self.file_position = self.next_file_position
             # Do we need to skip around?
             if self.next_file_position != next_file_position:
-                try:
-                    self.current_file.seek(self.file_position)
-                except:
-                    logging.exception("virtual_sdcard seek")
-                    self.work_timer = None
-                    return self.reactor.NEVER
+                self.file_reader.seek(self.file_position)
                 lines = []
-                partial_input = ""
+                partial_input = b""
         logging.info("Exiting SD card print (position %d)", self.file_position)
         self.work_timer = None
         self.cmd_from_sd = False
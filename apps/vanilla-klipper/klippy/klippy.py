@@ -35,6 +35,11 @@ class Printer:
         self.run_result = None
         self.event_handlers = {}
         self.objects = collections.OrderedDict()
+        # Startup time tracking
+        self.start_time = self.reactor.monotonic()
+        self.startup_phases = []
+        self.load_times = {}
+        self.load_nested_time = 0.
         # Init printer components that must be setup prior to config
         for m in [gcode, webhooks]:
             m.add_early_printer_objects(self)
@@ -100,22 +105,52 @@ class Printer:
             if default is not configfile.sentinel:
                 return default
             raise self.config_error("Unable to load module '%s'" % (section,))
+        start_time = self.reactor.monotonic()
+        outer_nested_time = self.load_nested_time
+        self.load_nested_time = 0.
         mod = importlib.import_module('extras.' + module_name)
+        import_time = self.reactor.monotonic() - start_time
         init_func = 'load_config'
         if len(module_parts) > 1:
             init_func = 'load_config_prefix'
         init_func = getattr(mod, init_func, None)
         if init_func is None:
+            self.load_nested_time = outer_nested_time
             if default is not configfile.sentinel:
                 return default
             raise self.config_error("Unable to load module '%s'" % (section,))
         self.objects[section] = init_func(config.getsection(section))
+        # Note load time (excluding any other objects loaded by this one)
+        total_time = self.reactor.monotonic() - start_time
+        self.load_times[section] = (total_time - self.load_nested_time,
+                                    import_time)
+        self.load_nested_time = outer_nested_time + total_time
         return self.objects[section]
+    def _note_startup_phase(self, name):
+        self.startup_phases.append((name, self.reactor.monotonic()))
+    def _log_startup_profile(self):
+        # Report where time was spent during startup
+        phases = []
+        last_time = self.start_time
+        for name, phase_time in self.startup_phases:
+            phases.append("%s=%.3fs" % (name, phase_time - last_time))
+            last_time = phase_time
+        logging.info("Startup profile: total=%.3fs %s (process cpu %.3fs)",
+                     last_time - self.start_time, " ".join(phases),
+                     time.process_time())
+        load_times = sorted(self.load_times.items(),
+                            key=(lambda i: i[1][0]), reverse=True)
+        msgs = ["%s=%.3fs (import %.3fs)" % (section, load_time, import_time)
+                for section, (load_time, import_time) in load_times[:10]
+                if load_time >= .001]
+        if msgs:
+            logging.info("Startup profile objects: %s", ", ".join(msgs))
     def _read_config(self):
         self.objects['configfile'] = pconfig = configfile.PrinterConfig(self)
         config = pconfig.read_main_config()
         if self.bglogger is not None:
             pconfig.log_config(config)
+        self._note_startup_phase("config")
         # Create printer components
         for m in [pins, mcu]:
             m.add_printer_objects(config)
@@ -125,14 +160,17 @@ class Printer:
             m.add_printer_objects(config)
         # Validate that there are no undefined parameters in the config file
         pconfig.check_unused_options(config)
+        self._note_startup_phase("objects")
     def _connect(self, eventtime):
         try:
             self._read_config()
             self.send_event("klippy:mcu_identify")
+            self._note_startup_phase("identify")
             for cb in self.event_handlers.get("klippy:connect", []):
                 if self.state_message is not message_startup:
                     return
                 cb()
+            self._note_startup_phase("connect")
         except (self.config_error, pins.error) as e:
             logging.exception("Config error")
             self._set_state("%s\n%s" % (str(e), message_restart))
@@ -162,6 +200,8 @@ class Printer:
                 if self.state_message is not message_ready:
                     return
                 cb()
+            self._note_startup_phase("ready")
+            self._log_startup_profile()
         except Exception as e:
             logging.exception("Unhandled exception during ready callback")
             self.invoke_shutdown("Internal error during ready callback: %s"
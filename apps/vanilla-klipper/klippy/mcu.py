@@ -964,21 +964,29 @@ class MCU:
         self._reserved_move_slots += 1
     def register_flush_callback(self, callback):
         self._flush_callbacks.append(callback)
-    def flush_moves(self, print_time, clear_history_time):
+    def _steppersync_flush(self, clock, clear_history_clock):
+        # Transmit queued steps (this may be run from a step generation thread)
+        ret = self._ffi_lib.steppersync_flush(self._steppersync, clock,
+                                              clear_history_clock)
+        if ret:
+            raise error("Internal error in MCU '%s' stepcompress"
+                        % (self._name,))
+    def prepare_flush_moves(self, print_time, clear_history_time):
+        # Run flush callbacks and return the steppersync flush to perform
         if self._steppersync is None:
-            return
+            return None
         clock = self.print_time_to_clock(print_time)
         if clock < 0:
-            return
+            return None
         for cb in self._flush_callbacks:
             cb(print_time, clock)
         clear_history_clock = \
             max(0, self.print_time_to_clock(clear_history_time))
-        ret = self._ffi_lib.steppersync_flush(self._steppersync, clock,
-                                              clear_history_clock)
-        if ret:
-            raise error("Internal error in MCU '%s' stepcompress"
-                        % (self._name,))
+        return (lambda: self._steppersync_flush(clock, clear_history_clock))
+    def flush_moves(self, print_time, clear_history_time):
+        flush = self.prepare_flush_moves(print_time, clear_history_time)
+        if flush is not None:
+            flush()
     def check_active(self, print_time, eventtime):
         if self._steppersync is None:
             return
@@ -3,7 +3,7 @@
 # Copyright (C) 2016-2020  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import os, gc, select, math, time, logging, queue
+import os, gc, select, math, time, logging, queue, bisect
 import greenlet
 import chelper, util
 
@@ -61,6 +61,78 @@ class ReactorGreenlet(greenlet.greenlet):
     def __init__(self, run):
         greenlet.greenlet.__init__(self, run=run)
         self.timer = None
+        # Callback timing (only used when callback stats are enabled)
+        self.cb_start = self.cb_elapsed = 0.
+
+# Upper bounds (in seconds) of the callback duration histogram buckets
+STATS_BUCKETS = [.001, .005, .010, .025, .050, .100, .250, .500, 1.]
+
+def _callback_name(callback):
+    obj = getattr(callback, '__self__', None)
+    if isinstance(obj, ReactorCallback):
+        return _callback_name(obj.callback)
+    if isinstance(obj, greenlet.greenlet):
+        # Resuming a paused greenlet - time is charged to its callback
+        return None
+    func = getattr(callback, '__func__', callback)
+    if not hasattr(func, '__qualname__'):
+        func = type(func)
+    return "%s.%s" % (func.__module__, func.__qualname__)
+
+class ReactorCallbackStats:
+    def __init__(self, reactor, slow_time=0.):
+        self.monotonic = reactor.monotonic
+        self.slow_time = slow_time
+        self.callbacks = {}
+        self.period_count = 0
+        self.period_time = self.period_max = 0.
+        self.period_max_name = None
+    def run(self, callback, eventtime):
+        g = greenlet.getcurrent()
+        g.cb_elapsed = 0.
+        g.cb_start = self.monotonic()
+        res = callback(eventtime)
+        self.note(callback, g.cb_elapsed + self.monotonic() - g.cb_start)
+        return res
+    def note_pause(self, g):
+        g.cb_elapsed += self.monotonic() - g.cb_start
+    def note_resume(self, g):
+        g.cb_start = self.monotonic()
+    def note(self, callback, elapsed):
+        name = _callback_name(callback)
+        if name is None:
+            return
+        st = self.callbacks.get(name)
+        if st is None:
+            st = self.callbacks[name] = {
+                'count': 0, 'total': 0., 'max': 0.,
+                'histogram': [0] * (len(STATS_BUCKETS) + 1)}
+        st['count'] += 1
+        st['total'] += elapsed
+        st['histogram'][bisect.bisect_left(STATS_BUCKETS, elapsed)] += 1
+        if elapsed > st['max']:
+            st['max'] = elapsed
+        self.period_count += 1
+        self.period_time += elapsed
+        if elapsed > self.period_max:
+            self.period_max = elapsed
+            self.period_max_name = name
+        if self.slow_time and elapsed >= self.slow_time:
+            logging.warning("Slow reactor callback %s took %.3fs",
+                            name, elapsed)
+    def get_stats(self):
+        return {'buckets': STATS_BUCKETS,
+                'callbacks': {name: dict(st, histogram=list(st['histogram']))
+                              for name, st in self.callbacks.items()}}
+    def get_period_stats(self):
+        res = (self.period_count, self.period_time,
+               self.period_max, self.period_max_name)
+        self.period_count = 0
+        self.period_time = self.period_max = 0.
+        self.period_max_name = None
+        return res
+    def reset(self):
+        self.callbacks = {}
 
 class ReactorMutex:
     def __init__(self, reactor, is_locked):
@@ -101,6 +173,9 @@ class SelectReactor:
         # Python garbage collection
         self._check_gc = gc_checking
         self._last_gc_times = [0., 0., 0.]
+        self._gc_handler = None
+        # Callback timing statistics
+        self._callback_stats = None
         # Timers
         self._timers = []
         self._next_timer = self.NEVER
@@ -116,6 +191,16 @@ class SelectReactor:
         self._all_greenlets = []
     def get_gc_stats(self):
         return tuple(self._last_gc_times)
+    def set_gc_handler(self, handler):
+        # The handler is called as handler(eventtime, deadline, gc_level)
+        # and returns the generation it collected (or None if deferred)
+        self._gc_handler = handler
+    def enable_callback_stats(self, slow_time=0.):
+        if self._callback_stats is None:
+            self._callback_stats = ReactorCallbackStats(self, slow_time)
+        return self._callback_stats
+    def get_callback_stats(self):
+        return self._callback_stats
     # Timers
     def update_timer(self, timer_handler, waketime):
         timer_handler.waketime = waketime
@@ -145,17 +230,27 @@ class SelectReactor:
                         gc_level = 1
                         if gi[2] >= 10:
                             gc_level = 2
-                    self._last_gc_times[gc_level] = eventtime
-                    gc.collect(gc_level)
-                    return 0.
+                    if self._gc_handler is None:
+                        gc.collect(gc_level)
+                    else:
+                        gc_level = self._gc_handler(
+                            eventtime, self._next_timer, gc_level)
+                    if gc_level is not None:
+                        self._last_gc_times[gc_level] = eventtime
+                        return 0.
             return min(1., max(.001, self._next_timer - eventtime))
         self._next_timer = self.NEVER
         g_dispatch = self._g_dispatch
+        cb_stats = self._callback_stats
         for t in self._timers:
             waketime = t.waketime
             if eventtime >= waketime:
                 t.waketime = self.NEVER
-                t.waketime = waketime = t.callback(eventtime)
+                if cb_stats is None:
+                    t.waketime = waketime = t.callback(eventtime)
+                else:
+                    t.waketime = waketime = cb_stats.run(t.callback,
+                                                         eventtime)
                 if g_dispatch is not self._g_dispatch:
                     self._next_timer = min(self._next_timer, waketime)
                     self._end_greenlet(g_dispatch)
@@ -221,8 +316,13 @@ class SelectReactor:
         g_next.parent = g.parent
         g.timer = self.register_timer(g.switch, waketime)
         self._next_timer = self.NOW
+        cb_stats = self._callback_stats
+        if cb_stats is not None:
+            cb_stats.note_pause(g)
         # Switch to _dispatch_loop (via _end_greenlet or direct)
         eventtime = g_next.switch()
+        if cb_stats is not None:
+            cb_stats.note_resume(g)
         # This greenlet activated from g.timer.callback (via _check_timers)
         return eventtime
     def _end_greenlet(self, g_old):
@@ -268,16 +368,23 @@ class SelectReactor:
             busy = False
             res = select.select(self._read_fds, self.write_fds, [], timeout)
             eventtime = self.monotonic()
+            cb_stats = self._callback_stats
             for fd in res[0]:
                 busy = True
-                fd.read_callback(eventtime)
+                if cb_stats is None:
+                    fd.read_callback(eventtime)
+                else:
+                    cb_stats.run(fd.read_callback, eventtime)
                 if g_dispatch is not self._g_dispatch:
                     self._end_greenlet(g_dispatch)
                     eventtime = self.monotonic()
                     break
             for fd in res[1]:
                 busy = True
-                fd.write_callback(eventtime)
+                if cb_stats is None:
+                    fd.write_callback(eventtime)
+                else:
+                    cb_stats.run(fd.write_callback, eventtime)
                 if g_dispatch is not self._g_dispatch:
                     self._end_greenlet(g_dispatch)
                     eventtime = self.monotonic()
@@ -341,16 +448,23 @@ class PollReactor(SelectReactor):
             busy = False
             res = self._poll.poll(int(math.ceil(timeout * 1000.)))
             eventtime = self.monotonic()
+            cb_stats = self._callback_stats
             for fd, event in res:
                 busy = True
                 if event & (select.POLLIN | select.POLLHUP):
-                    self._fds[fd].read_callback(eventtime)
+                    if cb_stats is None:
+                        self._fds[fd].read_callback(eventtime)
+                    else:
+                        cb_stats.run(self._fds[fd].read_callback, eventtime)
                     if g_dispatch is not self._g_dispatch:
                         self._end_greenlet(g_dispatch)
                         eventtime = self.monotonic()
                         break
                 if event & select.POLLOUT:
-                    self._fds[fd].write_callback(eventtime)
+                    if cb_stats is None:
+                        self._fds[fd].write_callback(eventtime)
+                    else:
+                        cb_stats.run(self._fds[fd].write_callback, eventtime)
                     if g_dispatch is not self._g_dispatch:
                         self._end_greenlet(g_dispatch)
                         eventtime = self.monotonic()
@@ -392,16 +506,23 @@ class EPollReactor(SelectReactor):
             busy = False
             res = self._epoll.poll(timeout)
             eventtime = self.monotonic()
+            cb_stats = self._callback_stats
             for fd, event in res:
                 busy = True
                 if event & (select.EPOLLIN | select.EPOLLHUP):
-                    self._fds[fd].read_callback(eventtime)
+                    if cb_stats is None:
+                        self._fds[fd].read_callback(eventtime)
+                    else:
+                        cb_stats.run(self._fds[fd].read_callback, eventtime)
                     if g_dispatch is not self._g_dispatch:
                         self._end_greenlet(g_dispatch)
                         eventtime = self.monotonic()
                         break
                 if event & select.EPOLLOUT:
-                    self._fds[fd].write_callback(eventtime)
+                    if cb_stats is None:
+                        self._fds[fd].write_callback(eventtime)
+                    else:
+                        cb_stats.run(self._fds[fd].write_callback, eventtime)
                     if g_dispatch is not self._g_dispatch:
                         self._end_greenlet(g_dispatch)
                         eventtime = self.monotonic()
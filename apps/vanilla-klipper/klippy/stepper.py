@@ -213,7 +213,7 @@ class MCU_stepper:
         return old_tq
     def add_active_callback(self, cb):
         self._active_callbacks.append(cb)
-    def generate_steps(self, flush_time):
+    def check_step_activity(self, flush_time):
         # Check for activity if necessary
         if self._active_callbacks:
             sk = self._stepper_kinematics
@@ -223,11 +223,15 @@ class MCU_stepper:
                 self._active_callbacks = []
                 for cb in cbs:
                     cb(ret)
-        # Generate steps
+    def generate_itersolve_steps(self, flush_time):
+        # Generate steps (this may be run from a step generation thread)
         sk = self._stepper_kinematics
         ret = self._itersolve_generate_steps(sk, flush_time)
         if ret:
             raise error("Internal error in stepcompress")
+    def generate_steps(self, flush_time):
+        self.check_step_activity(flush_time)
+        self.generate_itersolve_steps(flush_time)
     def is_active_axis(self, axis):
         ffi_main, ffi_lib = chelper.get_ffi()
         a = axis.encode()
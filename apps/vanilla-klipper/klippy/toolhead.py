@@ -3,8 +3,8 @@
 # Copyright (C) 2016-2024  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import math, logging, importlib
-import mcu, chelper, kinematics.extruder
+import os, math, logging, importlib
+import mcu, chelper, stepper, kinematics.extruder
 
 # Common suffixes: _d is distance (in mm), _v is velocity (in
 #   mm/second), _v2 is velocity squared (mm^2/s^2), _t is time (in
@@ -207,6 +207,55 @@ DRIP_TIME = 0.100
 class DripModeEndSignal(Exception):
     pass
 
+# Run stepper step generation on a pool of worker threads.  The C
+# itersolve and steppersync code only touches per-stepper (and per-mcu)
+# state and cffi releases the GIL during the calls, so steppers (and
+# mcus) can be processed concurrently.  Python callbacks (stepper
+# activity checks, mcu flush callbacks, and non-stepper generators) are
+# still run from the main thread.
+class StepGenerationPool:
+    def __init__(self, printer, num_threads):
+        import concurrent.futures
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=num_threads, thread_name_prefix="stepgen")
+        printer.register_event_handler("klippy:disconnect",
+                                       self._handle_disconnect)
+    def _handle_disconnect(self):
+        self.executor.shutdown(wait=True)
+    def _run_jobs(self, jobs):
+        if not jobs:
+            return
+        # Submit to the worker threads and process one job locally
+        futures = [self.executor.submit(job) for job in jobs[1:]]
+        first_error = None
+        try:
+            jobs[0]()
+        except Exception as e:
+            first_error = e
+        # Wait for all jobs (even on error) before continuing
+        for future in futures:
+            e = future.exception()
+            if e is not None and first_error is None:
+                first_error = e
+        if first_error is not None:
+            raise first_error
+    def generate_steps(self, step_generators, flush_time):
+        jobs = []
+        for sg in step_generators:
+            mcu_stepper = getattr(sg, '__self__', None)
+            if (not isinstance(mcu_stepper, stepper.MCU_stepper)
+                or sg != mcu_stepper.generate_steps):
+                sg(flush_time)
+                continue
+            mcu_stepper.check_step_activity(flush_time)
+            gen = mcu_stepper.generate_itersolve_steps
+            jobs.append((lambda gen=gen: gen(flush_time)))
+        self._run_jobs(jobs)
+    def flush_moves(self, mcus, flush_time, clear_history_time):
+        jobs = [m.prepare_flush_moves(flush_time, clear_history_time)
+                for m in mcus]
+        self._run_jobs([job for job in jobs if job is not None])
+
 # Main code to track events (and their timing) on the printer toolhead
 class ToolHead:
     def __init__(self, config):
@@ -263,6 +312,13 @@ class ToolHead:
         self.trapq_append = ffi_lib.trapq_append
         self.trapq_finalize_moves = ffi_lib.trapq_finalize_moves
         self.step_generators = []
+        self.step_pool = None
+        step_threads = config.getint('step_generation_threads', 0, minval=0)
+        if step_threads:
+            if (os.cpu_count() or 1) < 2:
+                logging.info("step_generation_threads enabled on a single"
+                             " core host - no speedup is expected")
+            self.step_pool = StepGenerationPool(self.printer, step_threads)
         # Create kinematics class
         gcode = self.printer.lookup_object('gcode')
         self.Coord = gcode.Coord
@@ -300,8 +356,11 @@ class ToolHead:
         sg_flush_want = min(flush_time + STEPCOMPRESS_FLUSH_TIME,
                             self.print_time - self.kin_flush_delay)
         sg_flush_time = max(sg_flush_want, flush_time)
-        for sg in self.step_generators:
-            sg(sg_flush_time)
+        if self.step_pool is not None:
+            self.step_pool.generate_steps(self.step_generators, sg_flush_time)
+        else:
+            for sg in self.step_generators:
+                sg(sg_flush_time)
         self.min_restart_time = max(self.min_restart_time, sg_flush_time)
         # Free trapq entries that are no longer needed
         clear_history_time = self.clear_history_time
@@ -311,8 +370,12 @@ class ToolHead:
         self.trapq_finalize_moves(self.trapq, free_time, clear_history_time)
         self.extruder.update_move_time(free_time, clear_history_time)
         # Flush stepcompress and mcu steppersync
-        for m in self.all_mcus:
-            m.flush_moves(flush_time, clear_history_time)
+        if self.step_pool is not None:
+            self.step_pool.flush_moves(self.all_mcus, flush_time,
+                                       clear_history_time)
+        else:
+            for m in self.all_mcus:
+                m.flush_moves(flush_time, clear_history_time)
         self.last_flush_time = flush_time
     def _advance_move_time(self, next_print_time):
         pt_delay = self.kin_flush_delay + STEPCOMPRESS_FLUSH_TIME
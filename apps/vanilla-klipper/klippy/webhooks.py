@@ -5,6 +5,10 @@
 # This file may be distributed under the terms of the GNU GPLv3 license
 import logging, socket, os, sys, errno, json, collections
 import gcode
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 REQUEST_LOG_SIZE = 20
 
@@ -26,6 +30,55 @@ if sys.version_info.major < 3:
                     for k, v in data.items()}
         return data
 
+# Message encodings that a client may select with the "info" request
+class JsonEncoding:
+    name = "json"
+    def __init__(self):
+        self.partial_data = b""
+    def encode(self, data):
+        return json.dumps(data, separators=(',', ':')).encode() + b"\x03"
+    def split_requests(self, data):
+        requests = data.split(b'\x03')
+        requests[0] = self.partial_data + requests[0]
+        self.partial_data = requests.pop()
+        return requests
+    def take_remainder(self, requests):
+        # Return the data from the not yet processed requests
+        data = b"".join([req + b"\x03" for req in requests])
+        data += self.partial_data
+        self.partial_data = b""
+        return data
+    def decode(self, request):
+        return json.loads(request, object_hook=json_loads_byteify)
+
+class MsgpackEncoding:
+    name = "msgpack"
+    def __init__(self):
+        self.packer = msgpack.Packer(use_bin_type=True)
+        self.unpacker = msgpack.Unpacker(raw=False, strict_map_key=False)
+    def encode(self, data):
+        return self.packer.pack(data)
+    def split_requests(self, data):
+        # Requests are unpacked as they are iterated, so the iteration
+        # may be stopped if the client switches encoding
+        self.unpacker.feed(data)
+        return self.unpacker
+    def take_remainder(self, requests):
+        return self.unpacker.read_bytes(sys.maxsize)
+    def decode(self, request):
+        return request
+
+ENCODINGS = {"json": JsonEncoding}
+if msgpack is not None:
+    ENCODINGS["msgpack"] = MsgpackEncoding
+
+# Return the first supported encoding from a client's list
+def find_encoding(encodings, default):
+    for name in encodings:
+        if name in ENCODINGS:
+            return name
+    return default
+
 class WebRequestError(gcode.CommandError):
     def __init__(self, message,):
         Exception.__init__(self, message)
@@ -40,9 +93,8 @@ class Sentinel:
 
 class WebRequest:
     error = WebRequestError
-    def __init__(self, client_conn, request):
+    def __init__(self, client_conn, base_request):
         self.client_conn = client_conn
-        base_request = json.loads(request, object_hook=json_loads_byteify)
         if type(base_request) != dict:
             raise ValueError("Not a top-level dictionary")
         self.id = base_request.get('id', None)
@@ -136,6 +188,7 @@ class ServerSocket:
         self.clients[client.uid] = client
 
     def _handle_disconnect(self):
+        self.webhooks.flush_output()
         for client in list(self.clients.values()):
             client.close()
         if self.sock is not None:
@@ -182,7 +235,13 @@ class ClientConnection:
         self.sock = sock
         self.fd_handle = self.reactor.register_fd(
             self.sock.fileno(), self.process_received, self._do_send)
-        self.partial_data = self.send_buffer = b""
+        self.send_buffer = b""
+        # Received data is decoded with self.decoder and sent data is
+        # encoded with self.encoding (they only differ while an "info"
+        # response that switches encoding is pending)
+        self.encoding = JsonEncoding()
+        self.decoder = JsonEncoding()
+        self.pending_encoding = None
         self.is_blocking = False
         self.blocking_count = 0
         self.set_client_info("?", "New connection")
@@ -236,19 +295,58 @@ class ClientConnection:
             # Socket Closed
             self.close()
             return
-        requests = data.split(b'\x03')
-        requests[0] = self.partial_data + requests[0]
-        self.partial_data = requests.pop()
-        for req in requests:
+        while data:
+            data = self._process_data(eventtime, data)
+
+    def _process_data(self, eventtime, data):
+        # Returns any data that must be decoded with a new encoding
+        try:
+            requests = iter(self.decoder.split_requests(data))
+        except Exception:
+            self._handle_decode_error()
+            return b""
+        while 1:
+            try:
+                req = next(requests, Sentinel)
+            except Exception:
+                self._handle_decode_error()
+                return b""
+            if req is Sentinel:
+                return b""
             self.request_log.append((eventtime, req))
             try:
-                web_request = WebRequest(self, req)
+                web_request = WebRequest(self, self.decoder.decode(req))
             except Exception:
                 logging.exception("webhooks: Error decoding Server Request %s"
                                   % (req))
                 continue
             self.reactor.register_callback(
                 lambda e, s=self, wr=web_request: s._process_request(wr))
+            name = self._check_decoder_switch(web_request)
+            if name is not None:
+                # The rest of the data is already in the new encoding
+                data = self.decoder.take_remainder(requests)
+                self.decoder = ENCODINGS[name]()
+                return data
+
+    def _handle_decode_error(self):
+        logging.exception("webhooks: Error decoding data from client %s"
+                          % (self.uid,))
+        self.close()
+
+    def _check_decoder_switch(self, web_request):
+        # Clients may send requests in the new encoding right after an
+        # "info" request that selects it (without waiting for the
+        # response), so the decoder is switched as soon as it is read
+        if web_request.get_method() != "info":
+            return None
+        encodings = web_request.params.get('encodings')
+        if type(encodings) != list:
+            return None
+        name = find_encoding(encodings, self.decoder.name)
+        if name == self.decoder.name:
+            return None
+        return name
 
     def _process_request(self, web_request):
         try:
@@ -265,20 +363,46 @@ class ClientConnection:
         result = web_request.finish()
         if result is None:
             return
+        # Deliver any output generated by the request before its result
+        self.webhooks.flush_output()
         self.send(result)
+        if self.pending_encoding is not None:
+            # Switch encoding once the "info" response has been sent
+            self.encoding = ENCODINGS[self.pending_encoding]()
+            self.pending_encoding = None
+
+    def select_encoding(self, encodings):
+        # Use the first supported encoding from the client's list
+        name = find_encoding(encodings, self.encoding.name)
+        if name != self.encoding.name:
+            self.pending_encoding = name
+        return name
+
+    def get_encoding(self):
+        return self.encoding.name
 
     def send(self, data):
         try:
-            jmsg = json.dumps(data, separators=(',', ':'))
-            self.send_buffer += jmsg.encode() + b"\x03"
-        except (TypeError, ValueError) as e:
-            msg = ("json encoding error: %s" % (str(e),))
+            msg = self.encoding.encode(data)
+        except (TypeError, ValueError, OverflowError) as e:
+            msg = ("%s encoding error: %s" % (self.encoding.name, str(e)))
             logging.exception(msg)
             self.printer.invoke_shutdown(msg)
             return
+        self._queue_send(msg)
+
+    def send_encoded(self, jmsg):
+        # Send a message that is already json encoded
+        self._queue_send(jmsg + b"\x03")
+
+    def _queue_send(self, msg):
+        self.send_buffer += msg
         if not self.is_blocking:
             self._do_send()
 
+    def get_send_buffer_size(self):
+        return len(self.send_buffer)
+
     def _do_send(self, eventtime=None):
         if self.fd_handle is None:
             return
@@ -306,6 +430,7 @@ class WebHooks:
         self._endpoints = {"list_endpoints": self._handle_list_endpoints}
         self._remote_methods = {}
         self._mux_endpoints = {}
+        self._flush_callbacks = []
         self.register_endpoint("info", self._handle_info_request)
         self.register_endpoint("emergency_stop", self._handle_estop_request)
         self.register_endpoint("register_remote_method",
@@ -317,6 +442,13 @@ class WebHooks:
             raise WebRequestError("Path already registered to an endpoint")
         self._endpoints[path] = callback
 
+    def register_flush_callback(self, callback):
+        self._flush_callbacks.append(callback)
+
+    def flush_output(self):
+        for cb in self._flush_callbacks:
+            cb()
+
     def register_mux_endpoint(self, path, key, value, callback):
         prev = self._mux_endpoints.get(path)
         if prev is None:
@@ -348,9 +480,14 @@ class WebHooks:
         web_request.send({'endpoints': list(self._endpoints.keys())})
 
     def _handle_info_request(self, web_request):
+        cconn = web_request.get_client_connection()
+        # The connection has already switched to decoding requests with
+        # the selected encoding, so select it even if the request fails
+        encodings = web_request.get('encodings', [], types=(list,))
+        encoding = cconn.select_encoding(encodings)
         client_info = web_request.get_dict('client_info', None)
         if client_info is not None:
-            web_request.get_client_connection().set_client_info(client_info)
+            cconn.set_client_info(client_info)
         state_message, state = self.printer.get_state_message()
         src_path = os.path.dirname(__file__)
         klipper_path = os.path.normpath(os.path.join(src_path, ".."))
@@ -365,6 +502,8 @@ class WebHooks:
         start_args = self.printer.get_start_args()
         for sa in ['log_file', 'config_file', 'software_version', 'cpu_info']:
             response[sa] = start_args.get(sa)
+        response['encoding'] = encoding
+        response['encodings'] = list(ENCODINGS.keys())
         web_request.send(response)
 
     def _handle_estop_request(self, web_request):
@@ -414,13 +553,19 @@ class WebHooks:
                 "No active connections for method '%s'" % (method))
         self._remote_methods[method] = valid_conns
 
+# Output lines that are always sent as their own message
+SEPARATE_OUTPUT_PREFIXES = ("!! ", "// action:")
+OUTPUT_BUFFER_LIMIT = 262144
+
 class GCodeHelper:
     def __init__(self, printer):
         self.printer = printer
+        self.reactor = printer.get_reactor()
         self.gcode = printer.lookup_object("gcode")
         # Output subscription tracking
         self.is_output_registered = False
         self.clients = {}
+        self.pending_output = []
         # Register webhooks
         wh = printer.lookup_object('webhooks')
         wh.register_endpoint("gcode/help", self._handle_help)
@@ -430,6 +575,7 @@ class GCodeHelper:
                              self._handle_firmware_restart)
         wh.register_endpoint("gcode/subscribe_output",
                              self._handle_subscribe_output)
+        wh.register_flush_callback(self._flush_output)
     def _handle_help(self, web_request):
         web_request.send(self.gcode.get_command_help())
     def _handle_script(self, web_request):
@@ -439,17 +585,63 @@ class GCodeHelper:
     def _handle_firmware_restart(self, web_request):
         self.gcode.run_script('firmware_restart')
     def _output_callback(self, msg):
-        for cconn, template in list(self.clients.items()):
+        # Output is buffered and sent once per reactor tick
+        if not self.pending_output:
+            self.reactor.register_callback(self._flush_output)
+        self.pending_output.append(msg)
+    def _flush_output(self, eventtime=None):
+        lines = self.pending_output
+        if not lines:
+            return
+        self.pending_output = []
+        # Join consecutive lines into multi-line messages
+        msgs = []
+        group = []
+        for line in lines:
+            if line.startswith(SEPARATE_OUTPUT_PREFIXES):
+                if group:
+                    msgs.append("\n".join(group))
+                    group = []
+                msgs.append(line)
+            else:
+                group.append(line)
+        if group:
+            msgs.append("\n".join(group))
+        jmsgs = [json.dumps(msg).encode() + b"}}" for msg in msgs]
+        for cconn, client in list(self.clients.items()):
             if cconn.is_closed():
                 del self.clients[cconn]
                 continue
-            tmp = dict(template)
-            tmp['params'] = {'response': msg}
-            cconn.send(tmp)
+            prefix, dropped, template = client
+            if cconn.get_send_buffer_size() > OUTPUT_BUFFER_LIMIT:
+                # Client is not keeping up - drop output
+                client[1] = dropped + len(lines)
+                continue
+            summary = None
+            if dropped:
+                client[1] = 0
+                summary = ("// webhooks: %d output lines dropped"
+                           " (client not reading)" % (dropped,))
+            if cconn.get_encoding() != "json":
+                for msg in ([summary] if summary else []) + msgs:
+                    tmp = dict(template)
+                    tmp['params'] = {'response': msg}
+                    cconn.send(tmp)
+                continue
+            out = [prefix + jmsg for jmsg in jmsgs]
+            if summary is not None:
+                out.insert(0, prefix + json.dumps(summary).encode() + b"}}")
+            cconn.send_encoded(b"\x03".join(out))
     def _handle_subscribe_output(self, web_request):
         cconn = web_request.get_client_connection()
-        template = web_request.get_dict('response_template', {})
-        self.clients[cconn] = template
+        template = dict(web_request.get_dict('response_template', {}))
+        template.pop('params', None)
+        # Encode the template once - messages are appended to it
+        prefix = json.dumps(template, separators=(',', ':'))[:-1]
+        if template:
+            prefix += ','
+        prefix += '"params":{"response":'
+        self.clients[cconn] = [prefix.encode(), 0, template]
         if not self.is_output_registered:
             self.gcode.register_output_handler(self._output_callback)
             self.is_output_registered = True
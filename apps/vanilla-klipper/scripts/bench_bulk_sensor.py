@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# Benchmark host side processing of sensor_bulk_data messages
+#
+# Copyright (C) 2026  Rinkhals contributors
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, time, struct, random
+sys.path.append(os.path.join(os.path.dirname(__file__), '../klippy'))
+from extras import bulk_sensor
+
+# Minimal stand-in for the mcu object used by FixedFreqReader
+class BenchMCU:
+    def __init__(self, rate):
+        self.rate = rate
+        self.handlers = {}
+        self.sequence = 0
+        self.clock = 0
+    def register_response(self, cb, msg_name, oid=None):
+        self.handlers[(msg_name, oid)] = cb
+    def lookup_query_command(self, msgformat, respformat, oid=None, cq=None):
+        return self
+    def send(self, data):
+        return {'clock': self.clock & 0xffffffff, 'query_ticks': 100,
+                'next_sequence': self.sequence & 0xffff, 'buffered': 0,
+                'possible_overflows': 0}
+    def clock32_to_clock64(self, clock32):
+        return self.clock
+    def clock_to_print_time(self, clock):
+        return clock / 1000000.
+    def seconds_to_clock(self, t):
+        return int(t * 1000000.)
+    def feed(self, msgs):
+        cb = self.handlers[('sensor_bulk_data', 0)]
+        for data in msgs:
+            cb({'oid': 0, 'sequence': self.sequence & 0xffff, 'data': data})
+            self.sequence += 1
+        self.clock += int(len(msgs) * 1000000. / self.rate)
+
+# The original list based queue and per-sample unpack loop
+class LegacyFixedFreqReader(bulk_sensor.FixedFreqReader):
+    def setup_query_command(self, msgformat, oid, cq):
+        bulk_sensor.FixedFreqReader.setup_query_command(self, msgformat,
+                                                        oid, cq)
+        self.bulk_queue = bulk_sensor.BulkDataQueue(self.mcu, oid=oid)
+        self.bulk_queue.get_overflows = (lambda: 0)
+    def pull_samples(self):
+        self._update_clock()
+        raw_samples = self.bulk_queue.pull_queue()
+        if not raw_samples:
+            return []
+        last_sequence = self.last_sequence
+        time_base, chip_base, inv_freq = self.clock_sync.get_time_translation()
+        unpack_from = struct.Struct(self.unpack_fmt).unpack_from
+        bytes_per_sample = self.bytes_per_sample
+        samples_per_block = self.samples_per_block
+        count = seq = 0
+        samples = [None] * (len(raw_samples) * samples_per_block)
+        for params in raw_samples:
+            seq_diff = (params['sequence'] - last_sequence) & 0xffff
+            seq_diff -= (seq_diff & 0x8000) << 1
+            seq = last_sequence + seq_diff
+            msg_cdiff = seq * samples_per_block - chip_base
+            data = params['data']
+            for i in range(len(data) // bytes_per_sample):
+                ptime = time_base + (msg_cdiff + i) * inv_freq
+                udata = unpack_from(data, i * bytes_per_sample)
+                samples[count] = (ptime,) + udata
+                count += 1
+        self.clock_sync.set_last_chip_clock(seq * samples_per_block + i)
+        del samples[count:]
+        return samples
+
+def make_messages(ffreader, count):
+    block = ffreader.samples_per_block * ffreader.bytes_per_sample
+    return [bytes(random.getrandbits(8) for i in range(block))
+            for j in range(count)]
+
+def setup_reader(reader_class, unpack_fmt, sample_rate):
+    ffreader = reader_class(None, 1000, unpack_fmt)
+    ffreader.unpack_fmt = unpack_fmt
+    mcu = BenchMCU(sample_rate / float(ffreader.samples_per_block))
+    ffreader.mcu = ffreader.clock_sync.mcu = mcu
+    ffreader.setup_query_command("", 0, None)
+    ffreader.note_start()
+    return ffreader, mcu
+
+def run_bench(unpack_fmt, sample_rate, seconds, batch_interval):
+    tests = [('legacy_tuples', LegacyFixedFreqReader, 'pull_samples'),
+             ('ring_tuples', bulk_sensor.FixedFreqReader, 'pull_samples')]
+    results = []
+    overflows = 0
+    for name, reader_class, method in tests:
+        ffreader, mcu = setup_reader(reader_class, unpack_fmt, sample_rate)
+        pull = getattr(ffreader, method)
+        msgs = make_messages(ffreader, int(mcu.rate * batch_interval))
+        batches = int(seconds / batch_interval)
+        start = time.process_time()
+        for b in range(batches):
+            # Message delivery (normally on the serial thread) is included
+            mcu.feed(msgs)
+            pull()
+        results.append((name, time.process_time() - start))
+        overflows += ffreader.get_last_overflows()
+    total = sample_rate * seconds
+    print("format=%s rate=%dHz duration=%.1fs overflows=%d"
+          % (unpack_fmt, sample_rate, seconds, overflows))
+    for name, t in results:
+        print("  %-14s %8.3fs cpu  %10.0f samples/s  %5.2f%% of a core"
+              % (name, t, total / t, 100. * t / seconds))
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-r", "--rate", type="int", dest="rate", default=3200,
+                    help="sensor sample rate in Hz")
+    opts.add_option("-s", "--seconds", type="float", dest="seconds",
+                    default=60., help="simulated measurement duration")
+    opts.add_option("-f", "--formats", type="string", dest="formats",
+                    default="BBBBB,<hhh,>I,<i",
+                    help="comma separated struct formats to test")
+    options, args = opts.parse_args()
+    if args:
+        opts.error("Incorrect number of arguments")
+    for fmt in options.formats.split(','):
+        run_bench(fmt, options.rate, options.seconds,
+                  bulk_sensor.BATCH_INTERVAL)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# Benchmark eddy current scan processing using recorded ldc1612 data
+#
+# Copyright (C) 2026  Rinkhals contributors
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, time, bisect, math, random
+sys.path.append(os.path.join(os.path.dirname(__file__), '../klippy'))
+from extras import probe_eddy_current
+
+BATCH_UPDATES = 0.100
+OUT_OF_RANGE = probe_eddy_current.OUT_OF_RANGE
+
+# Load "time,frequency[,z]" samples (lines starting with '#' are ignored)
+def load_samples(filename):
+    samples = []
+    f = open(filename, 'r')
+    for line in f:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parts = line.split(',')
+        samples.append((float(parts[0]), float(parts[1]), 999.9))
+    f.close()
+    return samples
+
+# Generate samples of a sensor passing over a slightly warped bed
+def generate_samples(data_rate, duration):
+    random.seed(0)
+    samples = []
+    for i in range(int(data_rate * duration)):
+        t = i / float(data_rate)
+        height = 1.0 + .2 * math.sin(t * 3.) + random.gauss(0., .002)
+        freq = 3200000. + 40000. / (height + .5)
+        samples.append((t, round(freq, 3), 999.9))
+    return samples
+
+# Group samples into messages as produced by ldc1612._process_batch()
+def make_messages(samples):
+    msgs = []
+    data = []
+    next_time = samples[0][0] + BATCH_UPDATES
+    for s in samples:
+        if s[0] >= next_time:
+            msgs.append({'data': data})
+            data = []
+            next_time += BATCH_UPDATES
+        data.append(s)
+    if data:
+        msgs.append({'data': data})
+    return msgs
+
+def make_calibration(samples, cal_class):
+    freqs = [s[1] for s in samples]
+    min_freq, max_freq = min(freqs) - 1000., max(freqs) + 1000.
+    cal = []
+    for i in range(101):
+        z = i * 0.040
+        freq = max_freq - (max_freq - min_freq) * math.sqrt(z / 4.)
+        cal.append((z, freq))
+    calibration = cal_class.__new__(cal_class)
+    calibration.drift_comp = probe_eddy_current.DummyDriftCompensation()
+    calibration.load_calibration(cal)
+    return calibration
+
+# The original per-sample conversion and per-window averaging
+class LegacyEddyCalibration(probe_eddy_current.EddyCalibration):
+    def freq_to_height(self, freq):
+        adj_freq = self.drift_comp.adjust_freq(freq, 0.)
+        pos = bisect.bisect(self.cal_freqs, adj_freq)
+        if pos >= len(self.cal_zpos):
+            zpos = -OUT_OF_RANGE
+        elif pos == 0:
+            zpos = OUT_OF_RANGE
+        else:
+            this_freq = self.cal_freqs[pos]
+            prev_freq = self.cal_freqs[pos - 1]
+            this_zpos = self.cal_zpos[pos]
+            prev_zpos = self.cal_zpos[pos - 1]
+            gain = (this_zpos - prev_zpos) / (this_freq - prev_freq)
+            offset = prev_zpos - prev_freq * gain
+            zpos = adj_freq * gain + offset
+        return round(zpos, 6)
+
+class LegacyEddyGatherSamples(probe_eddy_current.EddyGatherSamples):
+    def _pull_freq(self, start_time, end_time):
+        msg_num = discard_msgs = 0
+        samp_sum = 0.
+        samp_count = 0
+        while msg_num < len(self._samples):
+            msg = self._samples[msg_num]
+            msg_num += 1
+            data = msg['data']
+            if data[0][0] > end_time:
+                break
+            if data[-1][0] < start_time:
+                discard_msgs = msg_num
+                continue
+            for time, freq, z in data:
+                if time >= start_time and time <= end_time:
+                    samp_sum += freq
+                    samp_count += 1
+        del self._samples[:discard_msgs]
+        if not samp_count:
+            return 0.
+        return samp_sum / samp_count
+    def _lookup_toolhead_pos(self, pos_time):
+        toolhead = self._printer.lookup_object('toolhead')
+        kin = toolhead.get_kinematics()
+        kin_spos = {s.get_name(): s.mcu_to_commanded_position(
+                                      s.get_past_mcu_position(pos_time))
+                    for s in kin.get_steppers()}
+        return kin.calc_position(kin_spos)
+    def _check_samples(self):
+        while self._samples and self._probe_times:
+            start_time, end_time, pos_time, toolhead_pos = self._probe_times[0]
+            if self._samples[-1]['data'][-1][0] < end_time:
+                break
+            freq = self._pull_freq(start_time, end_time)
+            if pos_time is not None:
+                toolhead_pos = self._lookup_toolhead_pos(pos_time)
+            sensor_z = None
+            if freq:
+                sensor_z = self._calibration.freq_to_height(freq)
+            self._probe_results.append((sensor_z, toolhead_pos))
+            self._probe_times.pop(0)
+
+# Minimal stand-ins for the printer objects used during a rapid scan
+class BenchStepper:
+    def __init__(self, name):
+        self.name = name
+    def get_name(self):
+        return self.name
+    def get_past_mcu_position(self, print_time):
+        return int(print_time * 1000.)
+    def mcu_to_commanded_position(self, mcu_pos):
+        return mcu_pos * .0125
+class BenchKinematics:
+    def __init__(self):
+        self.steppers = [BenchStepper(n) for n in "xyz"]
+    def get_steppers(self):
+        return self.steppers
+    def calc_position(self, stepper_positions):
+        return [stepper_positions[n] for n in "xyz"]
+class BenchPrinter:
+    command_error = Exception
+    def __init__(self):
+        self.kin = BenchKinematics()
+    def lookup_object(self, name):
+        return self
+    def get_kinematics(self):
+        return self.kin
+class BenchSensor:
+    def add_client(self, cb):
+        pass
+
+def run_scan(gather_class, cal_class, samples, msgs, points, sample_time):
+    calibration = make_calibration(samples, cal_class)
+    gather = gather_class(BenchPrinter(), BenchSensor(), calibration, 1.)
+    start, end = samples[0][0], samples[-1][0] - sample_time
+    for i in range(points):
+        st = start + (end - start) * i / float(points)
+        gather.note_probe_and_position(st, st + sample_time,
+                                       st + sample_time / 2.)
+    curtime = time.process_time()
+    for msg in msgs:
+        gather._add_measurement(msg)
+    results = gather._probe_results
+    return time.process_time() - curtime, results
+
+def main():
+    usage = "%prog [options] [ldc1612_samples.csv]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-p", "--points", type="int", dest="points", default=5000,
+                    help="number of scan points")
+    opts.add_option("-t", "--sample-time", type="float", dest="sample_time",
+                    default=0.100, help="averaging window per point")
+    opts.add_option("-r", "--rate", type="int", dest="rate", default=250,
+                    help="data rate of generated samples")
+    opts.add_option("-d", "--duration", type="float", dest="duration",
+                    default=120., help="duration of generated samples")
+    options, args = opts.parse_args()
+    if len(args) > 1:
+        opts.error("Incorrect number of arguments")
+    if args:
+        samples = load_samples(args[0])
+        source = args[0]
+    else:
+        samples = generate_samples(options.rate, options.duration)
+        source = "generated"
+    msgs = make_messages(samples)
+    print("source=%s samples=%d messages=%d points=%d" % (
+        source, len(samples), len(msgs), options.points))
+    tests = [
+        ('legacy', LegacyEddyGatherSamples, LegacyEddyCalibration),
+        ('batched', probe_eddy_current.EddyGatherSamples,
+         probe_eddy_current.EddyCalibration)]
+    all_results = []
+    for name, gather_class, cal_class in tests:
+        t, results = run_scan(gather_class, cal_class, samples, msgs,
+                              options.points, options.sample_time)
+        all_results.append(results)
+        print("  %-8s %8.3fs cpu  %10.0f points/s" % (
+            name, t, options.points / t))
+    max_diff = max([abs(a[0] - b[0]) for a, b in zip(*all_results)
+                    if a[0] is not None and b[0] is not None] + [0.])
+    print("  max height difference: %.6f" % (max_diff,))
+
+if __name__ == '__main__':
+    main()
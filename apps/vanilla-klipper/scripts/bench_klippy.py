@@ -0,0 +1,450 @@
+#!/usr/bin/env python
+# Measure klippy host throughput by replaying gcode in file output mode
+#
+# Copyright (C) 2026  Rinkhals contributors
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, tempfile, time, math, json, gc, logging, re
+sys.path.append(os.path.join(os.path.dirname(__file__), '../klippy'))
+import util, reactor, msgproto, klippy
+
+LATENCY_INTERVAL = 0.005
+
+
+######################################################################
+# Synthetic corpus
+######################################################################
+
+CONFIG_TEMPLATE = """
+[stepper_x]
+step_pin: {0}
+dir_pin: {1}
+enable_pin: !{2}
+microsteps: 16
+rotation_distance: 40
+endstop_pin: ^{3}
+position_endstop: 0
+position_max: 300
+homing_speed: 50
+
+[stepper_y]
+step_pin: {4}
+dir_pin: {5}
+enable_pin: !{6}
+microsteps: 16
+rotation_distance: 40
+endstop_pin: ^{7}
+position_endstop: 0
+position_max: 300
+homing_speed: 50
+
+[stepper_z]
+step_pin: {8}
+dir_pin: {9}
+enable_pin: !{10}
+microsteps: 16
+rotation_distance: 8
+endstop_pin: ^{11}
+position_endstop: 0.5
+position_max: 250
+
+[extruder]
+step_pin: {12}
+dir_pin: {13}
+enable_pin: !{14}
+microsteps: 16
+rotation_distance: 33.5
+nozzle_diameter: 0.400
+filament_diameter: 1.750
+max_extrude_cross_section: 5
+heater_pin: {15}
+sensor_type: AD595
+sensor_pin: {16}
+control: watermark
+min_temp: 0
+max_temp: 250
+min_extrude_temp: 0
+
+[gcode_arcs]
+resolution: 0.5
+
+[input_shaper]
+
+[bed_mesh]
+mesh_min: 10, 10
+mesh_max: 290, 290
+probe_count: 7, 7
+mesh_pps: 2, 2
+algorithm: bicubic
+
+[bed_mesh default]
+version: 1
+points:
+{17}
+x_count: 7
+y_count: 7
+mesh_x_pps: 2
+mesh_y_pps: 2
+algo: bicubic
+tension: 0.2
+min_x: 10.0
+max_x: 290.0
+min_y: 10.0
+max_y: 290.0
+
+[mcu]
+serial: /dev/null
+
+[printer]
+kinematics: cartesian
+max_velocity: 500
+max_accel: 10000
+max_z_velocity: 20
+max_z_accel: 500
+"""
+
+# Obtain the list of usable pin names from the mcu data dictionary
+def get_pins(dict_fname):
+    with open(dict_fname, 'rb') as f:
+        dict_data = f.read()
+    msgparser = msgproto.MessageParser()
+    msgparser.process_identify(dict_data, decompress=False)
+    reserved = set()
+    for name, value in msgparser.get_constants().items():
+        if name.startswith("RESERVE_PINS_"):
+            reserved.update(value.split(','))
+    pins = msgparser.get_enumerations().get('pin', {})
+    return [p for p, v in sorted(pins.items(), key=lambda i: i[1])
+            if p not in reserved]
+
+def make_config(pins):
+    if len(pins) < 17:
+        raise Exception("Data dictionary only has %d pins (17 needed)"
+                        % (len(pins),))
+    rows = []
+    for y in range(7):
+        rows.append("  " + ", ".join(
+            ["%.4f" % (.05 * math.sin(x * .9) + .03 * math.cos(y * 1.3),)
+             for x in range(7)]))
+    return CONFIG_TEMPLATE.format(*(pins[:17] + ["\n".join(rows)]))
+
+GCODE_HEADER = ["G28", "G90", "M83", "G1 Z0.3 F3000"]
+
+# Full and partial circles using G2/G3 arc moves
+def make_arcs(scale):
+    out = list(GCODE_HEADER)
+    for layer in range(10 * scale):
+        out.append("G1 Z%.2f F3000" % (.3 + .2 * layer,))
+        for ring in range(10):
+            radius = 10. + 10. * ring
+            out.append("G1 X%.3f Y150 F12000" % (150. - radius,))
+            out.append("G2 X%.3f Y150 I%.3f J0 E%.4f F6000" % (
+                150. + radius, radius, math.pi * radius * .04))
+            out.append("G3 X%.3f Y150 I%.3f J0 E%.4f" % (
+                150. - radius, -radius, math.pi * radius * .04))
+    return out
+
+# Finely tessellated curves (many very short moves)
+def make_dense_curves(scale):
+    out = list(GCODE_HEADER)
+    for layer in range(10 * scale):
+        out.append("G1 Z%.2f F3000" % (.3 + .2 * layer,))
+        for i in range(2000):
+            t = i / 2000. * 2. * math.pi
+            r = 80. + 20. * math.sin(7. * t)
+            out.append("G1 X%.3f Y%.3f E%.5f F9000" % (
+                150. + r * math.cos(t), 150. + r * math.sin(t), .01))
+    return out
+
+# Long infill moves that are split up by the bed mesh
+def make_mesh(scale):
+    out = list(GCODE_HEADER) + ["BED_MESH_PROFILE LOAD=default"]
+    for layer in range(5 * scale):
+        out.append("G1 Z%.2f F3000" % (.3 + .2 * layer,))
+        for i in range(70):
+            y = 15. + 4. * i
+            if i & 1:
+                out.append("G1 X15 Y%.1f E%.4f F15000" % (y, 270 * .04))
+            else:
+                out.append("G1 X285 Y%.1f E%.4f F15000" % (y, 270 * .04))
+            out.append("G1 Y%.1f F15000" % (y + 2.,))
+    return out
+
+# Perimeters with sharp corners while input shaping is enabled
+def make_input_shaper(scale):
+    out = list(GCODE_HEADER) + [
+        "SET_INPUT_SHAPER SHAPER_FREQ_X=50 SHAPER_FREQ_Y=40 SHAPER_TYPE=mzv"]
+    for layer in range(10 * scale):
+        out.append("G1 Z%.2f F3000" % (.3 + .2 * layer,))
+        for size in range(5, 100, 5):
+            lo, hi = 150. - size, 150. + size
+            for x, y in [(lo, lo), (hi, lo), (hi, hi), (lo, hi), (lo, lo)]:
+                out.append("G1 X%.1f Y%.1f E%.4f F12000" % (
+                    x, y, size * .08))
+    return out
+
+SYNTHETIC_CORPUS = [
+    ("arcs", make_arcs), ("dense_curves", make_dense_curves),
+    ("mesh", make_mesh), ("input_shaper", make_input_shaper),
+]
+
+
+######################################################################
+# Gcode motion statistics
+######################################################################
+
+gcode_r = re.compile(r'([A-Z])([-+]?[0-9.]+)')
+
+# Count motion commands and toolhead travel distance in a gcode file
+def calc_gcode_stats(gcode_fname):
+    pos = [0., 0., 0.]
+    absolute = True
+    moves = 0
+    distance = 0.
+    with open(gcode_fname, 'r') as f:
+        for line in f:
+            line = line.split(';', 1)[0].strip().upper()
+            if not line:
+                continue
+            cmd = line.split(None, 1)[0]
+            params = dict((k, float(v))
+                          for k, v in gcode_r.findall(line[len(cmd):]))
+            if cmd == 'G90':
+                absolute = True
+            elif cmd == 'G91':
+                absolute = False
+            elif cmd == 'G28':
+                pos = [0., 0., 0.]
+            elif cmd == 'G92':
+                for i, axis in enumerate('XYZ'):
+                    if axis in params:
+                        pos[i] = params[axis]
+            elif cmd in ('G0', 'G1', 'G2', 'G3'):
+                moves += 1
+                newpos = list(pos)
+                for i, axis in enumerate('XYZ'):
+                    if axis in params:
+                        newpos[i] = (params[axis] if absolute
+                                     else pos[i] + params[axis])
+                if cmd in ('G2', 'G3'):
+                    distance += calc_arc_length(
+                        pos, newpos, params.get('I', 0.),
+                        params.get('J', 0.), cmd == 'G2')
+                else:
+                    distance += math.sqrt(sum([(n - p)**2
+                                               for n, p in zip(newpos, pos)]))
+                pos = newpos
+    return moves, distance
+
+def calc_arc_length(start, end, i, j, clockwise):
+    cx, cy = start[0] + i, start[1] + j
+    radius = math.sqrt(i**2 + j**2)
+    start_angle = math.atan2(start[1] - cy, start[0] - cx)
+    end_angle = math.atan2(end[1] - cy, end[0] - cx)
+    if clockwise:
+        sweep = (start_angle - end_angle) % (2. * math.pi)
+    else:
+        sweep = (end_angle - start_angle) % (2. * math.pi)
+    if not sweep:
+        sweep = 2. * math.pi
+    return math.sqrt((radius * sweep)**2 + (end[2] - start[2])**2)
+
+
+######################################################################
+# Klippy runner
+######################################################################
+
+# Periodic timer that records how late the reactor runs it
+class LatencyProbe:
+    def __init__(self, printer):
+        self.printer = printer
+        self.reactor = printer.get_reactor()
+        self.samples = []
+        self.waketime = None
+        printer.register_event_handler("klippy:ready", self._handle_ready)
+    def _handle_ready(self):
+        self.waketime = self.reactor.monotonic()
+        self.reactor.register_timer(self._probe, self.waketime)
+    def _probe(self, eventtime):
+        self.samples.append(self.reactor.monotonic() - self.waketime)
+        self.waketime = eventtime + LATENCY_INTERVAL
+        return self.waketime
+    def get_percentiles(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return {}
+        def pct(p):
+            return 1000. * samples[min(len(samples) - 1,
+                                       int(p * len(samples)))]
+        return {'p50': pct(.50), 'p90': pct(.90), 'p99': pct(.99),
+                'max': 1000. * samples[-1], 'samples': len(samples)}
+
+# Run a full klippy instance (in this process) on a gcode file
+def run_klippy(cfg_fname, gcode_fname, dict_fname, out_fname, log_fname):
+    handler = logging.FileHandler(log_fname, mode='w')
+    root_logger = logging.getLogger()
+    root_logger.addHandler(handler)
+    root_logger.setLevel(logging.INFO)
+    gcode_file = open(gcode_fname, 'rb')
+    start_args = {'config_file': cfg_fname, 'start_reason': 'startup',
+                  'debuginput': gcode_fname,
+                  'gcode_fd': gcode_file.fileno(),
+                  'debugoutput': out_fname, 'dictionary': dict_fname,
+                  'software_version': 'bench', 'cpu_info': 'bench'}
+    try:
+        gc.collect()
+        gc.disable()
+        main_reactor = reactor.Reactor(gc_checking=True)
+        printer = klippy.Printer(main_reactor, None, start_args)
+        probe = LatencyProbe(printer)
+        start_times = []
+        def note_start():
+            start_times.append((time.time(), time.process_time()))
+        printer.register_event_handler("klippy:ready", note_start)
+        res = printer.run()
+        end_wall, end_cpu = time.time(), time.process_time()
+        main_reactor.finalize()
+    finally:
+        gc.enable()
+        gcode_file.close()
+        root_logger.removeHandler(handler)
+        handler.close()
+    if res != 'exit' or not start_times:
+        raise Exception("klippy failed (see %s)" % (log_fname,))
+    start_wall, start_cpu = start_times[0]
+    toolhead = printer.lookup_object('toolhead')
+    return {'wall_s': end_wall - start_wall, 'cpu_s': end_cpu - start_cpu,
+            'print_time_s': toolhead.get_status(0.)['print_time'],
+            'latency_ms': probe.get_percentiles()}
+
+def run_case(name, cfg_fname, gcode_fname, dict_fname, tmpdir, repeat):
+    moves, distance = calc_gcode_stats(gcode_fname)
+    out_fname = os.path.join(tmpdir, name + ".serial")
+    log_fname = os.path.join(tmpdir, name + ".log")
+    best = None
+    for i in range(repeat):
+        res = run_klippy(cfg_fname, gcode_fname, dict_fname,
+                         out_fname, log_fname)
+        if best is None or res['cpu_s'] < best['cpu_s']:
+            best = res
+    best.update({
+        'moves': moves, 'distance_mm': distance,
+        'moves_per_s': moves / best['wall_s'],
+        'cpu_us_per_mm': 1000000. * best['cpu_s'] / max(distance, 1.)})
+    return best
+
+
+######################################################################
+# Reporting
+######################################################################
+
+def print_result(name, res):
+    lat = res['latency_ms']
+    print("%-16s %7d moves %9.0f mm %7.3fs cpu %9.0f moves/s"
+          " %7.2f us/mm  latency p50=%.2f p90=%.2f p99=%.2f max=%.2fms"
+          % (name, res['moves'], res['distance_mm'], res['cpu_s'],
+             res['moves_per_s'], res['cpu_us_per_mm'], lat.get('p50', 0.),
+             lat.get('p90', 0.), lat.get('p99', 0.), lat.get('max', 0.)))
+
+# Compare results against a baseline and return the list of regressions
+def compare_results(results, baseline, threshold):
+    regressions = []
+    base_cases = baseline.get('cases', {})
+    print("Comparison with baseline (threshold %.0f%%):" % (threshold,))
+    for name, res in sorted(results['cases'].items()):
+        base = base_cases.get(name)
+        if base is None:
+            print("  %-16s (not in baseline)" % (name,))
+            continue
+        changes = [
+            ("moves/s", res['moves_per_s'], base['moves_per_s'], True),
+            ("us/mm", res['cpu_us_per_mm'], base['cpu_us_per_mm'], False),
+            ("p99 latency", res['latency_ms'].get('p99', 0.),
+             base['latency_ms'].get('p99', 0.), False)]
+        msgs = []
+        for label, new, old, higher_is_better in changes:
+            if not old:
+                continue
+            pct = 100. * (new - old) / old
+            worse = -pct if higher_is_better else pct
+            flag = ""
+            if worse > threshold:
+                flag = " REGRESSION"
+                regressions.append((name, label, pct))
+            msgs.append("%s %+.1f%%%s" % (label, pct, flag))
+        print("  %-16s %s" % (name, ", ".join(msgs)))
+    return regressions
+
+def main():
+    usage = "%prog [options] <mcu data dictionary> [gcode files or dirs]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-c", "--config", type="string", dest="config",
+                    help="printer config to use (default is generated)")
+    opts.add_option("-o", "--output", type="string", dest="output",
+                    help="write json results to this file")
+    opts.add_option("-b", "--baseline", type="string", dest="baseline",
+                    help="json results to compare against")
+    opts.add_option("-t", "--threshold", type="float", dest="threshold",
+                    default=10., help="regression threshold in percent")
+    opts.add_option("-r", "--repeat", type="int", dest="repeat", default=3,
+                    help="runs per gcode file (best cpu time is reported)")
+    opts.add_option("-s", "--scale", type="int", dest="scale", default=1,
+                    help="size multiplier for the synthetic corpus")
+    opts.add_option("-k", "--keep", action="store_true", dest="keep",
+                    help="keep temporary files (logs and mcu output)")
+    options, args = opts.parse_args()
+    if len(args) < 1:
+        opts.error("Incorrect number of arguments")
+    dict_fname = os.path.abspath(args[0])
+    tmpdir = tempfile.mkdtemp(prefix="bench_klippy-")
+    # Setup config
+    cfg_fname = options.config
+    if cfg_fname is None:
+        cfg_fname = os.path.join(tmpdir, "printer.cfg")
+        with open(cfg_fname, 'w') as f:
+            f.write(make_config(get_pins(dict_fname)))
+    cfg_fname = os.path.abspath(cfg_fname)
+    # Setup gcode corpus
+    corpus = []
+    for arg in args[1:]:
+        if os.path.isdir(arg):
+            corpus.extend(sorted([os.path.join(arg, f)
+                                  for f in os.listdir(arg)
+                                  if f.endswith('.gcode')]))
+        else:
+            corpus.append(arg)
+    corpus = [(os.path.splitext(os.path.basename(f))[0], os.path.abspath(f))
+              for f in corpus]
+    if not corpus:
+        for name, func in SYNTHETIC_CORPUS:
+            fname = os.path.join(tmpdir, name + ".gcode")
+            with open(fname, 'w') as f:
+                f.write("\n".join(func(options.scale)) + "\n")
+            corpus.append((name, fname))
+    # Run benchmarks
+    results = {'version': 1, 'time': time.time(),
+               'python': sys.version.split()[0],
+               'cpu_count': os.cpu_count(), 'cpu_info': util.get_cpu_info(),
+               'repeat': options.repeat, 'cases': {}}
+    for name, gcode_fname in corpus:
+        res = run_case(name, cfg_fname, gcode_fname, dict_fname, tmpdir,
+                       options.repeat)
+        results['cases'][name] = res
+        print_result(name, res)
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if options.keep:
+        print("Temporary files kept in %s" % (tmpdir,))
+    else:
+        for fname in os.listdir(tmpdir):
+            os.unlink(os.path.join(tmpdir, fname))
+        os.rmdir(tmpdir)
+    if options.baseline:
+        with open(options.baseline, 'r') as f:
+            baseline = json.load(f)
+        if compare_results(results, baseline, options.threshold):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# Benchmark serial and threaded step generation using klippy file output
+#
+# Copyright (C) 2026  Rinkhals contributors
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, subprocess, tempfile, time, resource, math
+import collections
+sys.path.append(os.path.join(os.path.dirname(__file__), '../klippy'))
+import msgproto
+
+KLIPPY = os.path.join(os.path.dirname(__file__), '../klippy/klippy.py')
+
+STEPPER_CONFIG = """
+[%s]
+step_pin: %s
+dir_pin: %s
+enable_pin: !%s
+microsteps: %d
+rotation_distance: %s
+"""
+
+RAIL_CONFIG = """endstop_pin: ^%s
+position_endstop: 0
+position_max: 300
+homing_speed: 50
+"""
+
+PRINTER_CONFIG = """
+[extruder]
+step_pin: %s
+dir_pin: %s
+enable_pin: !%s
+microsteps: %d
+rotation_distance: 33.5
+nozzle_diameter: 0.400
+filament_diameter: 1.750
+max_extrude_only_distance: 1000
+heater_pin: %s
+sensor_type: AD595
+sensor_pin: %s
+control: watermark
+min_temp: 0
+max_temp: 250
+min_extrude_temp: 0
+
+[mcu]
+serial: /dev/null
+
+[printer]
+kinematics: cartesian
+max_velocity: 500
+max_accel: 10000
+max_z_velocity: 50
+max_z_accel: 1000
+step_generation_threads: %d
+"""
+
+def load_msgparser(dict_fname):
+    with open(dict_fname, 'rb') as f:
+        dict_data = f.read()
+    msgparser = msgproto.MessageParser()
+    msgparser.process_identify(dict_data, decompress=False)
+    return msgparser
+
+# Obtain the list of usable pin names from the mcu data dictionary
+def get_pins(msgparser):
+    reserved = set()
+    for name, value in msgparser.get_constants().items():
+        if name.startswith("RESERVE_PINS_"):
+            reserved.update(value.split(','))
+    pins = msgparser.get_enumerations().get('pin', {})
+    return [p for p, v in sorted(pins.items(), key=lambda i: i[1])
+            if p not in reserved]
+
+# Extract the step related messages for each stepper from klippy output
+# (other messages, such as heater updates, depend on host timing)
+STEP_MSGS = ['queue_step', 'set_next_step_dir', 'reset_step_clock']
+def read_step_msgs(msgparser, out_fname):
+    with open(out_fname, 'rb') as f:
+        data = f.read()
+    steps = collections.defaultdict(list)
+    while data:
+        l = msgparser.check_packet(data)
+        if l <= 0:
+            break
+        for msg in msgparser.dump(data[:l])[1:]:
+            parts = msg.split()
+            if parts[0] in STEP_MSGS:
+                steps[parts[1]].append(msg)
+        data = data[l:]
+    return steps
+
+def make_config(pins, z_count, microsteps, threads):
+    pins = list(pins)
+    out = []
+    steppers = [('stepper_x', '40', True), ('stepper_y', '40', True),
+                ('stepper_z', '8', True)]
+    steppers += [('stepper_z%d' % (i,), '8', False)
+                 for i in range(1, z_count)]
+    for name, rotation_distance, has_endstop in steppers:
+        step, dpin, enable = pins.pop(0), pins.pop(0), pins.pop(0)
+        out.append(STEPPER_CONFIG % (name, step, dpin, enable, microsteps,
+                                     rotation_distance))
+        if has_endstop:
+            out.append(RAIL_CONFIG % (pins.pop(0),))
+    step, dpin, enable = pins.pop(0), pins.pop(0), pins.pop(0)
+    heater, sensor = pins.pop(0), pins.pop(0)
+    out.append(PRINTER_CONFIG % (step, dpin, enable, microsteps,
+                                 heater, sensor, threads))
+    return "".join(out)
+
+# Generate a spiral "vase" print that moves all axes at once
+def make_gcode(layers, segments):
+    out = ["G28", "G90", "M83", "G1 X150 Y150 Z1 F12000"]
+    radius, e_per_mm = 60., 0.05
+    seg_len = 2. * math.pi * radius / segments
+    for layer in range(layers):
+        for s in range(segments):
+            angle = 2. * math.pi * s / segments
+            z = 1. + .2 * (layer + float(s) / segments)
+            out.append("G1 X%.3f Y%.3f Z%.3f E%.5f F9000" % (
+                150. + radius * math.cos(angle),
+                150. + radius * math.sin(angle), z, seg_len * e_per_mm))
+    out.append("M400")
+    return "\n".join(out) + "\n"
+
+def run_klippy(tmpdir, dict_fname, pins, options, threads):
+    cfg_fname = os.path.join(tmpdir, "printer-%d.cfg" % (threads,))
+    with open(cfg_fname, 'w') as f:
+        f.write(make_config(pins, options.z_count, options.microsteps,
+                            threads))
+    out_fname = os.path.join(tmpdir, "output-%d.serial" % (threads,))
+    log_fname = os.path.join(tmpdir, "klippy-%d.log" % (threads,))
+    gcode_fname = os.path.join(tmpdir, "bench.gcode")
+    args = [sys.executable, KLIPPY, cfg_fname, "-i", gcode_fname,
+            "-o", out_fname, "-d", dict_fname, "-l", log_fname]
+    best = None
+    for i in range(options.repeat):
+        start_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start_time = time.time()
+        res = subprocess.call(args)
+        wall = time.time() - start_time
+        end_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        if res:
+            sys.stderr.write("klippy failed (see %s)\n" % (log_fname,))
+            sys.exit(-1)
+        cpu = (end_usage.ru_utime - start_usage.ru_utime
+               + end_usage.ru_stime - start_usage.ru_stime)
+        if best is None or wall < best[0]:
+            best = (wall, cpu)
+    return best, out_fname
+
+def main():
+    usage = "%prog [options] <mcu data dictionary>"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-t", "--threads", type="int", dest="threads", default=4,
+                    help="number of step generation threads")
+    opts.add_option("-z", "--z-count", type="int", dest="z_count", default=4,
+                    help="number of z steppers")
+    opts.add_option("-m", "--microsteps", type="int", dest="microsteps",
+                    default=64, help="stepper microsteps")
+    opts.add_option("-l", "--layers", type="int", dest="layers", default=50,
+                    help="number of spiral layers to print")
+    opts.add_option("-s", "--segments", type="int", dest="segments",
+                    default=200, help="moves per spiral layer")
+    opts.add_option("-r", "--repeat", type="int", dest="repeat", default=3,
+                    help="number of runs (best time is reported)")
+    options, args = opts.parse_args()
+    if len(args) != 1:
+        opts.error("Incorrect number of arguments")
+    dict_fname = args[0]
+    msgparser = load_msgparser(dict_fname)
+    pins = get_pins(msgparser)
+    needed = 4 * 3 + 3 * (options.z_count - 1) + 3 + 2
+    if len(pins) < needed:
+        opts.error("Data dictionary only has %d pins (%d needed)"
+                   % (len(pins), needed))
+    tmpdir = tempfile.mkdtemp(prefix="bench_stepgen-")
+    with open(os.path.join(tmpdir, "bench.gcode"), 'w') as f:
+        f.write(make_gcode(options.layers, options.segments))
+    print("steppers=%d microsteps=%d moves=%d output=%s" % (
+        3 + options.z_count, options.microsteps,
+        options.layers * options.segments, tmpdir))
+    (s_wall, s_cpu), s_out = run_klippy(tmpdir, dict_fname, pins, options, 0)
+    print("  serial      %7.3fs wall %7.3fs cpu" % (s_wall, s_cpu))
+    (p_wall, p_cpu), p_out = run_klippy(tmpdir, dict_fname, pins, options,
+                                        options.threads)
+    print("  %d threads   %7.3fs wall %7.3fs cpu  (%.2fx)" % (
+        options.threads, p_wall, p_cpu, s_wall / p_wall))
+    same = (read_step_msgs(msgparser, s_out)
+            == read_step_msgs(msgparser, p_out))
+    print("  step output %s" % ("identical" if same else "DIFFERS",))
+
+if __name__ == '__main__':
+    main()
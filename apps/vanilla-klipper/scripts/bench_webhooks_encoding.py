@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# Benchmark API server message encodings on typical webhooks payloads
+#
+# Copyright (C) 2026  Rinkhals contributors
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, time, math
+sys.path.append(os.path.join(os.path.dirname(__file__), '../klippy'))
+import webhooks
+
+# Subscription update sent by QueryStatusHelper while printing
+def make_status(count):
+    status = {}
+    for i in range(count):
+        status['extruder%s' % (i or '',)] = {
+            'temperature': 215.31 + i, 'target': 215., 'power': 0.4321,
+            'pressure_advance': 0.04, 'can_extrude': True}
+    status['toolhead'] = {
+        'position': [123.456, 87.654, 12.2, 2345.6789], 'print_time': 912.34,
+        'estimated_print_time': 910.12, 'max_velocity': 500.,
+        'max_accel': 10000., 'homed_axes': "xyz", 'stalls': 0}
+    status['gcode_move'] = {
+        'speed_factor': 1., 'extrude_factor': 1., 'speed': 9000.,
+        'gcode_position': [123.456, 87.654, 12.2, 2345.6789],
+        'position': [123.456, 87.654, 12.2, 2345.6789]}
+    status['virtual_sdcard'] = {
+        'file_position': 12345678, 'progress': 0.4567, 'is_active': True}
+    status['print_stats'] = {
+        'state': "printing", 'filename': "benchy.gcode",
+        'print_duration': 1234.5, 'filament_used': 2345.6789}
+    return {'id': 12345, 'result': {'eventtime': 1234.567,
+                                    'status': status}}
+
+# Bulk accelerometer batch sent by bulk_sensor.BatchBulkHelper
+def make_bulk(samples):
+    data = [[1234.5 + i * 0.0003125, 123.4 * math.sin(i * .1),
+             -234.5 * math.cos(i * .1), 9806.65 + i % 7]
+            for i in range(samples)]
+    return {'params': {'data': data, 'errors': 0, 'overflows': 0},
+            'key': "adxl345"}
+
+def time_calls(func, arg, count):
+    start = time.perf_counter()
+    for i in range(count):
+        func(arg)
+    return (time.perf_counter() - start) / count
+
+def bench_encoding(name, payload, count):
+    enc = webhooks.ENCODINGS[name]()
+    msg = enc.encode(payload)
+    dec = webhooks.ENCODINGS[name]()
+    def encode(data):
+        enc.encode(data)
+    def decode(data):
+        for req in dec.split_requests(data):
+            dec.decode(req)
+    if dec.decode(list(dec.split_requests(msg))[0]) != payload:
+        sys.stderr.write("%s: payload does not round-trip\n" % (name,))
+    return len(msg), time_calls(encode, payload, count), time_calls(
+        decode, msg, count)
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-n", "--count", type="int", dest="count", default=2000,
+                    help="number of encode/decode calls per payload")
+    opts.add_option("-e", "--extruders", type="int", dest="extruders",
+                    default=1, help="number of extruders in status payload")
+    opts.add_option("-s", "--samples", type="int", dest="samples",
+                    default=100, help="number of samples in bulk payload")
+    options, args = opts.parse_args()
+    if args:
+        opts.error("Incorrect number of arguments")
+    payloads = [("status", make_status(options.extruders)),
+                ("bulk", make_bulk(options.samples))]
+    if 'msgpack' not in webhooks.ENCODINGS:
+        print("msgpack module not available - only json is measured")
+    print("%-8s %-8s %8s %10s %10s" % (
+        "payload", "encoding", "bytes", "encode_us", "decode_us"))
+    for pname, payload in payloads:
+        for name in webhooks.ENCODINGS:
+            size, enc_time, dec_time = bench_encoding(name, payload,
+                                                      options.count)
+            print("%-8s %-8s %8d %10.1f %10.1f" % (
+                pname, name, size, enc_time * 1000000.,
+                dec_time * 1000000.))
+
+if __name__ == '__main__':
+    main()